@@ -0,0 +1,456 @@
+#class to accumulate summary statistics of simulation results,
+#which can be merged so each worker only sends back its statistics
+
+import json
+
+from collections import Counter
+
+import numpy as np
+
+#groups of simulations statistics are kept for, every
+#simulation and only those the party won
+GROUPS=['all','wins']
+
+#columns with few distinct values, whose exact value counts are
+#kept, so quantiles and histograms are exact
+COUNT_COLUMNS=['party_hp','party_extras','frac_party_hp','frac_party_extras',
+               'num_party_down','num_enemies_down','num_rounds','num_turns']
+
+#bins used in Evaluate_SimData.ipynb for the fraction of party hit
+#points lost (HP_cut) and of extras used (Ex_cut) in won encounters
+HP_BINS=np.linspace(-1/7,1+1/7,9)
+EXTRAS_BINS=np.linspace(-0.1,1.1,7)
+
+class SummaryAccumulator():
+    '''
+    class to accumulate statistics of simulation results without
+    keeping the results, accumulators for different simulations
+    can be merged, giving the same statistics as one accumulator
+    for all of them, kept separately for every simulation ('all')
+    and for the encounters the party won ('wins')
+
+    ...
+
+    Attributes
+    ----------
+    moments - dict
+        for each group, a dictionary with numeric column names as
+        keys and [count, mean, sum of squared differences from the
+        mean, min, max] lists as values
+    num_sims - int
+        number of simulations added
+    value_counts - dict
+        for each group, a dictionary with the COUNT_COLUMNS as keys
+        and Counter objects of the values of that column as values
+
+    Methods
+    -------
+    add(results)
+        method to add simulation results
+    from_dict(state)
+        class method to rebuild an accumulator from to_dict output
+    histogram(column,bins,group='wins',lost=False)
+        method to get the counts of a column in fixed bins
+    mean(column,group='all')
+        method to get the mean of a column
+    merge(other)
+        method to add the statistics of another accumulator
+    quantile(column,q,group='all')
+        method to get quantiles of a column
+    report()
+        method to get the main statistics as a dictionary
+    std(column,group='all')
+        method to get the standard deviation of a column
+    to_dict()
+        method to get the statistics as a JSON serializable dictionary
+    win_rate()
+        method to get the fraction of encounters the party won
+    '''
+
+    def __init__(self):
+        self.num_sims=0
+        self.moments={group:{} for group in GROUPS}
+        self.value_counts={group:{column:Counter() for column in COUNT_COLUMNS} \
+                           for group in GROUPS}
+
+    def add(self,results):
+        '''
+        method to add simulation results
+
+        Parameters
+        ----------
+        results - dict or list
+            a BatchEncounter summary dictionary (one entry per
+            encounter for each key), or a list of Encounter
+            summary dictionaries
+        '''
+
+        if not isinstance(results,dict):
+            results={key:[result[key] for result in results] \
+                     for key in results[0]} if results else {}
+
+        columns={key:np.asarray(values) for key,values in results.items() \
+                 if key!='CRs'}
+
+        if not columns:
+            return
+
+        wins=columns['success'].astype(bool)
+
+        self.num_sims+=len(wins)
+
+        for group,mask in [('all',None),('wins',wins)]:
+            for key,values in columns.items():
+                values=values if mask is None else values[mask]
+
+                if len(values):
+                    self._add_moments(group,key,values.astype(float))
+
+                if key in COUNT_COLUMNS:
+                    self.value_counts[group][key].update(values.tolist())
+
+    def _add_moments(self,group,key,values):
+        '''
+        method to merge the moments of an array of values
+        into those of a column
+        '''
+
+        mean=values.mean()
+
+        self._merge_moments(group,key,[len(values),mean,
+                                       float(((values-mean)**2).sum()),
+                                       values.min(),values.max()])
+
+    def _merge_moments(self,group,key,other):
+        '''
+        method to merge [count, mean, sum of squares, min, max]
+        moments into those of a column, with the pairwise update
+        of Chan et al.
+        '''
+
+        if key not in self.moments[group]:
+            self.moments[group][key]=[int(other[0])]+\
+              [float(value) for value in other[1:]]
+
+            return
+
+        count,mean,squares,low,high=self.moments[group][key]
+
+        total=count+other[0]
+        delta=other[1]-mean
+
+        self.moments[group][key]=[int(total),
+                                  float(mean+delta*other[0]/total),
+                                  float(squares+other[2]+\
+                                        delta**2*count*other[0]/total),
+                                  float(min(low,other[3])),
+                                  float(max(high,other[4]))]
+
+    def merge(self,other):
+        '''
+        method to add the statistics of another accumulator
+
+        Parameters
+        ----------
+        other - SummaryAccumulator
+            accumulator to merge in
+
+        Returns
+        -------
+        SummaryAccumulator
+            this accumulator, for chaining
+        '''
+
+        self.num_sims+=other.num_sims
+
+        for group in GROUPS:
+            for key,moments in other.moments[group].items():
+                self._merge_moments(group,key,moments)
+
+            for key,counts in other.value_counts[group].items():
+                self.value_counts[group].setdefault(key,Counter())\
+                  .update(counts)
+
+        return self
+
+    def win_rate(self):
+        '''
+        method to get the fraction of encounters the party won
+
+        Returns
+        -------
+        float
+            the win rate, NaN if nothing has been added
+        '''
+
+        return self.mean('success')
+
+    def mean(self,column,group='all'):
+        '''
+        method to get the mean of a column
+
+        Parameters
+        ----------
+        column - str
+            name of the column
+        group - str
+            'all' or 'wins'
+
+        Returns
+        -------
+        float
+            the mean, NaN if there are no values
+        '''
+
+        moments=self.moments[group].get(column)
+
+        return moments[1] if moments else float('nan')
+
+    def std(self,column,group='all'):
+        '''
+        method to get the sample standard deviation of a column
+
+        Parameters
+        ----------
+        column - str
+            name of the column
+        group - str
+            'all' or 'wins'
+
+        Returns
+        -------
+        float
+            the standard deviation, NaN if there are
+            fewer than two values
+        '''
+
+        moments=self.moments[group].get(column)
+
+        if not moments or moments[0]<2:
+            return float('nan')
+
+        return float(np.sqrt(moments[2]/(moments[0]-1)))
+
+    def quantile(self,column,q,group='all'):
+        '''
+        method to get quantiles of one of the COUNT_COLUMNS, exactly
+        as pandas.Series.quantile would give for all the values
+
+        Parameters
+        ----------
+        column - str
+            name of the column, one of COUNT_COLUMNS
+        q - float or list
+            quantile(s) to get, between 0 and 1
+        group - str
+            'all' or 'wins'
+
+        Returns
+        -------
+        float or numpy.ndarray
+            the quantile(s), NaN if there are no values
+        '''
+
+        if column not in COUNT_COLUMNS:
+            raise ValueError(f'Quantiles are only kept for {COUNT_COLUMNS}')
+
+        values,counts=self._sorted_counts(column,group)
+
+        q=np.asarray(q,dtype=float)
+
+        if not len(values):
+            return np.full(q.shape,np.nan)[()]
+
+        #linear interpolation between the order statistics
+        #either side of position (n-1)q, as pandas does
+        cumulative=np.cumsum(counts)
+        position=(cumulative[-1]-1)*q
+        lower=np.floor(position)
+
+        low=values[np.searchsorted(cumulative,lower,side='right')]
+        high=values[np.searchsorted(cumulative,
+                                    np.minimum(lower+1,cumulative[-1]-1),
+                                    side='right')]
+
+        return (low+(position-lower)*(high-low))[()]
+
+    def histogram(self,column,bins,group='wins',lost=False):
+        '''
+        method to get the counts of one of the COUNT_COLUMNS in fixed
+        bins, closed on the right with the lowest edge included (as
+        pandas.cut with include_lowest=True)
+
+        Parameters
+        ----------
+        column - str
+            name of the column, one of COUNT_COLUMNS
+        bins - array-like
+            bin edges, e.g., HP_BINS or EXTRAS_BINS
+        group - str
+            'all' or 'wins'
+        lost - bool
+            if True, bin one minus the values (e.g., the fraction
+            of hit points lost instead of kept)
+
+        Returns
+        -------
+        numpy.ndarray
+            count in each bin, values outside the bins are left out
+        '''
+
+        values,counts=self._sorted_counts(column,group)
+
+        values=1-values if lost else values
+        bins=np.asarray(bins)
+
+        #searchsorted on the left gives right closed bins
+        which=np.searchsorted(bins,values,side='left')-1
+        which[values==bins[0]]=0
+
+        inside=(which>=0)&(which<len(bins)-1)
+
+        return np.bincount(which[inside],weights=counts[inside],
+                           minlength=len(bins)-1).astype(int)
+
+    def _sorted_counts(self,column,group):
+        '''
+        method to get the sorted distinct values of a
+        column and how many times each was seen
+        '''
+
+        counts=self.value_counts[group][column]
+
+        values=np.array(sorted(counts),dtype=float)
+
+        return values,np.array([counts[value] for value in sorted(counts)],
+                               dtype=np.int64)
+
+    def report(self):
+        '''
+        method to get the main statistics as a dictionary, those
+        used in Evaluate_SimData.ipynb
+
+        Returns
+        -------
+        dict
+            dictionary with keys
+              num_sims: number of simulations
+              win_rate: fraction of encounters won
+              means: mean of each column over every simulation
+              wins: for 'frac_party_hp' and 'frac_party_extras' in
+                won encounters, the mean, median, and 5th and 95th
+                percentiles
+              HP_cut: counts of the fraction of party hit points lost
+                in won encounters, in HP_BINS
+              Ex_cut: counts of the fraction of extras used in won
+                encounters, in EXTRAS_BINS
+        '''
+
+        wins={}
+
+        for column in ['frac_party_hp','frac_party_extras']:
+            low,median,high=self.quantile(column,[0.05,0.5,0.95],'wins')
+
+            wins[column]={'mean':self.mean(column,'wins'),
+                          'median':float(median),
+                          'q05':float(low),
+                          'q95':float(high)}
+
+        return {'num_sims':self.num_sims,
+                'win_rate':self.win_rate(),
+                'means':{column:moments[1] for column,moments \
+                         in self.moments['all'].items()},
+                'wins':wins,
+                'HP_cut':{'bins':HP_BINS.tolist(),
+                          'counts':self.histogram('frac_party_hp',HP_BINS,
+                                                  lost=True).tolist()},
+                'Ex_cut':{'bins':EXTRAS_BINS.tolist(),
+                          'counts':self.histogram('frac_party_extras',
+                                                  EXTRAS_BINS,
+                                                  lost=True).tolist()}}
+
+    def to_dict(self):
+        '''
+        method to get the statistics as a JSON serializable
+        dictionary, see from_dict
+
+        Returns
+        -------
+        dict
+            dictionary with the num_sims, moments, and value_counts,
+            with the value counts as lists of [value,count] pairs
+        '''
+
+        return {'num_sims':self.num_sims,
+                'moments':self.moments,
+                'value_counts':{group:{column:[[value,count] for value,count \
+                                               in sorted(counts.items())] \
+                                       for column,counts in columns.items()} \
+                                for group,columns in self.value_counts.items()}}
+
+    @classmethod
+    def from_dict(cls,state):
+        '''
+        class method to rebuild an accumulator from to_dict output
+
+        Parameters
+        ----------
+        state - dict
+            dictionary returned by to_dict
+
+        Returns
+        -------
+        SummaryAccumulator
+            the rebuilt accumulator
+        '''
+
+        accumulator=cls()
+
+        accumulator.num_sims=state['num_sims']
+        accumulator.moments={group:{column:list(moments) for column,moments \
+                                    in columns.items()} \
+                             for group,columns in state['moments'].items()}
+        accumulator.value_counts={group:{column:Counter({value:count \
+                                                         for value,count \
+                                                         in pairs}) \
+                                         for column,pairs in columns.items()} \
+                                  for group,columns \
+                                  in state['value_counts'].items()}
+
+        return accumulator
+
+def write_summary(output_file,accumulator):
+    '''
+    function to write an accumulator to a JSON file, with its main
+    statistics (see SummaryAccumulator.report) for reading by eye and
+    its full state for read_summary
+
+    Parameters
+    ----------
+    output_file - str or path-like
+        the JSON file
+    accumulator - SummaryAccumulator
+        the statistics to write
+    '''
+
+    with open(output_file,'w') as jfile:
+        json.dump({'report':accumulator.report(),
+                   'state':accumulator.to_dict()},jfile,indent=1)
+
+def read_summary(summary_file):
+    '''
+    function to read an accumulator written by write_summary
+
+    Parameters
+    ----------
+    summary_file - str or path-like
+        the JSON file
+
+    Returns
+    -------
+    SummaryAccumulator
+        the statistics
+    '''
+
+    with open(summary_file,'r') as jfile:
+        return SummaryAccumulator.from_dict(json.load(jfile)['state'])
@@ -0,0 +1,541 @@
+#class to run many encounters at once, in lockstep,
+#using numpy arrays instead of one Encounter object per battle
+
+import numpy as np
+
+from encounter_utils import CR_strings,CR_to_XP
+
+class BatchEncounter():
+    '''
+    class to run many simulated encounters between a Party
+    BattleGroup and a set of Enemies BattleGroups at the same
+    time, all encounters are advanced one initiative slot at a
+    time with masked array updates, following the same rules
+    as the Encounter class
+
+    ...
+
+    Attributes
+    ----------
+    <initial>
+    enemies - list
+        list of Enemies BattleGroup subclass objects, one per
+        encounter in the batch
+    heal_threshold - float
+        when party has taken this much damage or more since the last
+        heal, a heal action is taken if enough extras remain
+    initiative_order - numpy.ndarray
+        (num_encounters,max_combatants) array with the turn order of
+        each encounter, a 1 means party member takes a turn, a 0 means
+        an enemy takes a turn, and a -1 pads encounters with fewer
+        combatants than the largest encounter in the batch
+    num_encounters - int
+        number of encounters in the batch
+    party - Party
+        the Party BattleGroup subclass object representing the PCs,
+        the same party is used as the starting point of every encounter
+    rng - numpy.random.default_rng
+        random number generator used for the whole batch
+    seed - int
+        random seed used to instantiate the random number generator
+    <subsequent>
+    combatant_down - numpy.ndarray
+        boolean array with the same shape as initiative_order flagging
+        if a combatant is down (True) or active (False)
+    enemies_hp - numpy.ndarray
+        current total hit points of the enemies in each encounter
+    num_enemies_down - numpy.ndarray
+        number of enemies currently down in each encounter
+    num_pcs_down - numpy.ndarray
+        number of PCs currently down in each encounter
+    num_rounds - numpy.ndarray
+        number of rounds each encounter took to complete, always
+        rounded up as in the Encounter class
+    num_turns - numpy.ndarray
+        number of turns each encounter took to complete, only counts
+        turns for active combatants
+    party_damage - numpy.ndarray
+        damage taken by the party since the last heal action
+    party_extras - numpy.ndarray
+        current number of extras of the party in each encounter
+    party_hp - numpy.ndarray
+        current total hit points of the party in each encounter
+    summary - dict
+        dictionary with the same keys as the Encounter summary
+        attribute, but with an array (or list for CRs) of values,
+        one entry per encounter
+
+    Methods
+    -------
+    encounter_over()
+        method to evaluate which encounters should be considered over
+    run_encounter(records=None)
+        method to run all encounters in the batch to completion
+    set_initiative_order()
+        method to randomly generate the initiative order of every
+        encounter in the batch
+    write_summary(records)
+        method to write the results of every encounter into an
+        array of encounter.SUMMARY_DTYPE records
+    _check_down_enemies(idx)
+        method to down an enemy in the given encounters if the
+        enemies hit points are at or below the threshold
+    _check_down_pcs(idx)
+        method to down a PC in the given encounters if the party
+        hit points are at or below the threshold
+    _enemy_turns(idx)
+        method to run an enemy turn in each of the given encounters
+    _CR_counts()
+        method to get the number of enemies of each challenge
+        rating in each encounter
+    _make_summary()
+        method to create the summary attribute
+    _pc_turns(idx)
+        method to run a PC turn in each of the given encounters
+    _pick_combatants(idx,candidates)
+        method to randomly select one flagged combatant per encounter
+    '''
+
+    def __init__(self,party,enemies,SEED=None,RNG=None,initiative=None):
+        '''
+        Parameters
+        ----------
+        party - Party BattleGroup subclass
+            the Party class object representing the PCs, the same
+            starting party is used for every encounter in the batch,
+            the object itself is not modified
+        enemies - list
+            list of Enemies class objects, one for each encounter in
+            the batch, the objects themselves are not modified
+        SEED - int, numpy.random.SeedSequence, or None-type
+            seed to instantiate the random number generator, if not
+            specified will use fresh entropy from the operating system,
+            only used if RNG is None-type
+        RNG - numpy.random.default_rng or None-type
+            random number generator for the batch or a None-type which
+            indicates that one is made using SEED
+        initiative - iterable or None-type
+            the initiative order used for every encounter, with PC turns
+            represented by 1s and enemy turns represented by 0s, can only
+            be used if all enemy groups have the same number of members,
+            if not specified will be determined randomly per encounter
+        '''
+
+        self.party=party
+        self.enemies=list(enemies)
+        self.num_encounters=len(self.enemies)
+
+        if self.num_encounters==0:
+            raise ValueError('Need at least one Enemies object to run\
+ a batch of encounters')
+
+        #same initial heal threshold as the Encounter class
+        self.heal_threshold=2*(self.party.hit_points/self.party.num_members) \
+            if self.party.num_members>1 else 0.5*self.party.hit_points
+
+        if RNG is None:
+            self.seed=np.random.SeedSequence().entropy if SEED is None \
+              else SEED
+            self.rng=np.random.default_rng(seed=self.seed)
+
+        else:
+            self.rng=RNG
+
+        #gather the per encounter enemy values into arrays
+        self._num_enemies=np.array([group.num_members \
+                                    for group in self.enemies],dtype=np.int64)
+        self._enemies_max_hp=np.array([group.hit_points \
+                                       for group in self.enemies],dtype=float)
+        self._enemies_to_hit=np.array([group.to_hit \
+                                       for group in self.enemies],dtype=float)
+        self._enemies_AC=np.array([group.armor_class \
+                                   for group in self.enemies],dtype=float)
+        self._enemies_damage=np.array([group.average_damage \
+                                       for group in self.enemies],dtype=np.int64)
+
+        if initiative is None:
+            self.set_initiative_order()
+
+        else:
+            #a fixed order only makes sense when every encounter
+            #has the same number of combatants
+            if (self._num_enemies!=self._num_enemies[0]).any():
+                raise ValueError('Input initiative order can only be used\
+ when all enemy groups have the same number of members')
+
+            if len(initiative)!=self.party.num_members+self._num_enemies[0]:
+                raise ValueError(f'Input initiative order does not have\
+ the correct number of total entries, received {len(initiative)} but need\
+ {self.party.num_members+self._num_enemies[0]}')
+
+            if sum([turn!=0 and turn!=1 for turn in initiative])>0:
+                raise ValueError('Input initiative order should only\
+ have entries of either 0 or 1.')
+
+            if sum(initiative)!=self.party.num_members:
+                raise ValueError(f'Input initiative order does not have\
+ correct number of PCs and enemies, should sum to {self.party.num_members}\
+ but input values yield {sum(initiative)}')
+
+            self.initiative_order=np.tile(np.array(initiative,dtype=np.int8),
+                                          (self.num_encounters,1))
+
+    def set_initiative_order(self):
+        '''
+        method to randomly generate the initiative order of each
+        encounter, an array of 1s (PCs turn) and 0s (enemies turn)
+        padded with -1s for encounters with fewer combatants
+        '''
+
+        num_pcs=self.party.num_members
+        num_combatants=num_pcs+self._num_enemies
+        max_combatants=num_combatants.max()
+
+        slots=np.arange(max_combatants)
+
+        #unshuffled order, PCs first, then enemies, then padding
+        ordered=np.where(slots<num_pcs,1,0).astype(np.int8)
+        ordered=np.tile(ordered,(self.num_encounters,1))
+        ordered[slots[None,:]>=num_combatants[:,None]]=-1
+
+        #shuffle each row by sorting random keys, padding is given
+        #a key larger than any uniform draw so it stays at the end
+        keys=self.rng.random(ordered.shape)
+        keys[ordered<0]=2.
+
+        self.initiative_order=np.take_along_axis(ordered,
+                                                 keys.argsort(axis=1),axis=1)
+
+    def run_encounter(self,records=None):
+        '''
+        method to run every encounter in the batch and create
+        the summary attribute with results and details
+
+        Parameters
+        ----------
+        records - numpy.ndarray or None-type
+            if given, an array of records with the
+            encounter.SUMMARY_DTYPE fields, one per encounter, the
+            results are written into with write_summary, instead
+            of creating the summary attribute
+        '''
+
+        num=self.num_encounters
+
+        self.combatant_down=np.zeros(self.initiative_order.shape,dtype=bool)
+
+        #current state of each encounter
+        self.party_hp=np.full(num,self.party.hit_points,dtype=np.int64)
+        self.party_extras=np.full(num,self.party.extras,dtype=np.int64)
+        self.party_damage=np.zeros(num,dtype=np.int64)
+        self.enemies_hp=self._enemies_max_hp.copy()
+        self.num_pcs_down=np.zeros(num,dtype=np.int64)
+        self.num_enemies_down=np.zeros(num,dtype=np.int64)
+
+        self.num_rounds=np.zeros(num,dtype=np.int64)
+        self.num_turns=np.zeros(num,dtype=np.int64)
+
+        #same starting down thresholds as the Encounter class
+        self._pc_down_threshold=np.full(num,
+                                        self.party.hit_points/2 if \
+                                          self.party.num_members>1 else 0,
+                                        dtype=float)
+        self._enemies_down_threshold=np.where(self._num_enemies>1,
+                                              self.enemies_hp/2,0.)
+
+        running=~self.encounter_over()
+
+        while running.any():
+            #always count the round, even if it ends early
+            self.num_rounds[running]+=1
+
+            for slot in range(self.initiative_order.shape[1]):
+                combatant=self.initiative_order[:,slot]
+
+                #only active combatants in unfinished encounters act
+                acting=running&(combatant>=0)&~self.combatant_down[:,slot]
+
+                pc_idx=np.flatnonzero(acting&(combatant==1))
+                enemy_idx=np.flatnonzero(acting&(combatant==0))
+
+                if pc_idx.size:
+                    self._pc_turns(pc_idx)
+                    self._check_down_enemies(pc_idx)
+
+                if enemy_idx.size:
+                    self._enemy_turns(enemy_idx)
+                    self._check_down_pcs(enemy_idx)
+
+                self.num_turns[acting]+=1
+
+                #check end conditions after every slot, as
+                #in the Encounter class
+                running&=~self.encounter_over()
+
+                if not running.any():
+                    break
+
+        if records is None:
+            self._make_summary()
+
+        else:
+            self.write_summary(records)
+
+    def write_summary(self,records):
+        '''
+        method to write the results of every encounter into
+        records, without building the summary dictionary
+
+        Parameters
+        ----------
+        records - numpy.ndarray
+            array of records with the encounter.SUMMARY_DTYPE fields,
+            one per encounter (e.g., a slice of a preallocated array),
+            written in place, any other fields are left alone
+        '''
+
+        records['party_hp']=self.party_hp
+        records['party_extras']=self.party_extras
+        records['frac_party_hp']=self.party_hp/self.party.max_hit_points()
+        records['frac_party_extras']=\
+          self.party_extras/self.party.max_extras()
+        records['num_party_down']=self.num_pcs_down
+        records['frac_party_down']=self.num_pcs_down/self.party.num_members
+        records['success']=~(self.party_hp<=0)
+        records['enemies_hp']=self.enemies_hp
+        records['num_enemies_down']=self.num_enemies_down
+        records['num_enemies']=self._num_enemies
+        records['frac_enemies_down']=self.num_enemies_down/self._num_enemies
+        records['CR_counts']=self._CR_counts()
+        records['totalXP']=[group.total_XP for group in self.enemies]
+        records['num_rounds']=self.num_rounds
+        records['num_turns']=self.num_turns
+
+    def _CR_counts(self):
+        '''
+        method to get the number of enemies of each challenge
+        rating in each encounter
+        '''
+
+        return np.array([group.challenge_rating_counts() \
+                         for group in self.enemies]).reshape(-1,len(CR_to_XP))
+
+    def _pc_turns(self,idx):
+        '''
+        method to run a PC turn in each of the given encounters,
+        either a heal action or an attack, possibly using an extra
+
+        Parameters
+        ----------
+        idx - numpy.ndarray
+            indices of the encounters where a PC is taking a turn
+        '''
+
+        has_extras=self.party_extras[idx]>0
+
+        #heal if extras remain and either enough damage has been
+        #taken since the last heal or any PC is down
+        heal=has_extras&((self.party_damage[idx]>=self.heal_threshold)|\
+                         (self.num_pcs_down[idx]>0))
+
+        heal_idx=idx[heal]
+
+        if heal_idx.size:
+            self.party_extras[heal_idx]-=1
+            self.party_hp[heal_idx]+=5
+            self.party_damage[heal_idx]=0
+
+            #healing gets a random down PC back up
+            revive_idx=heal_idx[self.num_pcs_down[heal_idx]>0]
+
+            if revive_idx.size:
+                candidates=(self.initiative_order[revive_idx]==1)&\
+                           self.combatant_down[revive_idx]
+
+                slots=self._pick_combatants(revive_idx,candidates)
+                self.combatant_down[revive_idx,slots]=False
+                self.num_pcs_down[revive_idx]-=1
+
+        attack_idx=idx[~heal]
+
+        if attack_idx.size:
+            #10% chance of using an extra for more damage
+            #when extras remain
+            use_extra=np.zeros(attack_idx.size,dtype=np.int64)
+            may_use=has_extras[~heal]
+            use_extra[may_use]=self.rng.random(may_use.sum())<0.1
+
+            self.party_extras[attack_idx]-=use_extra
+
+            d20=self.rng.integers(1,20,size=attack_idx.size,endpoint=True)
+
+            crit=d20==20
+            hit=(d20>1)&((d20+self.party.to_hit>=self._enemies_AC[attack_idx])\
+                         |crit)
+
+            damage=hit*self.party.average_damage*(1+use_extra)*(1+crit)
+
+            self.enemies_hp[attack_idx]-=damage
+
+    def _enemy_turns(self,idx):
+        '''
+        method to run an enemy turn in each of the given encounters
+
+        Parameters
+        ----------
+        idx - numpy.ndarray
+            indices of the encounters where an enemy is taking a turn
+        '''
+
+        d20=self.rng.integers(1,20,size=idx.size,endpoint=True)
+
+        crit=d20==20
+        hit=(d20>1)&((d20+self._enemies_to_hit[idx]>=self.party.armor_class)\
+                     |crit)
+
+        damage=hit*self._enemies_damage[idx]*(1+crit)
+
+        self.party_hp[idx]-=damage
+        self.party_damage[idx]+=damage
+
+    def _check_down_pcs(self,idx):
+        '''
+        method to down a random active PC in each of the given
+        encounters where the party hit points are at or below
+        the current threshold, and update that threshold
+
+        Parameters
+        ----------
+        idx - numpy.ndarray
+            indices of the encounters to check
+        '''
+
+        down_idx=idx[self.party_hp[idx]<=self._pc_down_threshold[idx]]
+
+        if not down_idx.size:
+            return
+
+        candidates=(self.initiative_order[down_idx]==1)&\
+                   ~self.combatant_down[down_idx]
+
+        #only encounters with an active PC can down one
+        has_up=candidates.any(axis=1)
+
+        if has_up.any():
+            pick_idx=down_idx[has_up]
+            slots=self._pick_combatants(pick_idx,candidates[has_up])
+            self.combatant_down[pick_idx,slots]=True
+            self.num_pcs_down[pick_idx]+=1
+
+        #threshold is 0 or the current hit points less an even share
+        num_up=self.party.num_members-self.num_pcs_down[down_idx]
+        hit_points=self.party_hp[down_idx]
+
+        self._pc_down_threshold[down_idx]=np.where(num_up<=1,0,
+          hit_points-hit_points//np.maximum(num_up,1))
+
+    def _check_down_enemies(self,idx):
+        '''
+        method to down a random active enemy in each of the given
+        encounters where the enemies hit points are at or below
+        the current threshold, and update that threshold
+
+        Parameters
+        ----------
+        idx - numpy.ndarray
+            indices of the encounters to check
+        '''
+
+        down_idx=idx[self.enemies_hp[idx]<=self._enemies_down_threshold[idx]]
+
+        if not down_idx.size:
+            return
+
+        candidates=(self.initiative_order[down_idx]==0)&\
+                   ~self.combatant_down[down_idx]
+
+        has_up=candidates.any(axis=1)
+
+        if has_up.any():
+            pick_idx=down_idx[has_up]
+            slots=self._pick_combatants(pick_idx,candidates[has_up])
+            self.combatant_down[pick_idx,slots]=True
+            self.num_enemies_down[pick_idx]+=1
+
+        num_up=self._num_enemies[down_idx]-self.num_enemies_down[down_idx]
+        hit_points=self.enemies_hp[down_idx]
+
+        self._enemies_down_threshold[down_idx]=np.where(num_up<=1,0,
+          hit_points-hit_points//np.maximum(num_up,1))
+
+    def _pick_combatants(self,idx,candidates):
+        '''
+        method to randomly select, with equal probability, one of
+        the flagged combatants in each of the given encounters
+
+        Parameters
+        ----------
+        idx - numpy.ndarray
+            indices of the encounters, used for the number of draws
+        candidates - numpy.ndarray
+            boolean array of shape (len(idx),max_combatants) flagging
+            the combatants to choose from, each row needs at least
+            one True entry
+
+        Returns
+        -------
+        numpy.ndarray
+            the initiative slot of the selected combatant per encounter
+        '''
+
+        counts=candidates.sum(axis=1)
+
+        #pick the k-th flagged combatant for a uniform k in each row
+        picks=(self.rng.random(idx.size)*counts).astype(np.int64)
+
+        return (candidates.cumsum(axis=1)>picks[:,None]).argmax(axis=1)
+
+    def encounter_over(self):
+        '''
+        method to check which encounters have met any of the
+        end conditions
+
+        Returns
+        -------
+        numpy.ndarray
+            boolean array, True where any end condition has been met
+        '''
+
+        return (self.num_pcs_down==self.party.num_members)|\
+               (self.num_enemies_down==self._num_enemies)|\
+               (self.party_hp<=0)|(self.enemies_hp<=0)
+
+    def _make_summary(self):
+        '''
+        method to create the summary attribute, a dictionary with
+        the same keys as the Encounter class summary but holding
+        one value per encounter
+        '''
+
+        CRstrings=CR_strings(self._CR_counts()).tolist()
+
+        self.summary={'party_hp':self.party_hp,
+                      'party_extras':self.party_extras,
+                      'frac_party_hp':\
+                        self.party_hp/self.party.max_hit_points(),
+                      'frac_party_extras':\
+                        self.party_extras/self.party.max_extras(),
+                      'num_party_down':self.num_pcs_down,
+                      'frac_party_down':\
+                        self.num_pcs_down/self.party.num_members,
+                      'success':~(self.party_hp<=0),
+                      'enemies_hp':self.enemies_hp,
+                      'num_enemies_down':self.num_enemies_down,
+                      'num_enemies':self._num_enemies,
+                      'frac_enemies_down':\
+                        self.num_enemies_down/self._num_enemies,
+                      'CRs':CRstrings,
+                      'totalXP':np.array([group.total_XP \
+                                          for group in self.enemies]),
+                      'num_rounds':self.num_rounds,
+                      'num_turns':self.num_turns}
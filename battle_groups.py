@@ -2,16 +2,19 @@
 #as well as derived classes for the Party and the Enemies
 
 import numpy as np
-
-import time
+from functools import lru_cache
 
 from encounter_utils import (
                     calculate_difficulty,
                     calculate_difficulty_boundaries,
+                    CR_CODES,
+                    CR_codes,
+                    CR_counts,
+                    CR_NAMES,
                     CR_to_XP,
-                    CR_ave_HP,
                     CR_ave_DMG,
-                    CR_to_float,
+                    CR_HP,
+                    enemy_group_stats,
                     valid_difficulty
                     )
 
@@ -266,6 +269,9 @@ class Enemies(BattleGroup):
     difficulty - str
         the difficulty rating for this enemy group, based on the
         challenge_ratings, num_pcs, and pc_levels
+    index - composition_index.CompositionIndex or None-type
+        precomputed index of group compositions random enemy groups
+        are picked from, if None-type groups are built by random trial
     num_pcs - int
         the number of PCs for which this enemy group's difficulty
         rating is to be calculated/compared against
@@ -307,9 +313,18 @@ class Enemies(BattleGroup):
         method to calculate the group average to hit bonus, based
         on challenge_ratings, if no average value(s) given as input,
         will be rounded to an int
+    challenge_rating_counts()
+        method to get the number of group members of each
+        challenge rating
     get_average_damage()
         a method to assign the average damage attribute for the
         group based on the challenge_ratings
+    _group_stats()
+        method to look up the memoized total XP, difficulty, hit
+        points, average damage, and to hit bonus of the group
+    _lookup_enemy_group(rng)
+        method called by build_enemy_group to pick the enemy group
+        from a precomputed index of group compositions
     _add_enemies(possible_CRs,rng=None)
         method called by build_enemy_group to construct candidate
         enemy group based on number of enemies and/or target
@@ -318,7 +333,7 @@ class Enemies(BattleGroup):
     '''
     
     def __init__(self,DIFFICULTY,NUMBER=0,ATK=3,AC=13,HP=0,CRs=None,\
-      NUM_PCs=5,LVL_PCs=1,SEED=None):
+      NUM_PCs=5,LVL_PCs=1,SEED=None,INDEX=None):
         '''
         Parameters
         ----------
@@ -355,11 +370,17 @@ class Enemies(BattleGroup):
             this enemy group is calibrated, currently this is forced
             to a value of 1, but future updates may allow for higher
             levels and a mix of values
-        SEED - int or None-type
+        SEED - int, numpy.random.SeedSequence, or None-type
             the random seed to be used when enemy groups are built randomly
             to match NUMBER and DIFFICULTY constraints, set for 
             reproducibility purposes and to avoid duplication if running
-            many simulations with multiprocessing
+            many simulations with multiprocessing, if None-type fresh
+            entropy from the operating system is used
+        INDEX - composition_index.CompositionIndex or None-type
+            if supplied, random enemy groups are picked from this
+            precomputed index of group compositions instead of built
+            by random trial, see CompositionIndex.sample, note the
+            groups follow a different distribution than random trial
         '''
     
         #force this for now
@@ -387,6 +408,8 @@ class Enemies(BattleGroup):
         self.num_pcs=NUM_PCs
         self.pc_levels=LVL_PCs
         
+        self.index=INDEX
+        
         #if we did not specify challenge ratings or the number
         #of group members, build the group randomly to match
         #the difficulty rating
@@ -411,8 +434,12 @@ class Enemies(BattleGroup):
                       if self.num_members>0 else len(CRs)
                     
             #calculate total XP and corresponding difficulty
-            self.total_XP,difficulty_cat=calculate_difficulty(CRs,NUM_PCs,
-                                                              LVL_PCs,True)
+            if isinstance(CRs,str):
+                self.total_XP,difficulty_cat=calculate_difficulty(CRs,NUM_PCs,
+                                                                  LVL_PCs,True)
+            
+            else:
+                self.total_XP,difficulty_cat=self._group_stats()[:2]
                     
             #make sure that the calculated difficulty matches
             #what the user requested, if they did
@@ -444,9 +471,10 @@ class Enemies(BattleGroup):
         
         Parameters
         ----------
-        SEED - int or None-type
+        SEED - int, numpy.random.SeedSequence, or None-type
             random seed to be used to initialize the
-            random number generator
+            random number generator, if None-type fresh entropy
+            from the operating system is used
         '''
         
         #quick check to make sure at least one of num_members
@@ -456,35 +484,52 @@ class Enemies(BattleGroup):
  encounter difficulty.')
 	    
         #create a random number generator instance using the
-        #passed seed or the integer version of current unix timestamp
-        rng=np.random.default_rng(seed=SEED if SEED is not None \
-          else int(time.time()))
+        #passed seed or fresh entropy from the operating system
+        rng=np.random.default_rng(seed=SEED)
 	    
-	    #get the list of possible challenge ratings to choose from
-	    #want it to be a list for ease of manipulation later
+        #with an index, the group is a single look-up
+        if self.index is not None:
+            return self._lookup_enemy_group(rng)
+        
+	    #get the list of codes (see encounter_utils.CR_codes) of the
+	    #possible challenge ratings to choose from, want it to be
+	    #a list for ease of manipulation later
         if self.challenge_ratings is None:
-            possible_CRs=[key for key in CR_to_XP.keys()]
+            possible_CRs=list(range(len(CR_to_XP)))
 
         elif hasattr(self.challenge_ratings,'__iter__') and \
           not isinstance(self.challenge_ratings,str):
-            possible_CRs=[CR for CR in self.challenge_ratings]
+            possible_CRs=CR_codes(self.challenge_ratings).tolist()
 
         else:
-            possible_CRs=[self.challenge_ratings]
+            possible_CRs=[CR_CODES[self.challenge_ratings]]
 	    
 	    #set a boolean variable to control when we exit
 	    #the while loop
         success=False
+        
+        #_add_enemies can rule out every candidate on an unlucky
+        #pass (e.g., for small parties), when that happens start
+        #over from the full list a limited number of times
+        all_CRs=list(possible_CRs)
+        restarts=0
 	    
-        while not (success or not possible_CRs):
+        while not success:
+            if not possible_CRs:
+                if restarts>=10:
+                    break
+                
+                possible_CRs=list(all_CRs)
+                restarts+=1
+            
 	        #randomly generate a group of enemies
             enemies=self._add_enemies(possible_CRs,rng)
         
             #calculate the total_XP for the potential group
 	        #update the difficulty rating if it wasn't specified
-            total_XP,difficulty_cat=calculate_difficulty(enemies,
-                                                 self.num_pcs,
-                                                 self.pc_levels)
+            total_XP,difficulty_cat=enemy_group_stats(CR_counts(enemies),
+                                                      self.num_pcs,
+                                                      self.pc_levels)[:2]
 	        
 	        #check that the returned difficulty actually matches
 	        #what is requested, might not happen if we have a high 
@@ -493,8 +538,9 @@ class Enemies(BattleGroup):
 	        #try again
             if self.difficulty is not None and \
               self.difficulty!=difficulty_cat:
-                low_idx=np.array([CR_to_float(CR) for CR in possible_CRs]).argmin()
-                possible_CRs.remove(possible_CRs[low_idx])
+                if possible_CRs:
+                    #codes are in order of challenge rating
+                    possible_CRs.remove(min(possible_CRs))
 	        
             else:
                 success=True
@@ -512,12 +558,46 @@ class Enemies(BattleGroup):
         self.difficulty=difficulty if self.difficulty is None else \
 	                    self.difficulty
 	    
-        self.challenge_ratings=enemies if self.challenge_ratings is None \
-	                    else self.challenge_ratings
+        self.challenge_ratings=[CR_NAMES[code] for code in enemies] \
+          if self.challenge_ratings is None else self.challenge_ratings
 	    
         if self.num_members<=0:
 	        self.num_members=len(enemies)
 	
+    def _lookup_enemy_group(self,rng):
+        '''
+        method called by build_enemy_group to pick the enemy group
+        from the precomputed index of group compositions, subject to
+        the num_members and/or difficulty constraints
+        
+        Parameters
+        ----------
+        rng - numpy.random.default_rng
+            random number generator for the selection
+        '''
+        
+        enemies=self.index.sample(self.num_pcs,self.difficulty,
+                                  self.num_members,self.challenge_ratings,
+                                  rng)
+        
+        if enemies is None:
+            print(f'Could not meet difficulty {self.difficulty} requirement\
+ with only {self.num_members} enemies')
+            return None
+        
+        self.total_XP,difficulty_cat=enemy_group_stats(CR_counts(enemies),
+                                                       self.num_pcs,
+                                                       self.pc_levels)[:2]
+        
+        self.difficulty=difficulty_cat if self.difficulty is None else \
+                        self.difficulty
+        
+        self.challenge_ratings=enemies if self.challenge_ratings is None \
+                        else self.challenge_ratings
+        
+        if self.num_members<=0:
+            self.num_members=len(enemies)
+    
     def _add_enemies(self,possible_CRs,rng=None):
         '''
         method to randomly create an enemies group, selecting from
@@ -527,16 +607,17 @@ class Enemies(BattleGroup):
         Parameters
         ----------
         possible_CRs - list
-            a list of strings corresponding to possible challenge
-            rating values for enemies to be added to the group
+            a list of the codes (see encounter_utils.CR_codes) of
+            possible challenge rating values for enemies to be
+            added to the group
         rng - numpy.random.default_rng instance or None-type
             random number generator instance for random selection
         
         Returns
         -------
-        list
-            list of challenge ratings (strings) corresponding to
-            the members of the proposed enemies group
+        numpy.ndarray
+            array of the challenge rating codes of the members
+            of the proposed enemies group
         '''
         
 	    #create an empty list to fill
@@ -544,7 +625,7 @@ class Enemies(BattleGroup):
 	    
     	#check on the random number generator
         if rng is None:
-            rng=np.random.default_rng(seed=int(time.time()) if SEED is None else SEED)
+            rng=np.random.default_rng()
     	
 	    #set a maximum number of enemies to control the while loop
 	    #if num_members is 0, then set an unrealistically high number
@@ -552,48 +633,35 @@ class Enemies(BattleGroup):
 
         #now we want a limiting value based on the requested difficulty
         if self.difficulty is not None:
-            boundaries=calculate_difficulty_boundaries(self.num_pcs,
-	                                                   self.pc_levels)
-	        
-	        #based on how the previous function structures the returned
-	        #list, we know which index we want for which difficulty rating
-	        #may decide on a slicker way to do this in the future
-            idx=1 if self.difficulty=='easy' else \
-                2 if self.difficulty=='medium' else \
-                3
-	        
-	        #the idx value will give us the upper limit
-	        #unless the encounter is deadly, in which case we'll
-	        #just set it high
-            XP_max_limit=boundaries[idx][1]*3 if \
-                self.difficulty=='deadly' else \
-                boundaries[idx][1]
-            
-            #get the minimum value as the next index down
-            #for medium and hard, 0 for easy, and the actual
-            #idx value for deadly
-            XP_min_limit=0 if idx==1 else \
-                boundaries[idx][1] if self.difficulty=='deadly' else \
-                boundaries[idx-1][1]
+            XP_min_limit,XP_max_limit=_difficulty_XP_limits(self.difficulty,
+                                                            self.num_pcs,
+                                                            self.pc_levels)
 	            
     	
+        #running count of each challenge rating in the group, the
+        #memoized group XP is looked up by these counts
+        counts=[0]*len(CR_to_XP)
+        
         #continue adding as long as we haven't eliminated all
         #possible CR values or met the requested number of enemies
         while possible_CRs and len(enemies)<num_max:
             #randomly select a challenge rating for a possible new enemy
-            new_enemy=rng.choice(possible_CRs,1)[0]
+            new_enemy=int(rng.choice(possible_CRs,1)[0])
                 
             #if we have a target difficulty
             if self.difficulty is not None:
     	        #check if that pushes us past the XP_limit
-                this_XP=calculate_difficulty(enemies+[new_enemy],
-                                             self.num_pcs,
-                                             self.pc_levels,
-                                             return_category=False)
+                counts[new_enemy]+=1
+                
+                this_XP=enemy_group_stats(tuple(counts),self.num_pcs,
+                                          self.pc_levels)[0]
+                
+                counts[new_enemy]-=1
 	        
     	        #if we're under the limit, add the enemy
                 if this_XP<XP_max_limit:
                     enemies.append(new_enemy)
+                    counts[new_enemy]+=1
 	         
                 #otherwise, remove the new_enemy challenge rating from
                 #our choices as it will increase the value too much
@@ -611,7 +679,7 @@ class Enemies(BattleGroup):
             else:
                 enemies.append(new_enemy)
         
-        return enemies
+        return np.array(enemies,dtype=np.int8)
 	
 	#if HP was not specified, calculate an HP total
 	#based on challenge ratings
@@ -621,18 +689,17 @@ class Enemies(BattleGroup):
         from the challenge_ratings if the hit point per member
         was not specified upon object creation
         '''
-        #if challenge_ratings is a list, iterate through
-        #the list and sum the total hit points
+        #if challenge_ratings is a list, look up the
+        #summed total hit points
         if hasattr(self.challenge_ratings,'__iter__') and \
           not isinstance(self.challenge_ratings,str):
-            self.hit_points=sum([CR_ave_HP.get(CR) \
-	                            for CR in self.challenge_ratings])
+            self.hit_points=self._group_stats()[2]
 	    
 	    #otherwise, multiply the single challenge rating by the
 	    #number of members in the enemy group
         else:
 	        self.hit_points=\
-	            self.num_members*CR_ave_HP.get(self.challenge_ratings)
+	            self.num_members*float(CR_HP[CR_CODES[self.challenge_ratings]])
 	
     def calculate_to_hit(self):
         '''
@@ -641,15 +708,11 @@ class Enemies(BattleGroup):
         object creation
         '''
         
-        #if challenge_ratings is iterable, iterate through the list
-        #and average the result
+        #if challenge_ratings is iterable, look up the
+        #averaged result
         if hasattr(self.challenge_ratings,'__iter__') and \
           not isinstance(self.challenge_ratings,str):
-            #with the currently available CR values, the to hit
-            #is either +3 or +4 for CR '3'
-            to_hit=[4 if CR=='3' else 3]
-            
-            self.to_hit=np.average(to_hit).round(0).astype(int)
+            self.to_hit=self._group_stats()[4]
        
         #otherwise, set it based on if it is '3' or less
         else:
@@ -661,14 +724,96 @@ class Enemies(BattleGroup):
         based on the challenge_ratings information
         '''
         
-        #if challenge_ratings is iterable, go through and average
-        #all the damage values
+        #if challenge_ratings is iterable, look up the
+        #average of all the damage values
         if hasattr(self.challenge_ratings,'__iter__') and \
           not isinstance(self.challenge_ratings,str):
-            self.average_damage=np.average(\
-                [CR_ave_DMG.get(CR) for CR in self.challenge_ratings])\
-                .round(0).astype(int)
+            self.average_damage=self._group_stats()[3]
         
         #otherwise, use the corresponding value for the given CR
         else:
-            self.average_damage=CR_ave_DMG.get(self.challenge_ratings)
\ No newline at end of file
+            self.average_damage=CR_ave_DMG.get(self.challenge_ratings)
+    
+    def challenge_rating_counts(self):
+        '''
+        method to get the number of group members of each challenge
+        rating, in the order of the CR_to_XP keys, see
+        encounter_utils.CR_counts
+        
+        Returns
+        -------
+        tuple
+            number of members for each challenge rating
+        '''
+        
+        #a single challenge rating is shared by every member
+        if isinstance(self.challenge_ratings,str):
+            return tuple(self.num_members if CR==self.challenge_ratings \
+                         else 0 for CR in CR_to_XP)
+        
+        return CR_counts(self.challenge_ratings)
+    
+    def _group_stats(self):
+        '''
+        method to look up the memoized quantities derived from
+        a list of challenge_ratings, see
+        encounter_utils.enemy_group_stats
+        
+        Returns
+        -------
+        tuple
+            total XP, difficulty category, total hit points,
+            average damage, and average to hit bonus
+        '''
+        
+        return enemy_group_stats(CR_counts(self.challenge_ratings),
+                                 self.num_pcs,self.pc_levels)
+
+@lru_cache(maxsize=None)
+def _difficulty_XP_limits(difficulty,num_pcs,levels):
+    '''
+    function to get the XP limits used when building a random enemy
+    group of a given difficulty, memoized as only a handful of
+    combinations ever come up
+    
+    Parameters
+    ----------
+    difficulty - str
+        the requested encounter difficulty, lower case
+    num_pcs - int
+        the number of PCs
+    levels - int or list
+        level(s) of the PCs
+    
+    Returns
+    -------
+    float
+        the lower XP limit of the difficulty category
+    float
+        the XP limit a group must stay below
+    '''
+    
+    boundaries=calculate_difficulty_boundaries(num_pcs,levels)
+    
+    #based on how the previous function structures the returned
+    #list, we know which index we want for which difficulty rating
+    #may decide on a slicker way to do this in the future
+    idx=1 if difficulty=='easy' else \
+        2 if difficulty=='medium' else \
+        3
+    
+    #the idx value will give us the upper limit
+    #unless the encounter is deadly, in which case we'll
+    #just set it high
+    XP_max_limit=boundaries[idx][1]*3 if \
+        difficulty=='deadly' else \
+        boundaries[idx][1]
+    
+    #get the minimum value as the next index down
+    #for medium and hard, 0 for easy, and the actual
+    #idx value for deadly
+    XP_min_limit=0 if idx==1 else \
+        boundaries[idx][1] if difficulty=='deadly' else \
+        boundaries[idx-1][1]
+    
+    return XP_min_limit,XP_max_limit
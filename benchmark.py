@@ -0,0 +1,588 @@
+#benchmarks of the simulation hot paths, writing the timings to
+#a JSON file that can be compared against an earlier run
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime,timezone
+from pathlib import Path
+
+import numpy as np
+
+from battle_groups import Enemies
+
+from encounter import Encounter
+
+from encounter_utils import (
+                    calculate_difficulty,
+                    CR_to_XP,
+                    load_configuration
+                    )
+
+from encounter_worker import (
+                    _init_worker,
+                    _make_enemies,
+                    _make_party,
+                    _simulate_index
+                    )
+
+from run_encounters import generate_encounter_results
+
+from simulation_pool import SimulationPool
+
+#difficulty configuration files shipped with the code
+CONFIG_FILES=['easy_battle.yml','medium_battle.yml',
+              'hard_battle.yml','deadly_battle.yml']
+
+#enemy groups with given CRs used for the Enemies benchmark
+GIVEN_CRS={'single':['1'],
+           'mixed':['1/8','1/4','1/4','1/2','1'],
+           'large':['0']*6+['1/8']*6+['1/4']*8}
+
+#modules timed by the startup benchmark, the entry module of the
+#worker processes and the module the main process imports
+STARTUP_MODULES=['encounter_worker','run_encounters']
+
+#most time importing encounter_worker should take, in seconds, a
+#worker over this has likely picked up a heavy import (e.g., pandas)
+STARTUP_BUDGET=0.25
+
+def time_calls(func,num_calls,setup=None):
+    '''
+    function to time repeated calls of a function
+
+    Parameters
+    ----------
+    func - function
+        function to time, called with the value returned by
+        setup(i) for call i, or with no arguments if setup
+        is None-type
+    num_calls - int
+        number of calls to time
+    setup - function or None-type
+        function called (untimed) before each call to make
+        its argument
+
+    Returns
+    -------
+    dict
+        dictionary with keys
+          calls: number of calls timed
+          total: total time of the calls, in seconds
+          mean, median, min, p95: statistics of the time per
+            call, in seconds
+          per_sec: calls per second, from the total time
+    '''
+
+    times=np.empty(num_calls)
+
+    for i in range(num_calls):
+        if setup is None:
+            start=time.perf_counter()
+            func()
+
+        else:
+            arg=setup(i)
+
+            start=time.perf_counter()
+            func(arg)
+
+        times[i]=time.perf_counter()-start
+
+    return _time_stats(times)
+
+def _time_stats(times):
+    '''
+    function to get the statistics of an array of call times
+    '''
+
+    total=float(times.sum())
+
+    return {'calls':len(times),
+            'total':total,
+            'mean':float(times.mean()),
+            'median':float(np.median(times)),
+            'min':float(times.min()),
+            'p95':float(np.percentile(times,95)),
+            'per_sec':len(times)/total if total>0 else None}
+
+def bench_encounters(num_calls=2000,SEED=0,rng_mode='buffered',
+                     config_files=CONFIG_FILES):
+    '''
+    function to time Encounter.run_encounter for each difficulty
+    configuration, the party and enemies are built before the
+    clock starts, so only the turn loop is timed
+
+    Parameters
+    ----------
+    num_calls - int
+        number of encounters to run per configuration
+    SEED - int
+        root seed, encounter i of a configuration always gets
+        the same party, enemies, and random draws
+    rng_mode - str
+        Encounter RNG_MODE
+    config_files - list
+        configuration files to time
+
+    Returns
+    -------
+    dict
+        time_calls statistics keyed by 'encounter/<difficulty>'
+    '''
+
+    results={}
+
+    for config_file in config_files:
+        config=load_configuration(_config_path(config_file))
+
+        def setup(i):
+            enemy_seed,encounter_seed=np.random.SeedSequence(SEED,
+                                                             spawn_key=(i,))\
+                                        .spawn(2)
+
+            return Encounter(party=_make_party(config),
+                             enemies=_make_enemies(config,enemy_seed),
+                             SEED=encounter_seed,
+                             initiative=config.get('initiative'),
+                             RNG_MODE=rng_mode)
+
+        results[f'encounter/{config["difficulty"]}']=\
+          time_calls(Encounter.run_encounter,num_calls,setup)
+
+    return results
+
+def bench_enemies(num_calls=2000,SEED=0):
+    '''
+    function to time building Enemies groups, randomly for each
+    difficulty and from the given CRs in GIVEN_CRS
+
+    Parameters
+    ----------
+    num_calls - int
+        number of groups to build per case
+    SEED - int
+        root seed for the random groups
+
+    Returns
+    -------
+    dict
+        time_calls statistics keyed by 'enemies/random/<difficulty>'
+        and 'enemies/given/<name>'
+    '''
+
+    results={}
+
+    for difficulty in ['easy','medium','hard','deadly']:
+        results[f'enemies/random/{difficulty}']=\
+          time_calls(lambda seed:Enemies(difficulty,SEED=seed),num_calls,
+                     lambda i:np.random.SeedSequence(SEED,spawn_key=(i,)))
+
+    for name,CRs in GIVEN_CRS.items():
+        results[f'enemies/given/{name}']=\
+          time_calls(lambda:Enemies('easy',CRs=list(CRs)),num_calls)
+
+    return results
+
+def bench_difficulty(num_calls=20000,SEED=0,max_enemies=10):
+    '''
+    function to time calculate_difficulty on random enemy groups
+
+    Parameters
+    ----------
+    num_calls - int
+        number of groups to rate
+    SEED - int
+        seed for picking the groups
+    max_enemies - int
+        largest group size
+
+    Returns
+    -------
+    dict
+        time_calls statistics keyed by 'calculate_difficulty'
+    '''
+
+    rng=np.random.default_rng(SEED)
+
+    CRs=list(CR_to_XP.keys())
+
+    groups=[[CRs[idx] for idx in rng.integers(len(CRs),size=size)] \
+            for size in rng.integers(1,max_enemies+1,size=num_calls)]
+
+    return {'calculate_difficulty':time_calls(calculate_difficulty,num_calls,
+                                              groups.__getitem__)}
+
+def bench_startup(num_calls=10,config_file='hard_battle.yml'):
+    '''
+    function to time the start up of worker processes, importing
+    each of STARTUP_MODULES in a fresh interpreter, and starting two
+    workers with the spawn start method (which, unlike fork, imports
+    everything again in each worker) and running a simulation on them
+
+    Parameters
+    ----------
+    num_calls - int
+        number of times to time each case
+    config_file - str or path-like
+        configuration file given to the workers
+
+    Returns
+    -------
+    dict
+        statistics keyed by 'startup/<module>' and
+        'startup/spawn_pool', the import cases also say whether
+        pandas was imported ('pandas'), and the encounter_worker
+        case gives the STARTUP_BUDGET ('budget') and whether its
+        median is within it ('within_budget')
+    '''
+
+    code='import sys,time;start=time.perf_counter();import {};\
+print(time.perf_counter()-start,"pandas" in sys.modules)'
+
+    results={}
+
+    for module in STARTUP_MODULES:
+        times=np.empty(num_calls)
+
+        for i in range(num_calls):
+            output=subprocess.run([sys.executable,'-c',code.format(module)],
+                                  capture_output=True,text=True,check=True,
+                                  cwd=Path(__file__).parent).stdout.split()
+
+            times[i]=float(output[0])
+
+        results[f'startup/{module}']=dict(_time_stats(times),
+                                          pandas=output[1]=='True')
+
+    worker=results['startup/encounter_worker']
+    worker.update(budget=STARTUP_BUDGET,
+                  within_budget=worker['median']<=STARTUP_BUDGET)
+
+    config=load_configuration(_config_path(config_file))
+    context=mp.get_context('spawn')
+
+    def start_pool():
+        with context.Pool(processes=2,initializer=_init_worker,
+                          initargs=(config,'buffered',0)) as pool:
+            pool.map(_simulate_index,range(2),chunksize=1)
+
+    results['startup/spawn_pool']=time_calls(start_pool,num_calls)
+
+    return results
+
+def bench_pool(num_calls=20,config_file='hard_battle.yml',num_sims=4,
+               num_jobs=2,SEED=0):
+    '''
+    function to time a small run with generate_encounter_results,
+    which starts and stops its own workers, and with a SimulationPool
+    whose workers are already running
+
+    Parameters
+    ----------
+    num_calls - int
+        number of runs to time for each case
+    config_file - str or path-like
+        configuration file to simulate
+    num_sims - int
+        number of simulations per run
+    num_jobs - int
+        number of worker processes
+    SEED - int
+        root seed, run i uses SEED+i in both cases
+
+    Returns
+    -------
+    dict
+        statistics keyed by 'pool/generate' and 'pool/simulation_pool'
+    '''
+
+    config_path=_config_path(config_file)
+
+    results={}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file=Path(tmpdir)/'results.csv'
+
+        results['pool/generate']=time_calls(\
+          lambda i:generate_encounter_results(config_path,output_file,
+                                              num_sims,num_jobs,SEED=SEED+i),
+          num_calls,setup=lambda i:i)
+
+    with SimulationPool(num_jobs) as pool:
+        #the first run reads the configuration and
+        #imports pandas, which are not what is timed
+        pool.run(config_path,num_sims,SEED=SEED)
+
+        results['pool/simulation_pool']=time_calls(\
+          lambda i:pool.run(config_path,num_sims,SEED=SEED+i),num_calls,
+          setup=lambda i:i)
+
+    return results
+
+def bench_scaling(config_file='hard_battle.yml',num_sims=20000,
+                  jobs=(1,2,4),SEED=0,batch_size=None):
+    '''
+    function to time generate_encounter_results end to end for
+    several num_jobs values with the same simulations (strong
+    scaling), writing to a temporary file
+
+    Parameters
+    ----------
+    config_file - str or path-like
+        configuration file to simulate
+    num_sims - int
+        number of simulations per run
+    jobs - iterable
+        num_jobs values to time
+    SEED - int
+        root seed, every run simulates the same encounters
+    batch_size - int or None-type
+        batch_size passed to generate_encounter_results
+
+    Returns
+    -------
+    dict
+        statistics keyed by 'scaling/<num_jobs>', with the wall time,
+        simulations per second, speedup over the first num_jobs
+        value, and parallel efficiency (speedup per job relative
+        to the first num_jobs value)
+    '''
+
+    results={}
+    base=None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file=Path(tmpdir)/'results.csv'
+
+        for num_jobs in jobs:
+            start=time.perf_counter()
+
+            generate_encounter_results(_config_path(config_file),output_file,
+                                       num_sims,num_jobs,SEED=SEED,
+                                       batch_size=batch_size)
+
+            wall_time=time.perf_counter()-start
+
+            if base is None:
+                base=(num_jobs,wall_time)
+
+            speedup=base[1]/wall_time
+
+            results[f'scaling/{num_jobs}']={'num_jobs':num_jobs,
+                                            'num_sims':num_sims,
+                                            'total':wall_time,
+                                            'per_sec':num_sims/wall_time,
+                                            'speedup':speedup,
+                                            'efficiency':\
+                                              speedup*base[0]/num_jobs}
+
+    return results
+
+def run_benchmarks(output_file=None,quick=False,SEED=0,jobs=None,
+                   only=None):
+    '''
+    function to run the benchmark suite
+
+    Parameters
+    ----------
+    output_file - str, path-like, or None-type
+        if given, the results are written to this JSON file
+    quick - bool
+        if True, use a tenth of the calls and simulations, for a
+        fast check rather than stable numbers
+    SEED - int
+        root seed of every benchmark, so runs time the same work
+    jobs - iterable or None-type
+        num_jobs values for the scaling benchmark, by default 1, 2,
+        4, ... up to the number of CPUs
+    only - iterable or None-type
+        names of the benchmarks to run, out of 'encounters',
+        'enemies', 'difficulty', 'startup', 'pool', and 'scaling',
+        all by default
+
+    Returns
+    -------
+    dict
+        dictionary with keys
+          meta: machine, version, and settings details
+          results: statistics of each benchmark case
+    '''
+
+    scale=10 if quick else 1
+
+    if jobs is None:
+        num_cpus=os.cpu_count() or 1
+
+        jobs=[1]
+
+        while jobs[-1]*2<=num_cpus:
+            jobs.append(jobs[-1]*2)
+
+    benchmarks={'encounters':lambda:bench_encounters(2000//scale,SEED),
+                'enemies':lambda:bench_enemies(2000//scale,SEED),
+                'difficulty':lambda:bench_difficulty(20000//scale,SEED),
+                'startup':lambda:bench_startup(max(10//scale,2)),
+                'pool':lambda:bench_pool(max(20//scale,2),SEED=SEED),
+                'scaling':lambda:bench_scaling(num_sims=20000//scale,
+                                               jobs=jobs,SEED=SEED)}
+
+    if only is not None:
+        unknown=set(only)-set(benchmarks)
+
+        if unknown:
+            raise ValueError(f'Unknown benchmarks {sorted(unknown)}, must\
+ be from {list(benchmarks)}')
+
+    results={}
+
+    for name,benchmark in benchmarks.items():
+        if only is None or name in only:
+            results.update(benchmark())
+
+    report={'meta':{'date':datetime.now(timezone.utc).isoformat(),
+                    'python':platform.python_version(),
+                    'numpy':np.__version__,
+                    'platform':platform.platform(),
+                    'cpu_count':os.cpu_count(),
+                    'quick':quick,
+                    'seed':SEED},
+            'results':results}
+
+    if output_file is not None:
+        with open(output_file,'w') as jfile:
+            json.dump(report,jfile,indent=2)
+
+    return report
+
+def summary_table(report,baseline=None):
+    '''
+    function to format benchmark results as a text table
+
+    Parameters
+    ----------
+    report - dict
+        dictionary returned by run_benchmarks (or read from
+        its JSON file)
+    baseline - dict or None-type
+        earlier report to compare against, adds a column with
+        the ratio of the baseline time to the new time, so
+        values above 1 are speedups
+
+    Returns
+    -------
+    str
+        the table
+    '''
+
+    header=f'{"benchmark":<28}{"calls":>8}{"median":>12}{"p95":>12}\
+{"per sec":>12}'
+
+    if baseline is not None:
+        header+=f'{"vs base":>10}'
+
+    lines=[header,'-'*len(header)]
+
+    for name,stats in report['results'].items():
+        #scaling cases are single runs, so report the wall time
+        calls=stats.get('calls',stats.get('num_sims'))
+        median=stats.get('median',stats['total'])
+        p95=stats.get('p95')
+
+        line=f'{name:<28}{calls:>8}{_format_time(median):>12}\
+{_format_time(p95):>12}{stats["per_sec"]:>12.1f}'
+
+        if baseline is not None:
+            old=baseline['results'].get(name)
+            line+=f'{old.get("median",old["total"])/median:>10.2f}' \
+              if old is not None else f'{"-":>10}'
+
+        lines.append(line)
+
+    return '\n'.join(lines)
+
+def _format_time(seconds):
+    '''
+    function to format a time with sensible units
+    '''
+
+    if seconds is None:
+        return '-'
+
+    for unit,scale in [('s',1),('ms',1e-3),('us',1e-6)]:
+        if seconds>=scale:
+            return f'{seconds/scale:.3g} {unit}'
+
+    return f'{seconds/1e-9:.3g} ns'
+
+def _config_path(config_file):
+    '''
+    function to find a configuration file, either as given or
+    next to this module (e.g., the shipped difficulty files)
+    '''
+
+    config_file=Path(config_file)
+
+    if not config_file.exists() and not config_file.is_absolute():
+        config_file=Path(__file__).parent/config_file
+
+    return config_file
+
+def main(args=None):
+    '''
+    function to run the benchmarks from the command line, e.g.,
+
+    python benchmark.py --output bench.json --compare old_bench.json
+
+    Parameters
+    ----------
+    args - list or None-type
+        command line arguments, if None-type sys.argv is used
+    '''
+
+    parser=argparse.ArgumentParser(description='Benchmark the simulation\
+ hot paths')
+
+    parser.add_argument('--output',default=None,help='JSON file to write the\
+ results to')
+    parser.add_argument('--compare',default=None,help='JSON file of an\
+ earlier run to compare against')
+    parser.add_argument('--quick',action='store_true',help='run a tenth of\
+ the calls and simulations')
+    parser.add_argument('--seed',type=int,default=0,help='root seed')
+    parser.add_argument('--jobs',type=int,nargs='+',default=None,
+                        help='num_jobs values for the scaling benchmark')
+    parser.add_argument('--only',nargs='+',default=None,
+                        choices=['encounters','enemies','difficulty',
+                                 'startup','pool','scaling'],
+                        help='benchmarks to run, all by default')
+
+    parsed=parser.parse_args(args)
+
+    report=run_benchmarks(parsed.output,quick=parsed.quick,SEED=parsed.seed,
+                          jobs=parsed.jobs,only=parsed.only)
+
+    baseline=None
+
+    if parsed.compare is not None:
+        with open(parsed.compare,'r') as jfile:
+            baseline=json.load(jfile)
+
+    print(summary_table(report,baseline))
+
+    startup=report['results'].get('startup/encounter_worker')
+
+    if startup is not None and not startup['within_budget']:
+        print(f'\nImporting encounter_worker took\
+ {_format_time(startup["median"])}, over the {_format_time(STARTUP_BUDGET)}\
+ budget')
+
+if __name__=='__main__':
+    main()
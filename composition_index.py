@@ -0,0 +1,322 @@
+#class with a precomputed index of every possible enemy group
+#composition, so enemy groups matching a difficulty can be looked
+#up instead of built by random trial
+
+from functools import lru_cache
+
+import numpy as np
+
+from encounter_utils import (
+                    calculate_difficulty_batch,
+                    calculate_difficulty_boundaries,
+                    CR_codes,
+                    CR_NAMES,
+                    CR_XP,
+                    DIFFICULTIES,
+                    encounter_multiplier,
+                    valid_challenge_ratings,
+                    valid_difficulty
+                    )
+
+'''
+challenge ratings in the order used for the columns of the
+composition count arrays, lowest to highest
+'''
+
+CR_ORDER=CR_NAMES
+
+class CompositionIndex():
+    '''
+    class holding every enemy group composition, a count of enemies
+    for each challenge rating in CR_ORDER, up to a maximum group size,
+    along with the XP and difficulty category of each composition for
+    any number of PCs
+
+    ...
+
+    Attributes
+    ----------
+    compositions - numpy.ndarray
+        (num_compositions,7) array of enemy counts per challenge rating,
+        ordered by group size
+    max_size - int
+        the largest group size included
+    num_enemies - numpy.ndarray
+        group size of each composition
+    base_XP - numpy.ndarray
+        summed XP of each composition, before any modifier
+
+    Methods
+    -------
+    category(num_pcs)
+        method to get the difficulty category code of each composition
+    query(num_pcs,difficulty=None,num_enemies=None,CRs=None,max_XP=None)
+        method to get the compositions matching the given constraints
+    sample(num_pcs,difficulty=None,num_enemies=None,CRs=None,rng=None)
+        method to randomly pick a matching composition
+    total_XP(num_pcs)
+        method to get the modified total XP of each composition
+    '''
+
+    def __init__(self,MAX_SIZE=20):
+        '''
+        Parameters
+        ----------
+        MAX_SIZE - int
+            the largest enemy group size to include, 20 gives
+            888,029 compositions
+        '''
+
+        if MAX_SIZE<1:
+            raise ValueError(f'Maximum group size must be positive but\
+ {MAX_SIZE = } was passed in')
+
+        self.max_size=MAX_SIZE
+
+        #build every count vector with a total of at most MAX_SIZE
+        #one challenge rating at a time, each row is repeated once
+        #for every count the next challenge rating can still take
+        counts=np.arange(MAX_SIZE+1,dtype=np.int8)[:,None]
+
+        for _ in CR_ORDER[1:]:
+            room=MAX_SIZE-counts.sum(axis=1)
+            rows=np.repeat(counts,room+1,axis=0)
+
+            #0..room for each original row
+            starts=np.repeat(np.cumsum(room+1)-(room+1),room+1)
+            new=np.arange(rows.shape[0])-starts
+
+            counts=np.column_stack([rows,new.astype(np.int8)])
+
+        #drop the empty group and order by group size
+        sizes=counts.sum(axis=1)
+        order=np.argsort(sizes,kind='stable')
+        order=order[sizes[order]>0]
+
+        self.compositions=counts[order]
+        self.num_enemies=sizes[order].astype(np.int64)
+        self.base_XP=self.compositions@CR_XP
+
+        #start index of each group size, compositions are sorted by size
+        self._size_starts=np.searchsorted(self.num_enemies,
+                                          np.arange(MAX_SIZE+2))
+
+        #per number of PCs results, filled in as needed
+        self._total_XP={}
+        self._category={}
+        self._sample_candidates={}
+
+    def total_XP(self,num_pcs):
+        '''
+        method to get the total XP of each composition, including
+        the modifiers for the number of enemies and number of PCs,
+        the same values calculate_difficulty gives
+
+        Parameters
+        ----------
+        num_pcs - int
+            the number of PCs
+
+        Returns
+        -------
+        numpy.ndarray
+            total XP of each composition
+        '''
+
+        if num_pcs not in self._total_XP:
+            self._total_XP[num_pcs]=self.base_XP*\
+              encounter_multiplier(self.num_enemies,num_pcs)
+
+        return self._total_XP[num_pcs]
+
+    def category(self,num_pcs):
+        '''
+        method to get the difficulty category of each composition,
+        as an index into DIFFICULTIES
+
+        Parameters
+        ----------
+        num_pcs - int
+            the number of PCs
+
+        Returns
+        -------
+        numpy.ndarray
+            difficulty category code of each composition
+        '''
+
+        if num_pcs not in self._category:
+            self._category[num_pcs]=\
+              calculate_difficulty_batch(self.compositions,num_pcs)[1]
+
+        return self._category[num_pcs]
+
+    def query(self,num_pcs,difficulty=None,num_enemies=None,CRs=None,
+              max_XP=None):
+        '''
+        method to get every composition matching the constraints
+
+        Parameters
+        ----------
+        num_pcs - int
+            the number of PCs
+        difficulty - str or None-type
+            required difficulty category, any if None-type
+        num_enemies - int or None-type
+            required group size, any if None-type or non-positive
+        CRs - str, list, or None-type
+            allowed challenge rating(s), any if None-type
+        max_XP - float or None-type
+            total XP (with modifiers) must be below this value
+
+        Returns
+        -------
+        numpy.ndarray
+            (num_matches,7) array of enemy counts per challenge
+            rating in CR_ORDER
+        '''
+
+        return self.compositions[self._matches(num_pcs,difficulty,
+                                               num_enemies,CRs,max_XP)]
+
+    def sample(self,num_pcs,difficulty=None,num_enemies=None,CRs=None,
+               rng=None):
+        '''
+        method to randomly pick an enemy group matching the
+        constraints, if num_enemies is not given a group size is
+        first picked at random, with equal probability, out of the
+        sizes with any matching compositions, then a composition of
+        that size is picked with equal probability, deadly groups
+        are kept below three times the deadly XP boundary, as when
+        Enemies groups are built by random trial
+
+        Parameters
+        ----------
+        num_pcs - int
+            the number of PCs
+        difficulty - str or None-type
+            required difficulty category, any if None-type
+        num_enemies - int or None-type
+            required group size, any if None-type or non-positive
+        CRs - str, list, or None-type
+            allowed challenge rating(s), any if None-type
+        rng - numpy.random.default_rng or None-type
+            random number generator for the selection
+
+        Returns
+        -------
+        list or None-type
+            challenge ratings (strings) of the group members, lowest
+            first, or None-type if no composition matches
+        '''
+
+        rng=np.random.default_rng() if rng is None else rng
+
+        candidates=self._candidates(num_pcs,difficulty,num_enemies,CRs)
+
+        if not candidates:
+            return None
+
+        #pick the size first so large groups, which have many
+        #more compositions, do not dominate
+        matches=candidates[rng.integers(len(candidates))]
+
+        counts=self.compositions[matches[rng.integers(len(matches))]]
+
+        return [CR for CR,count in zip(CR_ORDER,counts) \
+                for _ in range(count)]
+
+    def _candidates(self,num_pcs,difficulty,num_enemies,CRs):
+        '''
+        method to get the indices of the compositions sample picks
+        from, split up by group size, kept after the first request
+        so repeated samples only cost two random draws
+        '''
+
+        if num_enemies is None or num_enemies<=0:
+            num_enemies=0
+
+        if CRs is not None:
+            CRs=(CRs,) if isinstance(CRs,str) else tuple(sorted(CRs))
+
+        key=(num_pcs,difficulty,num_enemies,CRs)
+
+        if key not in self._sample_candidates:
+            max_XP=None
+
+            if difficulty is not None and difficulty.lower()=='deadly':
+                max_XP=3*calculate_difficulty_boundaries(num_pcs)[3,1]
+
+            matches=np.flatnonzero(self._matches(num_pcs,difficulty,
+                                                 num_enemies,CRs,max_XP))
+
+            #compositions are sorted by size, so split where it changes
+            splits=np.flatnonzero(np.diff(self.num_enemies[matches]))+1
+
+            self._sample_candidates[key]=[group for group in \
+                                          np.split(matches,splits) \
+                                          if group.size]
+
+        return self._sample_candidates[key]
+
+    def _matches(self,num_pcs,difficulty,num_enemies,CRs,max_XP):
+        '''
+        method to get the boolean mask of compositions matching
+        the constraints, see query
+        '''
+
+        mask=np.ones(len(self.compositions),dtype=bool)
+
+        if num_enemies is not None and num_enemies>0:
+            if num_enemies>self.max_size:
+                raise ValueError(f'Index only holds groups of up to\
+ {self.max_size} enemies, {num_enemies = } was requested')
+
+            #compositions are sorted by size
+            mask[:]=False
+            mask[self._size_starts[num_enemies]:\
+                 self._size_starts[num_enemies+1]]=True
+
+        if difficulty is not None:
+            if not valid_difficulty(difficulty):
+                raise ValueError(f'Invalid encounter difficulty,\
+ "{difficulty}"')
+
+            mask&=self.category(num_pcs)==\
+              DIFFICULTIES.index(difficulty.lower())
+
+        if CRs is not None:
+            CRs=[CRs] if isinstance(CRs,str) else list(CRs)
+
+            if not valid_challenge_ratings(CRs):
+                raise ValueError(f'Invalid challenge rating(s) {CRs}')
+
+            #no enemies of the challenge ratings not allowed
+            allowed=np.zeros(len(CR_ORDER),dtype=bool)
+            allowed[CR_codes(CRs)]=True
+
+            mask&=~self.compositions[:,~allowed].any(axis=1)
+
+        if max_XP is not None:
+            mask&=self.total_XP(num_pcs)<max_XP
+
+        return mask
+
+@lru_cache(maxsize=None)
+def default_index(max_size=20):
+    '''
+    function to get a shared CompositionIndex, built the first
+    time it is needed in a process and reused afterwards
+
+    Parameters
+    ----------
+    max_size - int
+        the largest enemy group size to include
+
+    Returns
+    -------
+    CompositionIndex
+        the shared index
+    '''
+
+    return CompositionIndex(MAX_SIZE=max_size)
@@ -1,10 +1,32 @@
 #class with methods to actually run the encounters
 #needs Party and Enemies objects as inputs
 
-import time
+from bisect import insort
 
 import numpy as np
 
+from encounter_utils import CR_string,CR_to_XP
+
+#fixed layout of the results of one encounter, the fields of the
+#summary dictionary in the same order but with the challenge ratings
+#of the enemies as the number of each of the CR_to_XP keys (see
+#encounter_utils.CR_strings for the CRs strings), 73 bytes a record
+SUMMARY_DTYPE=np.dtype([('party_hp','int32'),
+                        ('party_extras','int16'),
+                        ('frac_party_hp','float64'),
+                        ('frac_party_extras','float64'),
+                        ('num_party_down','int8'),
+                        ('frac_party_down','float64'),
+                        ('success','bool'),
+                        ('enemies_hp','float64'),
+                        ('num_enemies_down','int8'),
+                        ('num_enemies','int8'),
+                        ('frac_enemies_down','float64'),
+                        ('CR_counts','uint8',(len(CR_to_XP),)),
+                        ('totalXP','float64'),
+                        ('num_rounds','int32'),
+                        ('num_turns','int32')])
+
 class Encounter():
     '''
     class to run a simulated encounter between a Party
@@ -28,14 +50,20 @@ class Encounter():
     party - Party
         the Party BattleGroup subclass object representing
         the PCs
+    random - EncounterRNG
+        source of the d20 rolls, extra usage draws, and random
+        combatant selections made during the turn loop
     rng - numpy.random.default_rng
         random number generator used for the encounter
     seed - int
         random seed used to instantiate the random number generator
     <subsequent>
-    combatant_down - numpy.ndarray
-        array with 0/1 flag indicating if each combatant with the same
+    combatant_down - list
+        list with 0/1 flag indicating if each combatant with the same
         index in initiative is down (1) or active (0)
+    enemies_down_threshold - float
+        when the enemies hit points are at or below this value, a
+        random enemy is downed, updated as the encounter progresses
     num_rounds - int
         number of rounds encounter took to complete, note that this
         will always round up (e.g., if a round ended after only 1 out
@@ -43,6 +71,11 @@ class Encounter():
     num_turns - int
         number of total turns encounter took to complete, only counts
         turns for a combatant is active
+    party_damage - int
+        total damage taken by the party since the last heal action
+    pc_down_threshold - float
+        when the party hit points are at or below this value, a
+        random PC is downed, updated as the encounter progresses
     summary - dict
         dictionary with the results of the encounter, with keys
           party_hp: ending total hit points of the party
@@ -63,6 +96,9 @@ class Encounter():
             the encounter
           frac_enemies_down: fraction of enemies down at the end
             of the encounter
+          CRs: challenge ratings of the enemies from lowest to
+            highest, joined by underscores
+          totalXP: total XP of the enemies, with modifiers
           num_rounds: number of rounds, always rounded up, that the
             encounter took to finish
           num_turns: number of turns, not counting downed combatant
@@ -90,12 +126,13 @@ class Encounter():
     pc_back_up()
         a method to randomly activate a down PC as the resulting
         of healing
-    run_encounter()
+    run_encounter(record=None)
         method to run the encounter, handling rounds and turns via
         calls to other class methods
-    run_round(round_status)
-        method to run a round of combat, keeping track of a status
-        dictionary
+    run_round()
+        method to run a round of combat, updating the damage and
+        down threshold attributes, and report if the encounter
+        has concluded
     run_turn(PC,party_damage)
         method to determine the outcome of a turn in a combat round
         with different rules for a PC turn or enemy turn, updates
@@ -108,13 +145,17 @@ class Encounter():
     update_pc_down_threshold()
         method to update the damage threshold for considering
         another PC to be down
+    write_summary(row)
+        method to write the results of a completed encounter
+        into a SUMMARY_DTYPE record
     _make_summary()
         method to create the summary attribute, a dictionary with
         information about a completed encounter
     
     '''
     
-    def __init__(self,party,enemies,SEED=None,RNG=None,initiative=None):
+    def __init__(self,party,enemies,SEED=None,RNG=None,initiative=None,
+                 RNG_MODE='buffered'):
         '''
         Parameters
         ----------
@@ -124,10 +165,10 @@ class Encounter():
         enemies - Enemies BattleGroup subclass
             the Enemies class object representing the enemies, see
             the battle_groups module for more information
-        SEED - int or None-type
+        SEED - int, numpy.random.SeedSequence, or None-type
             seed to instantiate the random number generator, if not
-            specified will use the the system unix timestamp cast as
-            an int, only used if RNG is None-type
+            specified will use fresh entropy from the operating system,
+            only used if RNG is None-type
         RNG - numpy.random.default_rng or None-type
             random number generator for the battle or a None-type which
             indicates that one is made using SEED
@@ -135,6 +176,11 @@ class Encounter():
             the initiative order, with PC turns represented by 1s and
             enemy turns represented by 0s, if not specified will be
             determined randomly
+        RNG_MODE - str
+            how random draws are made during the turn loop, see the
+            EncounterRNG class, 'buffered' (default) draws in blocks
+            while 'exact' reproduces the results of earlier versions
+            of the code for a given seed
         '''
         
         self.party=party
@@ -147,8 +193,10 @@ class Encounter():
             if self.party.num_members>1 else 0.5*self.party.hit_points
         
         if RNG is None:
-            #allow for setting random seed
-            self.seed=int(time.time()) if SEED is None else SEED
+            #allow for setting random seed, fresh entropy from the
+            #operating system avoids the repeats a timestamp can give
+            self.seed=np.random.SeedSequence().entropy if SEED is None \
+              else SEED
         
             #assign a random number generator to the encounter
             self.rng=np.random.default_rng(seed=self.seed)
@@ -156,6 +204,10 @@ class Encounter():
         else:
             self.rng=RNG
         
+        #draws made during the turn loop go through this,
+        #nothing is drawn until the first turn
+        self.random=EncounterRNG(self.rng,MODE=RNG_MODE)
+        
         #if not supplied as an input, randomly create
         #the initiative order
         if initiative is None:
@@ -204,40 +256,97 @@ class Encounter():
         self.initiative_order=self.rng.choice(combatants,size=combatants.shape,
                               replace=False)
     
-    def run_encounter(self):
+    def run_encounter(self,record=None):
         '''
         method to run the encounter and create the
         summary attribute with results and details
+        
+        Parameters
+        ----------
+        record - numpy.void or None-type
+            if given, a record with the SUMMARY_DTYPE fields (e.g.,
+            a row of a preallocated array) the results are written
+            into with write_summary, instead of creating the
+            summary attribute
         '''
         
-        #create array for knowing if a combatant has been
+        #plain python list version of the initiative order,
+        #faster to loop over than the numpy array
+        self._turn_order=self.initiative_order.tolist()
+        
+        #create list for knowing if a combatant has been
         #removed from the battle
-        self.combatant_down=np.zeros(len(self.initiative_order))
+        self.combatant_down=[0]*len(self._turn_order)
+        
+        #keep running counts and sorted index lists of active and
+        #down combatants, updated whenever someone goes down or gets
+        #back up, instead of recounting them every turn
+        self._up_pcs=[idx for idx,combatant in enumerate(self._turn_order) \
+                      if combatant==1]
+        self._down_pcs=[]
+        self._up_enemies=[idx for idx,combatant \
+                          in enumerate(self._turn_order) if combatant==0]
+        self._num_pcs_down=0
+        self._num_enemies_down=0
         
         #create attributes for tracking number of rounds and turns
         self.num_rounds=0
         self.num_turns=0
         
-        #use this to keep track of values and whether or not
-        #the encounter is finished
-        round_results={'party_damage':0,
-                      'pc_down_threshold':self.party.hit_points/2 if \
-                        self.party.num_members>1 else 0,
-                      'enemies_down_threshold':self.enemies.hit_points/2 if \
-                        self.enemies.num_members>1 else 0,
-                      'concluded':False}
+        #use these to keep track of values between turns and rounds
+        self.party_damage=0
+        self.pc_down_threshold=self.party.hit_points/2 if \
+          self.party.num_members>1 else 0
+        self.enemies_down_threshold=self.enemies.hit_points/2 if \
+          self.enemies.num_members>1 else 0
+        
+        concluded=False
                 
         #start a while loop for the rounds
-        while not round_results.get('concluded'):
+        while not concluded:
             
-            round_results=self.run_round(round_results)
+            concluded=self.run_round()
             
             #always increment the number of rounds, even if
             #it may have ended early
             self.num_rounds+=1
         
         #create the encounter summary
-        self._make_summary()
+        if record is None:
+            self._make_summary()
+        
+        else:
+            self.write_summary(record)
+    
+    def write_summary(self,row):
+        '''
+        method to write the results of a completed encounter into
+        a record, without building the summary dictionary
+        
+        Parameters
+        ----------
+        row - numpy.void
+            record with the SUMMARY_DTYPE fields, e.g., a row of a
+            preallocated array, written in place, any other fields
+            are left alone
+        '''
+        
+        row['party_hp']=self.party.hit_points
+        row['party_extras']=self.party.extras
+        row['frac_party_hp']=self.party.current_hit_point_fraction()
+        row['frac_party_extras']=self.party.current_extras_fraction()
+        row['num_party_down']=self._num_pcs_down
+        row['frac_party_down']=self._num_pcs_down/self.party.num_members
+        row['success']=not self.party.hit_points<=0
+        row['enemies_hp']=self.enemies.hit_points
+        row['num_enemies_down']=self._num_enemies_down
+        row['num_enemies']=self.enemies.num_members
+        row['frac_enemies_down']=\
+          self._num_enemies_down/self.enemies.num_members
+        row['CR_counts']=self.enemies.challenge_rating_counts()
+        row['totalXP']=self.enemies.total_XP
+        row['num_rounds']=self.num_rounds
+        row['num_turns']=self.num_turns
     
     def _make_summary(self):
         '''
@@ -245,13 +354,9 @@ class Encounter():
         the results and details of a completed encounter
         '''
         
-        #we want to be able to return the challenge ratings
-        #but not comma separated
-        if isinstance(self.enemies.challenge_ratings,str):
-            CRstring=self.enemies.challenge_ratings
-        
-        else:
-            CRstring='_'.join(self.enemies.challenge_ratings)
+        #the challenge ratings from lowest to highest, the same
+        #string for every group with the same members
+        CRstring=CR_string(self.enemies.challenge_rating_counts())
         
         #dictionary for ease of access to results
         #may rethink logic for 'success' key value
@@ -261,67 +366,52 @@ class Encounter():
                         self.party.current_hit_point_fraction(),
                       'frac_party_extras':\
                         self.party.current_extras_fraction(),
-                      'num_party_down':self.num_pcs_down(),
+                      'num_party_down':self._num_pcs_down,
                       'frac_party_down':\
-                        self.num_pcs_down()/self.party.num_members,
+                        self._num_pcs_down/self.party.num_members,
                       'success':not self.party.hit_points<=0,
                       'enemies_hp':self.enemies.hit_points,
-                      'num_enemies_down':self.num_enemies_down(),
+                      'num_enemies_down':self._num_enemies_down,
                       'num_enemies':self.enemies.num_members,
                       'frac_enemies_down':\
-                        self.num_enemies_down()/self.enemies.num_members,
+                        self._num_enemies_down/self.enemies.num_members,
                       'CRs':CRstring,
                       'totalXP':self.enemies.total_XP,
                       'num_rounds':self.num_rounds,
                       'num_turns':self.num_turns}
             
     
-    def run_round(self,round_status):
+    def run_round(self):
         '''
-        method to run a round of combat
-        
-        Parameters
-        ----------
-        round_status - dict
-            a dictionary with keys denoting the current damage
-            thresholds for downing a combatant of either party,
-            a key denoting how much damage the party has taken
-            since a heal, and a key with a flag to indicate if
-            the encounter has concluded
+        method to run a round of combat, updating the party_damage,
+        pc_down_threshold, and enemies_down_threshold attributes
         
         Returns
         -------
-        dict
-            and updated dictionary with the same keys as the input
-            dictionary
+        bool
+            True if the encounter has concluded, otherwise False
         '''
         
         #cycle through the the combatants, skip if down, and
         #break early if encounter end conditions are met
-        for idx,combatant in enumerate(self.initiative_order):
+        for idx,combatant in enumerate(self._turn_order):
             #check if the current combatant is up
             if not self.combatant_down[idx]:
                 #if they are, run the turn and update the damage
                 #taken by the party since last heal
-                round_status.update(\
-                  [('party_damage',
-                  self.run_turn(combatant,round_status.get('party_damage')))])
+                self.party_damage=self.run_turn(combatant,self.party_damage)
                 
                 #if combatant is 0, enemy, PC might need to be
                 #considered down
                 if not combatant:
-                    round_status.update(\
-                      [('pc_down_threshold',
-                        self.check_down_pc(round_status\
-                          .get('pc_down_threshold')))])
+                    self.pc_down_threshold=\
+                      self.check_down_pc(self.pc_down_threshold)
                 
                 #otherwise, see if an enemy should be
                 #considered down
                 else:
-                    round_status.update(\
-                      [('enemies_down_threshold',
-                        self.check_down_enemy(round_status\
-                         .get('enemies_down_threshold')))])
+                    self.enemies_down_threshold=\
+                      self.check_down_enemy(self.enemies_down_threshold)
                 
                 #only count a turn if the combatant is active
                 self.num_turns+=1
@@ -333,13 +423,7 @@ class Encounter():
             if self.encounter_over():
                 break
         
-        #update the round_status by returning the round_results
-        round_results={'party_damage':round_status.get('party_damage'),
-          'pc_down_threshold':round_status.get('pc_down_threshold'),
-          'enemies_down_threshold':round_status.get('enemies_down_threshold'),
-          'concluded':self.encounter_over()}
-        
-        return round_results
+        return self.encounter_over()
     
     def run_turn(self,PC,party_damage):
         '''
@@ -372,7 +456,7 @@ class Encounter():
                 #the heal threshold or any PCs are down,
                 #perform a heal action
                 if party_damage>=self.heal_threshold or \
-                 self.num_pcs_down()>0:
+                 self._num_pcs_down>0:
                     #reduce number of extras and increase
                     #hit points by average/typical value
                     self.party.extras-=1
@@ -385,14 +469,14 @@ class Encounter():
                     #now check if a PC was down, assume the healing
                     #got them back up from 0, not currently working with
                     #death (e.g., failed death saves or massive damage)
-                    if self.num_pcs_down()>0:
+                    if self._num_pcs_down>0:
                         self.pc_back_up()
                 
                 #if we didn't meet the heal threshold, posit
                 #that there is a 10% chance of using an extra
                 #for more damage (spell slot, etc.)    
                 else:
-                    use_extra=self.rng.binomial(1,0.1)
+                    use_extra=self.random.use_extra()
                     self.party.extras-=use_extra
             
             #if no extras available, set value to 0 and move to damage
@@ -402,7 +486,7 @@ class Encounter():
             #if we didn't heal, attempt to do damage
             if not healed:        
                 #roll a d20
-                d20=self.rng.integers(1,20,endpoint=True)
+                d20=self.random.d20()
                 
                 #determine if the attack hits
                 if d20>1 and \
@@ -427,7 +511,7 @@ class Encounter():
         else:
             #assume no healing or extras at this level
             #so just roll a d20
-            d20=self.rng.integers(1,20,endpoint=True)
+            d20=self.random.d20()
             
             #check if the attack hits
             if d20>1 and \
@@ -510,38 +594,32 @@ class Encounter():
         method to randomly down an active PC
         '''
         
-        #get an array with entries set to True if the
-        #combatant is a PC and is active and get the
-        #corresponding indices
-        up_pcs=(self.initiative_order==1)&(self.combatant_down==0)
-        up_pcs_idx=[idx for idx,flag in enumerate(up_pcs) if flag]
-        
-        #make sure we have a non-empty list
-        if up_pcs_idx:
+        #make sure we have an active PC, the list of their
+        #indices is kept sorted so the selection matches earlier
+        #versions of the code that rebuilt it every time
+        if self._up_pcs:
             #randomly pick an active PC to down
-            down_idx=self.rng.choice(up_pcs_idx,size=1)[0]
+            down_idx=self._up_pcs.pop(self.random.select(len(self._up_pcs)))
+            insort(self._down_pcs,down_idx)
             
-            #update the combatant_down array
+            #update the combatant_down list and count
             self.combatant_down[down_idx]=1
+            self._num_pcs_down+=1
     
     def down_enemy(self):
         '''
         method to randomly down an active enemy
         '''
         
-        #get an array with entries set to True if the
-        #combatant is an enemy and is active and get
-        #the corresponding indices
-        up_enemies=(self.initiative_order==0)&(self.combatant_down==0)
-        up_enemies_idx=[idx for idx,flag in enumerate(up_enemies) if flag]
-        
-        #make sure we have a non-empty list
-        if up_enemies_idx:
+        #make sure we have an active enemy
+        if self._up_enemies:
             #randomly pick an up enemy to known out
-            down_idx=self.rng.choice(up_enemies_idx,size=1)[0]
+            down_idx=self._up_enemies.pop(\
+              self.random.select(len(self._up_enemies)))
             
-            #update the combatant_down array
+            #update the combatant_down list and count
             self.combatant_down[down_idx]=1
+            self._num_enemies_down+=1
     
     def update_pc_down_threshold(self):
         '''
@@ -557,7 +635,7 @@ class Encounter():
         #either set the threshold to 0 or the current
         #party total HP divided by the number of active
         #PCs, rounded down
-        num_pcs=self.party.num_members-self.num_pcs_down()
+        num_pcs=self.party.num_members-self._num_pcs_down
         return 0 if num_pcs<=1 else \
           self.party.hit_points-self.party.hit_points//num_pcs
     
@@ -575,7 +653,7 @@ class Encounter():
         #either set the threshold to 0 or the current
         #total enemy HP divided by the number of active
         #enemies, rounded down
-        num_enemies=self.enemies.num_members-self.num_enemies_down()
+        num_enemies=self.enemies.num_members-self._num_enemies_down
         return 0 if num_enemies<=1 else \
           self.enemies.hit_points-self.enemies.hit_points//num_enemies
     
@@ -589,7 +667,7 @@ class Encounter():
             the number of down PCs
         '''
         
-        return sum(self.initiative_order[self.combatant_down==1])
+        return self._num_pcs_down
     
     def num_enemies_down(self):
         '''
@@ -601,25 +679,22 @@ class Encounter():
             the number of down enemies
         '''
         
-        return sum(self.initiative_order[self.combatant_down==1]==0)
+        return self._num_enemies_down
     
     def pc_back_up(self):
         '''
         method to reactivate a random down PC
         '''
         
-        #get an array of True if combatant is a PC and is down
-        #and get the corresponding indices
-        downed_pcs=(self.initiative_order==1)&(self.combatant_down==1)
-        downed_pcs_idx=[idx for idx,flag in enumerate(downed_pcs) if flag]
-                
-        #make sure we don't have an empty list
-        if downed_pcs_idx:
+        #make sure we have a down PC
+        if self._down_pcs:
             #randomly select a PC to reactivate
-            up_idx=self.rng.choice(downed_pcs_idx,size=1)[0]
+            up_idx=self._down_pcs.pop(self.random.select(len(self._down_pcs)))
+            insort(self._up_pcs,up_idx)
             
             #set the combatant_down flag to 0 for the newly raised PC
             self.combatant_down[up_idx]=0
+            self._num_pcs_down-=1
     
     def encounter_over(self):
         '''
@@ -636,10 +711,10 @@ class Encounter():
         #be extra sure
         
         #are all PCs down?
-        all_pcs_down=self.party.num_members==self.num_pcs_down()
+        all_pcs_down=self.party.num_members==self._num_pcs_down
         
         #are all enemies defeated?
-        all_enemies_down=self.enemies.num_members==self.num_enemies_down()
+        all_enemies_down=self.enemies.num_members==self._num_enemies_down
         
         #is the party HP at 0?
         party_zero_hp=self.party.hit_points<=0
@@ -648,4 +723,170 @@ class Encounter():
         enemies_zero_hp=self.enemies.hit_points<=0
         
         return all_pcs_down or all_enemies_down or party_zero_hp or enemies_zero_hp
-        
\ No newline at end of file
+
+class EncounterRNG():
+    '''
+    class to supply the random draws needed in the Encounter
+    turn loop: d20 rolls, the 10% chance of a PC using an extra,
+    and the random selection of which combatant is downed or
+    gets back up
+    
+    ...
+    
+    Two modes are available:
+      'buffered': d20 rolls, extra usage draws, and selection
+        uniforms are each drawn from the generator in blocks of
+        block_size values and handed out one at a time, with a
+        new block drawn once one runs out, this avoids most of
+        the generator call overhead but results for a given seed
+        differ from the 'exact' mode
+      'exact': every draw is a direct call to the generator with
+        the same calls, in the same order, as earlier versions of
+        the Encounter class, so results are bit-identical to those
+        versions for a given seed (e.g., to reproduce old CSVs)
+    
+    Attributes
+    ----------
+    block_size - int
+        number of values drawn at once for each buffer in the
+        'buffered' mode
+    mode - str
+        either 'buffered' or 'exact'
+    rng - numpy.random.default_rng
+        the random number generator the draws are made from
+    
+    Methods
+    -------
+    d20()
+        method to roll a d20
+    select(num_options)
+        method to randomly select an index out of num_options
+    use_extra()
+        method to decide if a PC uses an extra, 10% chance
+    '''
+    
+    def __init__(self,RNG,MODE='buffered',BLOCK_SIZE=128):
+        '''
+        Parameters
+        ----------
+        RNG - numpy.random.default_rng
+            random number generator to make the draws from
+        MODE - str
+            either 'buffered' or 'exact', see class description
+        BLOCK_SIZE - int
+            number of values drawn at once for each buffer in the
+            'buffered' mode, ignored in the 'exact' mode
+        '''
+        
+        if MODE not in ['buffered','exact']:
+            raise ValueError(f'Invalid random draw mode, "{MODE}", must\
+ be either "buffered" or "exact"')
+        
+        if BLOCK_SIZE<1:
+            raise ValueError(f'Block size must be positive but\
+ {BLOCK_SIZE = } was passed in')
+        
+        self.rng=RNG
+        self.mode=MODE
+        self.block_size=BLOCK_SIZE
+        
+        #buffers start empty and are filled on first use, so
+        #that nothing is drawn until the turn loop starts
+        self._d20s=[]
+        self._d20_idx=0
+        self._extras=[]
+        self._extras_idx=0
+        self._uniforms=[]
+        self._uniforms_idx=0
+        
+        #in exact mode, swap in the direct generator calls
+        if self.mode=='exact':
+            self.d20=self._exact_d20
+            self.use_extra=self._exact_use_extra
+            self.select=self._exact_select
+    
+    def d20(self):
+        '''
+        method to roll a d20
+        
+        Returns
+        -------
+        int
+            a value from 1 to 20
+        '''
+        
+        if self._d20_idx>=len(self._d20s):
+            #python ints are faster to hand out than numpy ints
+            self._d20s=self.rng.integers(1,20,size=self.block_size,
+                                         endpoint=True).tolist()
+            self._d20_idx=0
+        
+        self._d20_idx+=1
+        
+        return self._d20s[self._d20_idx-1]
+    
+    def use_extra(self):
+        '''
+        method to decide if a PC uses an extra for more damage,
+        with a 10% chance
+        
+        Returns
+        -------
+        int
+            1 if an extra is used, otherwise 0
+        '''
+        
+        if self._extras_idx>=len(self._extras):
+            self._extras=self.rng.binomial(1,0.1,size=self.block_size)\
+                .tolist()
+            self._extras_idx=0
+        
+        self._extras_idx+=1
+        
+        return self._extras[self._extras_idx-1]
+    
+    def select(self,num_options):
+        '''
+        method to randomly select one of num_options
+        with equal probability
+        
+        Parameters
+        ----------
+        num_options - int
+            the number of options to choose from
+        
+        Returns
+        -------
+        int
+            the index of the selected option
+        '''
+        
+        if self._uniforms_idx>=len(self._uniforms):
+            self._uniforms=self.rng.random(self.block_size).tolist()
+            self._uniforms_idx=0
+        
+        self._uniforms_idx+=1
+        
+        return int(self._uniforms[self._uniforms_idx-1]*num_options)
+    
+    def _exact_d20(self):
+        '''
+        exact mode version of d20()
+        '''
+        
+        return self.rng.integers(1,20,endpoint=True)
+    
+    def _exact_use_extra(self):
+        '''
+        exact mode version of use_extra()
+        '''
+        
+        return self.rng.binomial(1,0.1)
+    
+    def _exact_select(self,num_options):
+        '''
+        exact mode version of select(), choosing an index is
+        the same draw as choosing from a list of that length
+        '''
+        
+        return self.rng.choice(num_options,size=1)[0]
@@ -0,0 +1,576 @@
+#Encounter subclass that reports the events of the turn loop to
+#hook objects, and hooks to count the events and time the turns
+
+import time
+
+from encounter import Encounter
+
+class EncounterHooks():
+    '''
+    class with the hook methods called by a HookedEncounter, each
+    one does nothing here, subclasses override the ones they need
+
+    ...
+
+    Methods
+    -------
+    attack(encounter,PC,d20,hit)
+        called after an attack roll
+    down(encounter,PC)
+        called after a combatant is downed
+    extra(encounter)
+        called after a PC uses an extra for more damage
+    heal(encounter)
+        called after a PC uses an extra to heal
+    revive(encounter)
+        called after a down PC is healed back up
+    start(encounter)
+        called before the first round of an encounter
+    summary()
+        method to get the values to add to the encounter summary
+    turn_end(encounter,PC)
+        called after a combatant's turn
+    turn_start(encounter,PC)
+        called before a combatant's turn
+    '''
+
+    def start(self,encounter):
+        '''
+        called once at the start of HookedEncounter.run_encounter,
+        before the first round, so per encounter values can be reset
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the encounter about to run
+        '''
+
+        pass
+
+    def turn_start(self,encounter,PC):
+        '''
+        called at the start of every combatant turn, before
+        anything in the turn has happened
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the running encounter
+        PC - int
+            indicator of if the active combatant is a PC (1)
+            or an enemy (0)
+        '''
+
+        pass
+
+    def turn_end(self,encounter,PC):
+        '''
+        called at the end of every combatant turn, after its heal,
+        extra, and attack hooks, but before the checks for
+        combatants going down that follow the turn
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the running encounter
+        PC - int
+            indicator of if the active combatant is a PC (1)
+            or an enemy (0)
+        '''
+
+        pass
+
+    def heal(self,encounter):
+        '''
+        called after a PC turn in which the party used an extra to
+        heal, in place of attacking, before turn_end
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the running encounter
+        '''
+
+        pass
+
+    def extra(self,encounter):
+        '''
+        called after a PC turn in which the party used an extra for
+        more damage on its attack, before the attack hook
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the running encounter
+        '''
+
+        pass
+
+    def attack(self,encounter,PC,d20,hit):
+        '''
+        called after a turn with an attack roll, before turn_end
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the running encounter
+        PC - int
+            indicator of if the attacker is a PC (1) or an enemy (0)
+        d20 - int
+            the attack roll, from 1 to 20, a 20 is a critical hit
+            and a 1 always misses
+        hit - bool
+            True if the attack hit, the roll plus the attacker's to
+            hit bonus reached the target's armor class (or was a 20)
+        '''
+
+        pass
+
+    def down(self,encounter,PC):
+        '''
+        called after a combatant is downed, at most once for
+        each down check after a turn
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the running encounter
+        PC - int
+            indicator of if the downed combatant is a PC (1)
+            or an enemy (0)
+        '''
+
+        pass
+
+    def revive(self,encounter):
+        '''
+        called after a heal brings a down PC back into the encounter,
+        during the healing PC's turn, so before the heal hook
+
+        Parameters
+        ----------
+        encounter - HookedEncounter
+            the running encounter
+        '''
+
+        pass
+
+    def summary(self):
+        '''
+        method to get the values to add to the encounter summary
+
+        Returns
+        -------
+        dict
+            dictionary of summary keys and values
+        '''
+
+        return {}
+
+class EventCounter(EncounterHooks):
+    '''
+    class to count the heals, extras used, critical hits, misses,
+    downs, and revives of an encounter
+
+    ...
+
+    Attributes
+    ----------
+    counts - dict
+        counts of each event in the current (or last) encounter,
+        with keys given by EVENTS
+    totals - dict
+        counts of each event summed over every encounter
+        this object has been used with
+
+    Methods
+    -------
+    summary()
+        method to get the counts of the last encounter
+    '''
+
+    EVENTS=['num_heals','num_extras','num_pc_crits','num_pc_misses',
+            'num_enemy_crits','num_enemy_misses','num_pc_downs',
+            'num_enemy_downs','num_revives']
+
+    def __init__(self):
+        self.counts=dict.fromkeys(self.EVENTS,0)
+        self.totals=dict.fromkeys(self.EVENTS,0)
+
+    def _count(self,event):
+        '''
+        method to add one to the count and total of an event
+        '''
+
+        self.counts[event]+=1
+        self.totals[event]+=1
+
+    def start(self,encounter):
+        '''
+        method to reset the counts for a new encounter,
+        the totals are kept
+        '''
+
+        self.counts=dict.fromkeys(self.EVENTS,0)
+
+    def heal(self,encounter):
+        '''
+        method to count a heal
+        '''
+
+        self._count('num_heals')
+
+    def extra(self,encounter):
+        '''
+        method to count an extra used for more damage
+        '''
+
+        self._count('num_extras')
+
+    def attack(self,encounter,PC,d20,hit):
+        '''
+        method to count a critical hit (a d20 of 20) or a miss by
+        the PCs or the enemies, other hits are not counted
+        '''
+
+        if d20==20:
+            self._count('num_pc_crits' if PC else 'num_enemy_crits')
+
+        elif not hit:
+            self._count('num_pc_misses' if PC else 'num_enemy_misses')
+
+    def down(self,encounter,PC):
+        '''
+        method to count a downed PC or enemy
+        '''
+
+        self._count('num_pc_downs' if PC else 'num_enemy_downs')
+
+    def revive(self,encounter):
+        '''
+        method to count a PC brought back up
+        '''
+
+        self._count('num_revives')
+
+    def summary(self):
+        '''
+        method to get the counts of the last encounter
+
+        Returns
+        -------
+        dict
+            dictionary with the count of each event
+        '''
+
+        return dict(self.counts)
+
+class TurnTimer(EncounterHooks):
+    '''
+    class to time the turns of an encounter, only the turn
+    itself is timed, not the down checks that follow it
+
+    ...
+
+    Attributes
+    ----------
+    num_turns - int
+        number of turns timed in the current (or last) encounter
+    turn_time - float
+        total time, in seconds, of the turns in the current
+        (or last) encounter
+    total_turns - int
+        number of turns timed over every encounter
+    total_time - float
+        total time, in seconds, of the turns over every encounter
+
+    Methods
+    -------
+    summary()
+        method to get the total and mean turn time of
+        the last encounter
+    '''
+
+    def __init__(self):
+        self.num_turns=0
+        self.turn_time=0.
+        self.total_turns=0
+        self.total_time=0.
+
+    def start(self,encounter):
+        '''
+        method to reset the turn count and time for a new
+        encounter, the totals are kept
+        '''
+
+        self.num_turns=0
+        self.turn_time=0.
+
+    def turn_start(self,encounter,PC):
+        '''
+        method to start the clock on a turn
+        '''
+
+        self._start=time.perf_counter()
+
+    def turn_end(self,encounter,PC):
+        '''
+        method to stop the clock on a turn and add its time
+        to the encounter and overall totals
+        '''
+
+        elapsed=time.perf_counter()-self._start
+
+        self.num_turns+=1
+        self.turn_time+=elapsed
+        self.total_turns+=1
+        self.total_time+=elapsed
+
+    def summary(self):
+        '''
+        method to get the total and mean turn time of the last encounter
+
+        Returns
+        -------
+        dict
+            dictionary with keys
+              turn_time: total time of the turns, in seconds
+              mean_turn_time: turn_time divided by the number of turns
+        '''
+
+        return {'turn_time':self.turn_time,
+                'mean_turn_time':self.turn_time/self.num_turns \
+                  if self.num_turns else 0.}
+
+class HookedEncounter(Encounter):
+    '''
+    Encounter subclass that reports the events of the turn loop to
+    a list of EncounterHooks objects, and adds the values from their
+    summary methods to the summary attribute (or to the matching
+    fields of the record given to run_encounter), the plain Encounter
+    class has no hooks so it pays nothing for them
+
+    ...
+
+    Attributes
+    ----------
+    hooks - list
+        list of EncounterHooks objects
+
+    See the Encounter class for the other attributes and methods
+    '''
+
+    def __init__(self,party,enemies,hooks,**kwargs):
+        '''
+        Parameters
+        ----------
+        party - Party BattleGroup subclass
+            the Party class object representing the PCs
+        enemies - Enemies BattleGroup subclass
+            the Enemies class object representing the enemies
+        hooks - list
+            list of EncounterHooks objects, called in order
+        kwargs
+            keyword arguments passed on to Encounter (SEED, RNG,
+            initiative, RNG_MODE)
+        '''
+
+        super().__init__(party,enemies,**kwargs)
+
+        self.hooks=list(hooks)
+
+        #record the d20 rolls so the attack hooks can see them,
+        #the draws themselves are unchanged
+        self.random=_RecordedRNG(self.random)
+
+    def run_encounter(self,record=None):
+        '''
+        method to call the start hooks and then run the
+        encounter, see Encounter.run_encounter
+
+        Parameters
+        ----------
+        record - numpy.void or None-type
+            if given, a record the results (and hook values with
+            a matching field) are written into, instead of
+            creating the summary attribute
+        '''
+
+        for hook in self.hooks:
+            hook.start(self)
+
+        super().run_encounter(record)
+
+    def write_summary(self,row):
+        '''
+        method to write the results of a completed encounter into
+        a record, see Encounter.write_summary, along with the hook
+        summary values whose keys are fields of the record
+
+        Parameters
+        ----------
+        row - numpy.void
+            record with the encounter.SUMMARY_DTYPE fields, and
+            possibly fields for hook values, written in place
+        '''
+
+        super().write_summary(row)
+
+        #hook values are written to the fields the record has
+        for hook in self.hooks:
+            for key,value in hook.summary().items():
+                if key in row.dtype.names:
+                    row[key]=value
+
+    def _make_summary(self):
+        '''
+        method to create the summary attribute, with the
+        summary values of every hook added
+        '''
+
+        super()._make_summary()
+
+        for hook in self.hooks:
+            self.summary.update(hook.summary())
+
+    def run_turn(self,PC,party_damage):
+        '''
+        method to run a combatant turn, see Encounter.run_turn,
+        calling turn_start before it and then, from what changed
+        during the turn, the heal or extra, attack, and turn_end
+        hooks after it
+
+        Parameters
+        ----------
+        PC - int
+            indicator of if the active combatant is a PC (1)
+            or an enemy (0)
+        party_damage - int
+            total damage currently taken by the party since
+            the last heal action
+
+        Returns
+        -------
+        int
+            the updated party damage value
+        '''
+
+        for hook in self.hooks:
+            hook.turn_start(self,PC)
+
+        extras=self.party.extras
+        hit_points=self.party.hit_points
+        self.random.last_d20=None
+
+        party_damage=super().run_turn(PC,party_damage)
+
+        #a PC turn only raises the party hit points with a heal,
+        #otherwise an extra used goes to the attack
+        if PC and self.party.extras<extras:
+            if self.party.hit_points>hit_points:
+                for hook in self.hooks:
+                    hook.heal(self)
+
+            else:
+                for hook in self.hooks:
+                    hook.extra(self)
+
+        d20=self.random.last_d20
+
+        if d20 is not None:
+            to_hit,armor_class=(self.party.to_hit,self.enemies.armor_class) \
+              if PC else (self.enemies.to_hit,self.party.armor_class)
+
+            hit=d20>1 and (d20+to_hit>=armor_class or d20==20)
+
+            for hook in self.hooks:
+                hook.attack(self,PC,d20,hit)
+
+        for hook in self.hooks:
+            hook.turn_end(self,PC)
+
+        return party_damage
+
+    def down_pc(self):
+        '''
+        method to randomly down an active PC, see Encounter.down_pc,
+        calling the down hooks if one was downed
+        '''
+
+        if self._up_pcs:
+            super().down_pc()
+
+            for hook in self.hooks:
+                hook.down(self,1)
+
+    def down_enemy(self):
+        '''
+        method to randomly down an active enemy, see
+        Encounter.down_enemy, calling the down hooks
+        if one was downed
+        '''
+
+        if self._up_enemies:
+            super().down_enemy()
+
+            for hook in self.hooks:
+                hook.down(self,0)
+
+    def pc_back_up(self):
+        '''
+        method to reactivate a random down PC, see
+        Encounter.pc_back_up, calling the revive hooks
+        if one was brought back up
+        '''
+
+        if self._down_pcs:
+            super().pc_back_up()
+
+            for hook in self.hooks:
+                hook.revive(self)
+
+class _RecordedRNG():
+    '''
+    class wrapping an EncounterRNG to keep the last d20 roll, so
+    HookedEncounter.run_turn can tell if the turn had an attack
+    and what was rolled, the other draws are passed straight
+    through and every draw is unchanged
+
+    ...
+
+    Attributes
+    ----------
+    last_d20 - int or None-type
+        the last d20 rolled, reset to None-type by
+        HookedEncounter.run_turn before each turn
+    random - EncounterRNG
+        the wrapped random number source
+    '''
+
+    def __init__(self,random):
+        '''
+        Parameters
+        ----------
+        random - EncounterRNG
+            the random number source of the encounter
+        '''
+
+        self.random=random
+        self.last_d20=None
+
+        self.use_extra=random.use_extra
+        self.select=random.select
+
+    def d20(self):
+        '''
+        method to roll a d20 with the wrapped source and keep it
+
+        Returns
+        -------
+        int
+            a value from 1 to 20
+        '''
+
+        self.last_d20=self.random.d20()
+
+        return self.last_d20
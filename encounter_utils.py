@@ -3,8 +3,8 @@
 
 import numpy as np
 import time
-import yaml
-from functools import reduce
+from fractions import Fraction
+from functools import lru_cache,reduce
 
 '''
 look-up dictionary for XP by challenge rating
@@ -31,6 +31,14 @@ XP_difficulty_by_level={1:\
                     'deadly':100}
                     }
 
+'''
+difficulty categories from lowest to highest, the order of the
+rows of calculate_difficulty_boundaries and of the category codes
+returned by calculate_difficulty_batch
+'''
+
+DIFFICULTIES=['easy','medium','hard','deadly']
+
 '''
 look-up dictionary for the average enemy hit points
 based on challenge rating
@@ -57,6 +65,45 @@ CR_ave_DMG={'0':1,
             '2':17.5,
             '3':23.5}
 
+'''
+integer code of each challenge rating (its position in CR_to_XP),
+and arrays of the per-enemy XP, average hit points, average damage,
+and to hit bonus indexed by code, so challenge ratings can be kept
+as small int arrays and looked up with a single gather
+'''
+
+CR_CODES={CR:code for code,CR in enumerate(CR_to_XP)}
+CR_NAMES=list(CR_to_XP)
+
+CR_XP=np.array([CR_to_XP[CR] for CR in CR_to_XP])
+CR_HP=np.array([CR_ave_HP[CR] for CR in CR_to_XP],dtype=float)
+CR_DMG=np.array([CR_ave_DMG[CR] for CR in CR_to_XP],dtype=float)
+CR_TO_HIT=np.array([4 if CR=='3' else 3 for CR in CR_to_XP])
+
+#float value of each challenge rating, see CR_to_float
+_CR_FLOATS={CR:float(Fraction(CR)) for CR in CR_to_XP}
+
+'''
+configuration values used when not given (the write_configuration
+defaults), and optional configuration flags, which default to False
+'''
+
+DEFAULT_CONFIGURATION={'difficulty':'easy',
+                       'num_pcs':5,
+                       'extras':5,
+                       'pcs_levels':1,
+                       'pcs_AC':13,
+                       'pcs_ATK':5,
+                       'pcs_HP':8.5,
+                       'num_enemies':0,
+                       'enemies_AC':3,
+                       'enemies_ATK':13,
+                       'enemies_HP':0,
+                       'CRs':None,
+                       'initiative':None}
+
+OPTIONAL_KEYS=['group_index','count_events']
+
 def CR_to_float(CR):
     '''
     function to convert challenge rating string to a
@@ -75,9 +122,37 @@ def CR_to_float(CR):
         rating string
     '''
     
+    if CR in _CR_FLOATS:
+        return _CR_FLOATS[CR]
+    
     return reduce(lambda n,d:float(n)/float(d),CR.split('/')) \
       if len(CR)>1 else float(CR)
 
+def CR_codes(CRs):
+    '''
+    function to convert challenge rating strings into integer
+    codes, see CR_CODES
+    
+    Parameters
+    ----------
+    CRs - str, list, or numpy.ndarray
+        a challenge rating string or list of strings, an integer
+        array is taken to be codes already and returned as is
+    
+    Returns
+    -------
+    numpy.ndarray
+        int8 array with the code of each challenge rating
+    '''
+    
+    if isinstance(CRs,np.ndarray) and CRs.dtype.kind in 'iu':
+        return CRs
+    
+    if isinstance(CRs,str):
+        CRs=[CRs]
+    
+    return np.array([CR_CODES[CR] for CR in CRs],dtype=np.int8)
+
 def valid_difficulty(DIFFICULTY):
     '''
     function to check if a requested encounter difficulty
@@ -136,6 +211,10 @@ def valid_configuration(config_file):
         True or False result of validation
     '''
     
+    #yaml is only imported to read configuration files,
+    #the simulation code itself never needs it
+    import yaml
+    
     #first, try to open the file
     try:
         with open(config_file,'r') as cfile:
@@ -156,6 +235,123 @@ def valid_configuration(config_file):
     return set(expected_keys).issubset(config.keys())
 
 
+def load_configuration(config_file):
+    '''
+    function to read and validate a configuration file, meant
+    to be called once per set of simulations with the returned
+    dictionary handed to the code running the simulations
+    
+    Parameters
+    ----------
+    config_file - str or path-like
+        configuration file to read
+    
+    Returns
+    -------
+    dict
+        the configuration, with the 'None' placeholders for
+        the CRs and initiative keys converted to None-type, an
+        optional 'group_index' entry (True or False) picks random
+        enemy groups from the precomputed composition index and an
+        optional 'count_events' entry (True or False) adds counts
+        of the turn loop events to each encounter summary
+    '''
+    
+    #make sure that the configuration exists
+    #and has valid options
+    if not valid_configuration(config_file):
+        raise RuntimeError(f'{config_file} has invalid parameters')
+    
+    import yaml
+    
+    with open(config_file,'r') as cfile:
+        config=yaml.safe_load(cfile)
+    
+    #make sure a valid difficulty category has been supplied
+    if not valid_difficulty(config['difficulty']):
+        raise ValueError(f'difficulty = {config["difficulty"]} is not valid,\
+ must be one of "easy", "medium", "hard", or "deadly".  Case does not matter.')
+    
+    #write_configuration saves missing values as the string 'None'
+    for key in ['CRs','initiative']:
+        if config.get(key)=='None':
+            config[key]=None
+    
+    return config
+
+def normalize_configuration(config):
+    '''
+    function to check a configuration dictionary (e.g., one sent
+    by a client rather than read from a file) and put it in a
+    standard form, so configurations describing the same
+    encounter compare equal
+    
+    Parameters
+    ----------
+    config - dict
+        configuration with any of the keys of a configuration file,
+        missing keys get the values in DEFAULT_CONFIGURATION
+    
+    Returns
+    -------
+    dict
+        the configuration with every key in DEFAULT_CONFIGURATION
+        in that order, a lower case difficulty, whole numbers as
+        ints, CRs as a list sorted from lowest to highest or
+        None-type, and the OPTIONAL_KEYS that are set
+    '''
+    
+    unknown=set(config)-set(DEFAULT_CONFIGURATION)-set(OPTIONAL_KEYS)
+    
+    if unknown:
+        raise ValueError(f'Unknown configuration keys {sorted(unknown)}')
+    
+    normalized={}
+    
+    for key,default in DEFAULT_CONFIGURATION.items():
+        value=config.get(key,default)
+        
+        #write_configuration saves missing values as the string 'None'
+        normalized[key]=None if value=='None' else value
+    
+    if not isinstance(normalized['difficulty'],str) or \
+      not valid_difficulty(normalized['difficulty']):
+        raise ValueError(f'difficulty = {normalized["difficulty"]} is not\
+ valid, must be one of "easy", "medium", "hard", or "deadly".')
+    
+    normalized['difficulty']=normalized['difficulty'].lower()
+    
+    for key in ['num_pcs','extras','pcs_levels','pcs_AC','pcs_ATK','pcs_HP',
+                'num_enemies','enemies_AC','enemies_ATK','enemies_HP']:
+        try:
+            value=float(normalized[key])
+        
+        except (TypeError,ValueError):
+            raise ValueError(f'{key} = {normalized[key]} is not a number')
+        
+        normalized[key]=int(value) if value.is_integer() else value
+    
+    #the order of the CRs does not change the enemy group
+    if normalized['CRs'] is not None:
+        CRs=normalized['CRs']
+        CRs=[CRs] if isinstance(CRs,str) else [str(CR) for CR in CRs]
+        
+        if not valid_challenge_ratings(CRs):
+            raise ValueError(f'CRs = {CRs} has invalid challenge ratings,\
+ must be from {list(CR_to_XP.keys())}')
+        
+        normalized['CRs']=sorted(CRs,key=CR_to_float)
+    
+    if normalized['initiative'] is not None:
+        normalized['initiative']=[int(turn) for turn \
+                                  in normalized['initiative']]
+    
+    for key in OPTIONAL_KEYS:
+        if config.get(key):
+            normalized[key]=True
+    
+    return normalized
+
 def write_configuration(config_file,num_pcs=5,pcs_levels=1,extras=5,
                        pcs_AC=13,pcs_ATK=5,pcs_HP=8.5,difficulty='easy',
                        num_enemies=0,enemies_AC=3,enemies_ATK=13,
@@ -241,8 +437,9 @@ def calculate_difficulty(CRs,num_pcs=5,levels=1,return_category=True):
     
     Parameters
     ----------
-    CRs - list
-        the challenge ratings of enemies in the encounter
+    CRs - str, list, or numpy.ndarray
+        the challenge ratings of enemies in the encounter, or
+        their integer codes (see CR_codes)
     num_pcs - int
         the number of PCs for which the encounter difficulty should
         be calibrated
@@ -267,15 +464,11 @@ def calculate_difficulty(CRs,num_pcs=5,levels=1,return_category=True):
     levels=1
     
     #get the number of enemies and base sum of XP
-    #based on the challenge ratings
-    if hasattr(CRs,'__iter__') and \
-      not isinstance(CRs,str):
-        num_enemies=len(CRs)
-        XP_total=sum([CR_to_XP.get(cr) for cr in CRs])
-        
-    else:
-        num_enemies=1
-        XP_total=CR_to_XP.get(CRs)
+    #from the codes of the challenge ratings
+    codes=CR_codes(CRs)
+    
+    num_enemies=len(codes)
+    XP_total=int(CR_XP[codes].sum())
     
     #modifier for total XP based on number of enemies
     encounter_mod=1 if num_enemies<2 else \
@@ -317,6 +510,233 @@ def calculate_difficulty(CRs,num_pcs=5,levels=1,return_category=True):
     else:
         return XP_total
 
+def encounter_multiplier(num_enemies,num_pcs=5):
+    '''
+    function to calculate the modifier applied to the summed enemy
+    XP based on the number of enemies and number of PCs, the same
+    values used in calculate_difficulty, but working on arrays
+
+    Parameters
+    ----------
+    num_enemies - int or array
+        number(s) of enemies in the encounter(s)
+    num_pcs - int or array
+        number(s) of PCs for which the encounter difficulty should
+        be calibrated
+
+    Returns
+    -------
+    numpy.ndarray
+        the XP modifier for each encounter
+    '''
+
+    num_enemies=np.asarray(num_enemies)
+    num_pcs=np.asarray(num_pcs)
+
+    #modifier for total XP based on number of enemies
+    encounter_mod=np.select([num_enemies<2,num_enemies<3,num_enemies<7,
+                             num_enemies<11,num_enemies<15],
+                            [1,1.5,2,2.5,3],4)
+
+    #adjust the modifier based on party size
+    return np.where(num_pcs<3,
+                    np.where(encounter_mod<3,encounter_mod+0.5,
+                             encounter_mod+1),
+                    np.where(num_pcs>5,
+                             np.where(encounter_mod<4,encounter_mod-0.5,
+                                      encounter_mod-1),
+                             encounter_mod))
+
+def calculate_difficulty_batch(counts,num_pcs=5,levels=1):
+    '''
+    function to calculate the total XP and difficulty category of
+    many encounters in one call, the same values calculate_difficulty
+    gives for each of them (e.g., to re-label every row of a results
+    file for a different number of PCs)
+
+    Parameters
+    ----------
+    counts - array-like
+        (num_encounters,7) array of the number of enemies of each
+        challenge rating (see CR_counts), e.g., the CR_counts field
+        of encounter.SUMMARY_DTYPE records or parse_CR_strings output
+    num_pcs - int or array-like
+        the number of PCs for which the encounter difficulty should
+        be calibrated, either one value or one per encounter
+    levels - int
+        level of the PCs, currently this is forced to be 1
+
+    Returns
+    -------
+    numpy.ndarray
+        total XP of each encounter, taking into account modifiers
+        based on number of enemies and number of PCs
+    numpy.ndarray
+        int8 difficulty category code of each encounter, an
+        index into DIFFICULTIES
+    '''
+
+    #force this for now
+    levels=1
+
+    counts=np.asarray(counts).reshape(-1,len(CR_to_XP))
+    num_pcs=np.broadcast_to(np.asarray(num_pcs),(len(counts),))
+
+    total_XP=(counts@CR_XP)*encounter_multiplier(counts.sum(axis=1),num_pcs)
+
+    #XP boundary of each category for each encounter, as
+    #calculate_difficulty_boundaries gives them
+    boundaries=np.array([XP_difficulty_by_level[levels][category] \
+                         for category in DIFFICULTIES])*num_pcs[:,None]
+
+    #the number of boundaries below the XP, with the same small
+    #amount added for the >= aspect of the boundaries, anything
+    #below the easy boundary counts as easy
+    categories=(boundaries<(total_XP+0.005)[:,None]).sum(axis=1)-1
+
+    return total_XP,np.maximum(categories,0).astype(np.int8)
+
+def CR_counts(CRs):
+    '''
+    function to convert a list of challenge ratings into the number
+    of enemies of each challenge rating, in the order of the CR_to_XP
+    keys, a canonical form for a group regardless of member order
+    
+    Parameters
+    ----------
+    CRs - list or numpy.ndarray
+        the challenge ratings of enemies in a group,
+        or their integer codes (see CR_codes)
+    
+    Returns
+    -------
+    tuple
+        number of enemies for each challenge rating
+    '''
+    
+    return tuple(np.bincount(CR_codes(CRs),minlength=len(CR_to_XP)).tolist())
+
+@lru_cache(maxsize=2**16)
+def CR_string(counts):
+    '''
+    function to get the string form of an enemy group given the
+    number of enemies of each challenge rating, the challenge
+    ratings in the order of the CR_to_XP keys joined by underscores
+    (e.g., '1/4_1/4_1'), as in the CRs column of simulation output
+    
+    Parameters
+    ----------
+    counts - tuple
+        number of enemies of each challenge rating, see CR_counts
+    
+    Returns
+    -------
+    str
+        the underscore separated challenge ratings
+    '''
+    
+    return '_'.join([CR for CR,count in zip(CR_to_XP,counts) \
+                     for _ in range(count)])
+
+def CR_strings(counts):
+    '''
+    function to get the string forms of many enemy groups,
+    see CR_string, each distinct group is only joined once
+    
+    Parameters
+    ----------
+    counts - array-like
+        (num_groups,7) array of the number of enemies of each
+        challenge rating, e.g., the CR_counts field of an array
+        of encounter.SUMMARY_DTYPE records
+    
+    Returns
+    -------
+    numpy.ndarray
+        object array with the string form of each group
+    '''
+    
+    counts=np.asarray(counts).reshape(-1,len(CR_to_XP))
+    
+    groups,inverse=np.unique(counts,axis=0,return_inverse=True)
+    
+    strings=np.array([CR_string(tuple(group)) for group in groups.tolist()],
+                     dtype=object)
+    
+    return strings[inverse.ravel()]
+
+def parse_CR_strings(strings):
+    '''
+    function to get the number of enemies of each challenge rating
+    from many CRs strings (see CR_string), each distinct string is
+    only parsed once, e.g., to get the counts for the CRs column of
+    a results file
+    
+    Parameters
+    ----------
+    strings - array-like
+        the underscore separated challenge ratings of each group
+    
+    Returns
+    -------
+    numpy.ndarray
+        (num_groups,7) array of the number of enemies
+        of each challenge rating
+    '''
+    
+    groups,inverse=np.unique(np.asarray(strings,dtype=str),
+                             return_inverse=True)
+    
+    counts=np.array([CR_counts(group.split('_')) for group in groups],
+                    dtype=np.int64).reshape(-1,len(CR_to_XP))
+    
+    return counts[inverse.ravel()]
+
+#a few thousand groups cover nearly every encounter simulated,
+#so this many entries is plenty while keeping memory bounded
+@lru_cache(maxsize=2**16)
+def enemy_group_stats(counts,num_pcs=5,levels=1):
+    '''
+    function to calculate the quantities derived from the challenge
+    ratings of an enemy group, memoized so groups which come up
+    again cost a dictionary look-up, use enemy_group_stats.cache_info()
+    for the number of hits and misses
+    
+    Parameters
+    ----------
+    counts - tuple
+        number of enemies of each challenge rating, see CR_counts
+    num_pcs - int
+        the number of PCs for which the encounter difficulty should
+        be calibrated
+    levels - int or list
+        level(s) of PCs for which the encounter difficulty should
+        be calibrated, currently this is forced to be 1
+    
+    Returns
+    -------
+    tuple
+        total XP (with modifiers), difficulty category, total hit
+        points, average damage, and average to hit bonus of the group
+    '''
+    
+    #force this for now
+    levels=1
+    
+    codes=np.repeat(np.arange(len(CR_to_XP),dtype=np.int8),counts)
+    
+    total_XP,difficulty=calculate_difficulty(codes,num_pcs,levels,True)
+    
+    hit_points=float(CR_HP[codes].sum())
+    
+    average_damage=CR_DMG[codes].mean().round(0).astype(int)
+    
+    #with the currently available CR values, the to hit
+    #is either +3 or +4 for CR '3'
+    to_hit=CR_TO_HIT[codes].mean().round(0).astype(int)
+    
+    return total_XP,difficulty,hit_points,average_damage,to_hit
+
 def calculate_difficulty_boundaries(num_pcs=5,levels=1):
     '''
     function to calculate the encounter difficulty XP lower
@@ -343,7 +763,7 @@ def calculate_difficulty_boundaries(num_pcs=5,levels=1):
     
     boundaries=np.empty((4,2),dtype=object)
     
-    for idx,cat in enumerate(['easy','medium','hard','deadly']):
+    for idx,cat in enumerate(DIFFICULTIES):
         boundaries[idx][0]=cat
         
         #if levels is an iterable, num_pcs is ignored
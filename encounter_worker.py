@@ -0,0 +1,715 @@
+#functions run by the worker processes of run_encounters, kept
+#apart so a worker only imports NumPy and the simulation classes,
+#pandas and yaml are only loaded by the main process when needed
+
+import time
+
+import numpy as np
+
+from multiprocessing import shared_memory
+
+from battle_groups import (
+                    Party,
+                    Enemies
+                    )
+
+from encounter import Encounter
+
+from encounter_hooks import (
+                    EventCounter,
+                    HookedEncounter
+                    )
+
+from batch_encounter import BatchEncounter
+
+from encounter_utils import CR_strings
+
+from composition_index import default_index
+
+from accumulators import SummaryAccumulator
+
+from run_profile import profiled
+
+#configuration and Encounter random draw mode used by the
+#simulate_* functions in a worker process, set once per worker
+#by _init_worker so the configuration file is only read once
+_worker_config=None
+_worker_rng_mode='buffered'
+_worker_entropy=None
+_worker_profile=False
+_worker_records=None
+
+def simulation_seed(entropy,sim_index,key_prefix=()):
+    '''
+    function to get the seed of a single simulation, spawned from
+    the root seed of a run, the same simulation index always gets
+    the same seed, and different indices never share one
+    
+    Parameters
+    ----------
+    entropy - int
+        root seed entropy of the run
+    sim_index - int
+        index of the simulation within the run
+    key_prefix - tuple
+        extra spawn key entries placed before sim_index, used to
+        give each part of a larger run (e.g., a sweep cell) its
+        own set of simulation seeds
+    
+    Returns
+    -------
+    numpy.random.SeedSequence
+        seed for the simulation, with no key_prefix the same as the
+        sim_index-th child of numpy.random.SeedSequence(entropy).spawn
+    '''
+    
+    return np.random.SeedSequence(entropy,
+                                  spawn_key=tuple(key_prefix)+(sim_index,))
+
+def _init_worker(config,rng_mode='buffered',entropy=None,profile=False,
+                 shared=None):
+    '''
+    function run once when each worker process starts, storing
+    the configuration used by the simulate_* functions
+    
+    Parameters
+    ----------
+    config - dict
+        validated configuration, see
+        encounter_utils.load_configuration
+    rng_mode - str
+        Encounter RNG_MODE, either 'buffered' or 'exact'
+    entropy - int or None-type
+        root seed entropy of the run, see simulation_seed
+    profile - bool
+        flag to time the simulations, see run_profile.profiled
+    shared - tuple or None-type
+        layout of the shared memory array results are written to,
+        see SharedRecords.layout
+    '''
+    
+    global _worker_config,_worker_rng_mode,_worker_entropy,_worker_profile,\
+      _worker_records
+    
+    _worker_config=config
+    _worker_rng_mode=rng_mode
+    _worker_entropy=entropy
+    _worker_profile=profile
+    _worker_records=None if shared is None else SharedRecords.attach(*shared)
+
+def _simulate_index(sim_index):
+    '''
+    function run by a worker process to simulate the encounter
+    with the given simulation index
+    
+    Parameters
+    ----------
+    sim_index - int
+        index of the simulation within the run
+    
+    Returns
+    -------
+    dict
+        Encounter class object summary dictionary, along with the
+        process id and timings if profiling, see run_profile.profiled
+    '''
+    
+    if _worker_profile:
+        return profiled(simulate_encounter,
+                        simulation_seed(_worker_entropy,sim_index))
+    
+    return simulate_encounter(simulation_seed(_worker_entropy,sim_index))
+
+def _simulate_range(sim_range):
+    '''
+    function run by a worker process to simulate a batch of
+    encounters over a range of simulation indices
+    
+    Parameters
+    ----------
+    sim_range - tuple
+        first and one past the last simulation index of the batch
+    
+    Returns
+    -------
+    dict
+        BatchEncounter class object summary dictionary, along with the
+        process id and timings if profiling, see run_profile.profiled
+    '''
+    
+    seeds=[simulation_seed(_worker_entropy,sim_index) \
+           for sim_index in range(*sim_range)]
+    
+    if _worker_profile:
+        return profiled(simulate_batch,seeds)
+    
+    return simulate_batch(seeds)
+
+def _summarize_range(task):
+    '''
+    function run by a worker process to simulate a range of
+    simulation indices and return only their statistics
+    
+    Parameters
+    ----------
+    task - tuple
+        first and one past the last simulation index, and a flag
+        to run them as one batch with the BatchEncounter class
+    
+    Returns
+    -------
+    SummaryAccumulator
+        statistics of the simulations, along with the process id
+        and timings if profiling, see run_profile.profiled
+    '''
+    
+    first_sim,last_sim,batched=task
+    
+    seeds=[simulation_seed(_worker_entropy,sim_index) \
+           for sim_index in range(first_sim,last_sim)]
+    
+    if _worker_profile:
+        return profiled(summarize_simulations,seeds,batched=batched)
+    
+    return summarize_simulations(seeds,batched=batched)
+
+def _simulate_job_range(task):
+    '''
+    function run by a worker process of a simulation_pool.SimulationPool
+    to simulate a range of simulation indices of one job, the settings
+    of the job come with the task, so the same workers can run any
+    configuration
+    
+    Parameters
+    ----------
+    task - tuple
+        job index, first and one past the last simulation index, and
+        the job settings, a (config,rng_mode,entropy,batched,
+        summary_only) tuple
+    
+    Returns
+    -------
+    int
+        the job index
+    int
+        the first simulation index
+    SummaryAccumulator or list
+        statistics of the simulations if summary_only, otherwise
+        a list of Encounter summary dictionaries, or of a single
+        BatchEncounter summary dictionary if batched
+    '''
+    
+    job,first_sim,last_sim,(config,rng_mode,entropy,batched,summary_only)=task
+    
+    seeds=[simulation_seed(entropy,sim_index) \
+           for sim_index in range(first_sim,last_sim)]
+    
+    if summary_only:
+        return job,first_sim,summarize_simulations(seeds,config,batched,
+                                                   rng_mode=rng_mode)
+    
+    if batched:
+        return job,first_sim,[simulate_batch(seeds,config)]
+    
+    return job,first_sim,[simulate_encounter(seed,config,rng_mode) \
+                          for seed in seeds]
+
+def _make_party(config):
+    '''
+    function to create the Party BattleGroup of PCs described
+    by a configuration dictionary
+    
+    Parameters
+    ----------
+    config - dict
+        validated configuration, see
+        encounter_utils.load_configuration
+    
+    Returns
+    -------
+    Party
+        the party of PCs
+    '''
+    
+    return Party(LVL=config.get('pcs_levels'),
+                 EXTRAS=config.get('extras'),
+                 NUMBER=config.get('num_pcs'),
+                 ATK=config.get('pcs_ATK'),
+                 AC=config.get('pcs_AC'),
+                 HP=config.get('pcs_HP'))
+
+def _make_enemies(config,seed):
+    '''
+    function to create the Enemies BattleGroup described
+    by a configuration dictionary
+    
+    Parameters
+    ----------
+    config - dict
+        validated configuration, see
+        encounter_utils.load_configuration
+    seed - int or numpy.random.SeedSequence
+        random seed used if the enemy group is built randomly,
+        by look-up in the shared CompositionIndex if the
+        configuration has a True 'group_index' entry
+    
+    Returns
+    -------
+    Enemies
+        the enemy group
+    '''
+    
+    return Enemies(DIFFICULTY=config.get('difficulty'),
+                   NUMBER=config.get('num_enemies'),
+                   ATK=config.get('enemies_ATK'),
+                   AC=config.get('enemies_AC'),
+                   CRs=config.get('CRs'),
+                   NUM_PCs=config.get('num_pcs'),
+                   LVL_PCs=config.get('pcs_levels'),
+                   SEED=seed,
+                   INDEX=default_index() if config.get('group_index') \
+                     else None)
+
+def simulate_encounter(seed,config=None,rng_mode=None,timings=None,
+                       record=None):
+    '''
+    function to run a simulation of a given encounter
+    and return details of the outcome
+    
+    Parameters
+    ----------
+    seed - int or numpy.random.SeedSequence
+        random seed for the simulation, the enemy group and the
+        encounter each get a seed spawned from it
+    config - dict or None-type
+        validated configuration, see encounter_utils.load_configuration,
+        if None-type the configuration given to the worker process
+        by _init_worker is used
+    rng_mode - str or None-type
+        Encounter RNG_MODE, if None-type the mode given to the
+        worker process by _init_worker is used
+    timings - dict or None-type
+        if given, the time spent building the party, building the
+        enemy group, and running the combat is added to the 'party',
+        'enemies', and 'combat' entries
+    record - numpy.void or None-type
+        if given, a record with the encounter.SUMMARY_DTYPE fields
+        (e.g., a row of a preallocated array) the results are
+        written into, see Encounter.write_summary
+    
+    Returns
+    -------
+    dict or Encounter
+        Encounter class object summary dictionary, or the
+        Encounter class object itself if record is given
+    '''
+    
+    config=_worker_config if config is None else config
+    rng_mode=_worker_rng_mode if rng_mode is None else rng_mode
+    
+    #spawn independent seeds for the enemy group and the encounter
+    if not isinstance(seed,np.random.SeedSequence):
+        seed=np.random.SeedSequence(seed)
+    
+    enemy_seed,encounter_seed=seed.spawn(2)
+    
+    if timings is not None:
+        start=time.perf_counter()
+    
+    #make the Party BattleGroup of PCs
+    party=_make_party(config)
+    
+    if timings is not None:
+        _add_time(timings,'party',start)
+        start=time.perf_counter()
+    
+    #make the Enemies BattleGroup
+    enemies=_make_enemies(config,enemy_seed)
+    
+    if timings is not None:
+        _add_time(timings,'enemies',start)
+        start=time.perf_counter()
+    
+    #create the encounter, counting its events if asked
+    if config.get('count_events'):
+        encounter=HookedEncounter(party=party,
+                                  enemies=enemies,
+                                  hooks=[EventCounter()],
+                                  SEED=encounter_seed,
+                                  RNG=None,
+                                  initiative=config.get('initiative'),
+                                  RNG_MODE=rng_mode)
+    
+    else:
+        encounter=Encounter(party=party,
+                            enemies=enemies,
+                            SEED=encounter_seed,
+                            RNG=None,
+                            initiative=config.get('initiative'),
+                            RNG_MODE=rng_mode)
+    
+    #run the encounter
+    encounter.run_encounter(record)
+    
+    if timings is not None:
+        _add_time(timings,'combat',start)
+    
+    if record is not None:
+        return encounter
+    
+    #return the summary dictionary
+    return encounter.summary
+
+def simulate_batch(seeds,config=None,timings=None,records=None):
+    '''
+    function to run a batch of simulations of a given encounter
+    with the BatchEncounter class and return details of the outcomes
+    
+    Parameters
+    ----------
+    seeds - list
+        list of ints or numpy.random.SeedSequence objects, one
+        per encounter, each enemy group is built with a seed spawned
+        from its encounter seed (as in simulate_encounter), and the
+        batch random number generator uses the encounter seed
+        spawned from the first one
+    config - dict or None-type
+        validated configuration, see encounter_utils.load_configuration,
+        if None-type the configuration given to the worker process
+        by _init_worker is used
+    timings - dict or None-type
+        if given, the time spent building the party, building the
+        enemy groups, and running the combat is added to the 'party',
+        'enemies', and 'combat' entries
+    records - numpy.ndarray or None-type
+        if given, an array of records with the encounter.SUMMARY_DTYPE
+        fields, one per seed, the results are written into, see
+        BatchEncounter.write_summary
+    
+    Returns
+    -------
+    dict or BatchEncounter
+        BatchEncounter class object summary dictionary, with one
+        entry per encounter for each key, or the BatchEncounter
+        class object itself if records is given
+    '''
+    
+    config=_worker_config if config is None else config
+    
+    #spawn the enemy group and encounter seeds like simulate_encounter
+    #so a given seed gets the same enemy group with either function
+    seeds=[seed.spawn(2) if isinstance(seed,np.random.SeedSequence) \
+           else np.random.SeedSequence(seed).spawn(2) for seed in seeds]
+    
+    if timings is not None:
+        start=time.perf_counter()
+    
+    party=_make_party(config)
+    
+    if timings is not None:
+        _add_time(timings,'party',start)
+        start=time.perf_counter()
+    
+    enemies=[_make_enemies(config,enemy_seed) for enemy_seed,_ in seeds]
+    
+    if timings is not None:
+        _add_time(timings,'enemies',start)
+        start=time.perf_counter()
+    
+    #run all the encounters in lockstep
+    batch=BatchEncounter(party=party,
+                         enemies=enemies,
+                         SEED=seeds[0][1],
+                         RNG=None,
+                         initiative=config.get('initiative'))
+    
+    batch.run_encounter(records)
+    
+    if timings is not None:
+        _add_time(timings,'combat',start)
+    
+    if records is not None:
+        return batch
+    
+    return batch.summary
+
+def _record_range(task):
+    '''
+    function run by a worker process to simulate a range of
+    simulation indices and write the results to the shared array
+    
+    Parameters
+    ----------
+    task - tuple
+        first and one past the last simulation index, and a flag
+        to run them as one batch with the BatchEncounter class
+    
+    Returns
+    -------
+    int
+        number of simulations written, along with the process id
+        and timings if profiling, see run_profile.profiled
+    '''
+    
+    if _worker_profile:
+        return profiled(_record_simulations,*task)
+    
+    return _record_simulations(*task)
+
+def _record_simulations(first_sim,last_sim,batched,timings=None):
+    '''
+    function to simulate a range of simulation indices and write
+    the results to the shared array of the worker process
+    
+    Returns
+    -------
+    int
+        number of simulations written
+    '''
+    
+    seeds=[simulation_seed(_worker_entropy,sim_index) \
+           for sim_index in range(first_sim,last_sim)]
+    
+    if batched:
+        simulate_batch(seeds,timings=timings,
+                       records=_worker_records.rows(first_sim,last_sim))
+    
+    else:
+        for sim_index,seed in enumerate(seeds,first_sim):
+            simulate_encounter(seed,timings=timings,
+                               record=_worker_records.row(sim_index))
+    
+    return last_sim-first_sim
+
+class SharedRecords():
+    '''
+    class for an array of simulation result records in shared memory,
+    created by the parent process and attached to by the workers,
+    with the record of simulation i at row i-first_sim
+    
+    ...
+    
+    Attributes
+    ----------
+    first_sim - int
+        index of the simulation in the first row
+    layout - tuple
+        shared memory name, number of rows, first_sim, and dtype
+        description, what attach needs
+    records - numpy.ndarray
+        the structured array, backed by the shared memory
+    shm - multiprocessing.shared_memory.SharedMemory
+        the shared memory block
+    
+    Methods
+    -------
+    attach(name,num_sims,first_sim,dtype)
+        class method to open an array created in another process
+    create(num_sims,first_sim,dtype)
+        class method to create a new array
+    frame()
+        method to get the records as a DataFrame
+    release()
+        method to free the shared memory, in the process that made it
+    row(sim_index)
+        method to get the record of a simulation
+    rows(first_sim,last_sim)
+        method to get the records of a range of simulations
+    '''
+    
+    def __init__(self,shm,num_sims,first_sim,dtype):
+        '''
+        Parameters
+        ----------
+        shm - multiprocessing.shared_memory.SharedMemory
+            the shared memory block holding the records
+        num_sims - int
+            number of simulations, one record each
+        first_sim - int
+            index of the simulation in the first row
+        dtype - list
+            numpy dtype description of the records, e.g.,
+            encounter.SUMMARY_DTYPE.descr
+        '''
+        
+        self.shm=shm
+        self.first_sim=first_sim
+        self.layout=(shm.name,num_sims,first_sim,dtype)
+        
+        self.records=np.ndarray((num_sims,),dtype=np.dtype(dtype),
+                                buffer=shm.buf)
+    
+    @classmethod
+    def create(cls,num_sims,first_sim,dtype):
+        '''
+        class method to create a new array in a new shared memory
+        block, which the creating process frees with release
+        
+        Parameters
+        ----------
+        num_sims - int
+            number of simulations, one record each
+        first_sim - int
+            index of the simulation in the first row
+        dtype - list
+            numpy dtype description of the records
+        
+        Returns
+        -------
+        SharedRecords
+            the new array, its layout is what attach needs
+        '''
+        
+        shm=shared_memory.SharedMemory(create=True,
+                                       size=max(1,num_sims*\
+                                                np.dtype(dtype).itemsize))
+        
+        return cls(shm,num_sims,first_sim,dtype)
+    
+    @classmethod
+    def attach(cls,name,num_sims,first_sim,dtype):
+        '''
+        class method to open an array created in another
+        process, e.g., SharedRecords.attach(*records.layout)
+        
+        Parameters
+        ----------
+        name - str
+            name of the shared memory block
+        num_sims - int
+            number of simulations, one record each
+        first_sim - int
+            index of the simulation in the first row
+        dtype - list
+            numpy dtype description of the records
+        
+        Returns
+        -------
+        SharedRecords
+            the array, backed by the same memory as the original
+        '''
+        
+        #pool workers share the resource tracker of the parent process,
+        #so the block stays registered once and release removes it
+        shm=shared_memory.SharedMemory(name=name)
+        
+        return cls(shm,num_sims,first_sim,dtype)
+    
+    def row(self,sim_index):
+        '''
+        method to get the record of a simulation
+        
+        Parameters
+        ----------
+        sim_index - int
+            index of the simulation within the run
+        
+        Returns
+        -------
+        numpy.void
+            a view of the record in the shared memory, values
+            written to it go straight into the array
+        '''
+        
+        return self.records[sim_index-self.first_sim]
+    
+    def rows(self,first_sim,last_sim):
+        '''
+        method to get the records of a range of simulations
+        
+        Parameters
+        ----------
+        first_sim - int
+            index of the first simulation
+        last_sim - int
+            one past the index of the last simulation
+        
+        Returns
+        -------
+        numpy.ndarray
+            a view of the records in the shared memory, e.g., to
+            pass to BatchEncounter.run_encounter, written in place
+        '''
+        
+        return self.records[first_sim-self.first_sim:last_sim-self.first_sim]
+    
+    def frame(self):
+        '''
+        method to get the records as a DataFrame, with the
+        CR_counts turned into the CRs strings
+        
+        Returns
+        -------
+        pandas.DataFrame
+            one row per simulation, numeric columns are views
+            of the shared memory where pandas allows
+        '''
+        
+        #only the main process builds the frame, so
+        #workers never need to import pandas
+        import pandas as pd
+        
+        return pd.DataFrame({'CRs' if name=='CR_counts' else name:\
+                               CR_strings(self.records[name]) \
+                               if name=='CR_counts' \
+                               else self.records[name] \
+                             for name in self.records.dtype.names},copy=False)
+    
+    def release(self):
+        '''
+        method to free the shared memory, in the process that
+        created it, once nothing refers to the records
+        '''
+        
+        del self.records
+        
+        self.shm.close()
+        self.shm.unlink()
+
+def summarize_simulations(seeds,config=None,batched=False,timings=None,
+                          rng_mode=None):
+    '''
+    function to run simulations of a given encounter and
+    return only statistics of the outcomes
+    
+    Parameters
+    ----------
+    seeds - list
+        list of ints or numpy.random.SeedSequence objects, one per
+        simulation, see simulate_encounter and simulate_batch
+    config - dict or None-type
+        validated configuration, see encounter_utils.load_configuration,
+        if None-type the configuration given to the worker process
+        by _init_worker is used
+    batched - bool
+        if True, run the simulations as one batch with simulate_batch,
+        otherwise one at a time with simulate_encounter
+    timings - dict or None-type
+        passed on to simulate_encounter or simulate_batch
+    rng_mode - str or None-type
+        passed on to simulate_encounter
+    
+    Returns
+    -------
+    SummaryAccumulator
+        statistics of the simulations
+    '''
+    
+    accumulator=SummaryAccumulator()
+    
+    if batched:
+        accumulator.add(simulate_batch(seeds,config,timings=timings))
+    
+    else:
+        accumulator.add([simulate_encounter(seed,config,rng_mode,
+                                            timings=timings) \
+                         for seed in seeds])
+    
+    return accumulator
+
+def _add_time(timings,name,start):
+    '''
+    function to add the time since start to a timings entry
+    '''
+    
+    timings[name]=timings.get(name,0.)+time.perf_counter()-start
@@ -0,0 +1,671 @@
+#class to calculate the exact distribution of encounter outcomes
+#by following the probability of every reachable encounter state,
+#instead of sampling encounters one at a time
+
+from fractions import Fraction
+from itertools import combinations
+from math import ceil,prod
+
+import numpy as np
+import pandas as pd
+
+'''
+hit points, damage, and thresholds are held as integers in units of
+1/HP_SCALE, which is exact for the halves and quarters they can take
+'''
+
+HP_SCALE=4
+
+'''
+columns of the state arrays, the initiative order (mask of PC slots),
+the down combatants (mask of slots), party hit points, party extras,
+party damage since the last heal, PC down threshold, enemies hit
+points, enemy down threshold, number of PCs down, number of enemies down
+'''
+
+STATE_COLUMNS=['pc_mask','down_mask','party_hp','party_extras',
+               'party_damage','pc_threshold','enemies_hp',
+               'enemy_threshold','num_party_down','num_enemies_down']
+
+(PC_MASK,DOWN_MASK,PARTY_HP,EXTRAS,PARTY_DAMAGE,PC_THRESHOLD,
+ ENEMIES_HP,ENEMY_THRESHOLD,NUM_PCS_DOWN,NUM_ENEMIES_DOWN)=\
+  range(len(STATE_COLUMNS))
+
+class ExactEncounterSolver():
+    '''
+    class to calculate the exact probabilities of the outcomes of an
+    encounter between a Party BattleGroup and an Enemies BattleGroup,
+    following the same rules as the Encounter class
+
+    ...
+
+    The state of an encounter between turns is the initiative order,
+    which combatants are down, the party and enemies hit points, the
+    party extras, the damage taken since the last heal, and the two
+    down thresholds, everything else is fixed by the BattleGroups.
+    The probability of every reachable state is carried forward one
+    initiative slot at a time, with identical states merged, so the
+    number of rounds comes from how many passes through the initiative
+    order were made.  Since which combatants are down is part of the
+    state, the work grows quickly with the number of combatants.
+
+    Attributes
+    ----------
+    <initial>
+    enemies - Enemies
+        the Enemies BattleGroup subclass object representing the
+        enemies, not changed by the solver
+    initiative_orders - list
+        list of the initiative orders considered, each a tuple of 1s
+        (PC turns) and 0s (enemy turns), all equally likely
+    max_rounds - int
+        maximum number of rounds followed before giving up on the
+        probability which has not yet reached an outcome
+    party - Party
+        the Party BattleGroup subclass object representing the PCs,
+        not changed by the solver
+    prune - float
+        states with a smaller probability than this are dropped
+    tolerance - float
+        the solver stops once the probability of the encounter still
+        going drops below this value
+    <subsequent>
+    num_states - int
+        the largest number of distinct states held at one time
+    outcomes - pandas.DataFrame
+        one row per distinct encounter outcome, with the columns of
+        the Encounter summary dictionary (apart from CRs, totalXP,
+        num_enemies, and num_turns) and a 'probability' column
+    summary - dict
+        dictionary with
+          success: probability the party wins, with the same
+            definition as the Encounter summary (party hit points
+            above 0 at the end)
+          failure: probability the party loses
+          unresolved: probability not assigned to an outcome, from
+            encounters still going when the solver stopped and from
+            pruned states
+          expected values, over the resolved outcomes, of
+            frac_party_hp, frac_party_extras, num_party_down,
+            num_enemies_down, and num_rounds
+
+    Methods
+    -------
+    distribution(column)
+        method to get the probability of each value of an outcome
+        column (e.g., 'num_rounds')
+    solve()
+        method to calculate the outcome probabilities and create the
+        outcomes and summary attributes
+    '''
+
+    def __init__(self,party,enemies,initiative=None,MAX_ROUNDS=500,
+                 TOLERANCE=1e-12,PRUNE=0.):
+        '''
+        Parameters
+        ----------
+        party - Party BattleGroup subclass
+            the Party class object representing the PCs, see the
+            battle_groups module for more information
+        enemies - Enemies BattleGroup subclass
+            the Enemies class object representing the enemies, see
+            the battle_groups module for more information
+        initiative - iterable or None-type
+            the initiative order, with PC turns represented by 1s and
+            enemy turns represented by 0s, if not specified every order
+            is considered with equal probability, as when Encounter
+            decides it randomly, which multiplies the work by the
+            number of distinct orders
+        MAX_ROUNDS - int
+            maximum number of rounds to follow
+        TOLERANCE - float
+            probability of the encounter still going below which
+            the solver stops early
+        PRUNE - float
+            states with a probability below this are dropped, and
+            counted as unresolved, a small value (e.g., 1e-12) greatly
+            reduces the work for large groups, 0 keeps every state
+        '''
+
+        self.party=party
+        self.enemies=enemies
+        self.max_rounds=MAX_ROUNDS
+        self.tolerance=TOLERANCE
+        self.prune=PRUNE
+
+        num_combatants=self.party.num_members+self.enemies.num_members
+
+        #the down masks are held in 64 bit integers
+        if num_combatants>62:
+            raise ValueError(f'Cannot solve encounters with more than 62\
+ combatants, {num_combatants} were passed in')
+
+        if initiative is None:
+            #every arrangement of the PC turns among the slots is
+            #equally likely when the order is shuffled
+            self.initiative_orders=[tuple(int(idx in pc_slots) \
+                                          for idx in range(num_combatants)) \
+                                    for pc_slots in combinations(\
+                                      range(num_combatants),
+                                      self.party.num_members)]
+
+        else:
+            #same sanity checks as the Encounter class
+            if len(initiative)!=num_combatants:
+                raise ValueError(f'Input initiative order does not have\
+ the correct number of total entries, received {len(initiative)} but need\
+ {num_combatants}')
+
+            if sum([turn!=0 and turn!=1 for turn in initiative])>0:
+                raise ValueError('Input initiative order should only\
+ have entries of either 0 or 1.')
+
+            if sum(initiative)!=self.party.num_members:
+                raise ValueError(f'Input initiative order does not have\
+ correct number of PCs and enemies, should sum to {self.party.num_members}\
+ but input values yield {sum(initiative)}')
+
+            self.initiative_orders=[tuple(int(turn) for turn in initiative)]
+
+    def solve(self):
+        '''
+        method to calculate the probability of every encounter outcome
+        and create the outcomes and summary attributes
+
+        Returns
+        -------
+        dict
+            the summary attribute
+        '''
+
+        party=self.party
+        enemies=self.enemies
+
+        self._num_slots=party.num_members+enemies.num_members
+
+        #starting values, the same as Encounter.run_encounter
+        heal_threshold=2*Fraction(party.hit_points)/party.num_members \
+          if party.num_members>1 else Fraction(party.hit_points)/2
+        pc_down_threshold=Fraction(party.hit_points)/2 \
+          if party.num_members>1 else 0
+        enemy_down_threshold=Fraction(enemies.hit_points)/2 \
+          if enemies.num_members>1 else 0
+
+        #party damage is only compared to the heal threshold, so any
+        #value at or above it is the same, and it is capped there
+        self._heal_cap=ceil(heal_threshold*HP_SCALE)
+
+        #probabilities of a miss, a regular hit, and a natural 20
+        self._pc_attack=self._attack_probabilities(party.to_hit,
+                                                   enemies.armor_class)
+        self._enemy_attack=self._attack_probabilities(enemies.to_hit,
+                                                      party.armor_class)
+
+        #damage for each of those, PCs also double on using an extra
+        self._pc_damage=[[self._scaled(party.average_damage,'party damage')\
+                          *(1+use_extra)*crit for crit in [0,1,2]] \
+                         for use_extra in [0,1]]
+        self._enemy_damage=[self._scaled(enemies.average_damage,
+                                         'enemies damage')*crit \
+                            for crit in [0,1,2]]
+
+        #start from every initiative order, equally likely
+        states=np.array([[sum(1<<idx for idx,turn in enumerate(order) \
+                              if turn),
+                          0,
+                          self._scaled(party.hit_points,'party hit points'),
+                          party.extras,
+                          0,
+                          self._scaled(pc_down_threshold,'party hit points'),
+                          self._scaled(enemies.hit_points,
+                                       'enemies hit points'),
+                          self._scaled(enemy_down_threshold,
+                                       'enemies hit points'),
+                          0,
+                          0] for order in self.initiative_orders],
+                        dtype=np.int64)
+
+        probs=np.full(len(states),1/len(states))
+
+        finished_states=[]
+        finished_probs=[]
+        finished_rounds=[]
+
+        self.num_states=len(states)
+
+        pruned=0.
+
+        num_rounds=0
+
+        while len(states) and num_rounds<self.max_rounds:
+            num_rounds+=1
+
+            for slot_idx in range(self._num_slots):
+                slot=1<<slot_idx
+
+                #down combatants skip their turn
+                active=states[:,DOWN_MASK]&slot==0
+                pc=active&(states[:,PC_MASK]&slot!=0)
+                enemy=active&~pc
+
+                new_states,new_probs=[states[~active]],[probs[~active]]
+
+                for turn,mask in [(self._pc_turn,pc),(self._enemy_turn,enemy)]:
+                    if not mask.any():
+                        continue
+
+                    turn_states,turn_probs=turn(states[mask],probs[mask])
+
+                    over=self._encounter_over(turn_states)
+
+                    finished_states.append(turn_states[over])
+                    finished_probs.append(turn_probs[over])
+                    finished_rounds.append(np.full(over.sum(),num_rounds))
+
+                    new_states.append(turn_states[~over])
+                    new_probs.append(turn_probs[~over])
+
+                states,probs=self._merge(np.concatenate(new_states),
+                                         np.concatenate(new_probs))
+
+                if self.prune>0:
+                    keep=probs>=self.prune
+                    pruned+=probs[~keep].sum()
+                    states,probs=states[keep],probs[keep]
+
+                self.num_states=max(self.num_states,len(states))
+
+            if probs.sum()<self.tolerance:
+                break
+
+        self._make_outcomes(np.concatenate(finished_states),
+                            np.concatenate(finished_probs),
+                            np.concatenate(finished_rounds),
+                            probs.sum()+pruned)
+
+        return self.summary
+
+    def distribution(self,column):
+        '''
+        method to get the probability of each value of one of
+        the outcome columns
+
+        Parameters
+        ----------
+        column - str
+            name of a column of the outcomes attribute
+
+        Returns
+        -------
+        pandas.Series
+            probability of each value, indexed by value
+        '''
+
+        return self.outcomes.groupby(column)['probability'].sum()
+
+    def _pc_turn(self,states,probs):
+        '''
+        method to carry states through a PC turn, either a heal action
+        or an attack, possibly using an extra, followed by the check
+        on downing an enemy
+
+        Parameters
+        ----------
+        states - numpy.ndarray
+            (num_states,10) array of states, see STATE_COLUMNS
+        probs - numpy.ndarray
+            probability of each state
+
+        Returns
+        -------
+        numpy.ndarray
+            the states after the turn
+        numpy.ndarray
+            probability of each of those
+        '''
+
+        #heal action if there are extras and the party has taken
+        #enough damage or has a PC down
+        heal=(states[:,EXTRAS]>0)&((states[:,PARTY_DAMAGE]>=self._heal_cap)|\
+                                   (states[:,NUM_PCS_DOWN]>0))
+
+        healed=states[heal]
+        healed[:,PARTY_HP]+=5*HP_SCALE
+        healed[:,EXTRAS]-=1
+        healed[:,PARTY_DAMAGE]=0
+
+        #healing gets a random down PC back up
+        pc_down=healed[:,NUM_PCS_DOWN]>0
+        up_states=healed[pc_down]
+        up_states[:,NUM_PCS_DOWN]-=1
+
+        up_states,up_probs=self._pick_slot(up_states,probs[heal][pc_down],
+                                           up_states[:,PC_MASK]&\
+                                             up_states[:,DOWN_MASK],
+                                           healed[pc_down][:,NUM_PCS_DOWN],
+                                           False)
+
+        new_states=[healed[~pc_down],up_states]
+        new_probs=[probs[heal][~pc_down],up_probs]
+
+        #otherwise attack, with a 10% chance of using an extra
+        attack=states[~heal]
+        attack_probs=probs[~heal]
+        has_extras=attack[:,EXTRAS]>0
+
+        for use_extra,extra_probs in [(0,np.where(has_extras,0.9,1.)),
+                                      (1,np.where(has_extras,0.1,0.))]:
+            for damage,attack_prob in zip(self._pc_damage[use_extra],
+                                          self._pc_attack):
+                if attack_prob<=0:
+                    continue
+
+                keep=extra_probs>0
+                attacked=attack[keep]
+                attacked[:,ENEMIES_HP]-=damage
+
+                if use_extra:
+                    attacked[:,EXTRAS]-=1
+
+                    #party damage does not matter without extras
+                    attacked[attacked[:,EXTRAS]==0,PARTY_DAMAGE]=0
+
+                new_states.append(attacked)
+                new_probs.append(attack_probs[keep]*extra_probs[keep]*\
+                                 attack_prob)
+
+        states=np.concatenate(new_states)
+        probs=np.concatenate(new_probs)
+
+        #check if an enemy is downed
+        down=states[:,ENEMIES_HP]<=states[:,ENEMY_THRESHOLD]
+
+        checked=states[down]
+        num_up=self.enemies.num_members-checked[:,NUM_ENEMIES_DOWN]
+        checked[:,NUM_ENEMIES_DOWN]+=num_up>0
+        checked[:,ENEMY_THRESHOLD]=self._update_threshold(\
+          checked[:,ENEMIES_HP],
+          self.enemies.num_members-checked[:,NUM_ENEMIES_DOWN])
+
+        any_up=num_up>0
+
+        down_states,down_probs=self._pick_slot(checked[any_up],
+                                               probs[down][any_up],
+                                               ~checked[any_up][:,PC_MASK]&\
+                                                 ~checked[any_up][:,DOWN_MASK],
+                                               num_up[any_up],True)
+
+        return np.concatenate([states[~down],checked[~any_up],down_states]),\
+          np.concatenate([probs[~down],probs[down][~any_up],down_probs])
+
+    def _enemy_turn(self,states,probs):
+        '''
+        method to carry states through an enemy turn, an attack,
+        followed by the check on downing a PC
+
+        Parameters
+        ----------
+        states - numpy.ndarray
+            (num_states,10) array of states, see STATE_COLUMNS
+        probs - numpy.ndarray
+            probability of each state
+
+        Returns
+        -------
+        numpy.ndarray
+            the states after the turn
+        numpy.ndarray
+            probability of each of those
+        '''
+
+        new_states=[]
+        new_probs=[]
+
+        for damage,attack_prob in zip(self._enemy_damage,self._enemy_attack):
+            if attack_prob<=0:
+                continue
+
+            attacked=states.copy()
+            attacked[:,PARTY_HP]-=damage
+
+            #party damage does not matter without extras
+            attacked[:,PARTY_DAMAGE]=np.where(attacked[:,EXTRAS]>0,
+                                              np.minimum(\
+                                                attacked[:,PARTY_DAMAGE]+damage,
+                                                self._heal_cap),
+                                              0)
+
+            new_states.append(attacked)
+            new_probs.append(probs*attack_prob)
+
+        states=np.concatenate(new_states)
+        probs=np.concatenate(new_probs)
+
+        #check if a PC is downed
+        down=states[:,PARTY_HP]<=states[:,PC_THRESHOLD]
+
+        checked=states[down]
+        num_up=self.party.num_members-checked[:,NUM_PCS_DOWN]
+        checked[:,NUM_PCS_DOWN]+=num_up>0
+        checked[:,PC_THRESHOLD]=self._update_threshold(\
+          checked[:,PARTY_HP],
+          self.party.num_members-checked[:,NUM_PCS_DOWN])
+
+        any_up=num_up>0
+
+        down_states,down_probs=self._pick_slot(checked[any_up],
+                                               probs[down][any_up],
+                                               checked[any_up][:,PC_MASK]&\
+                                                 ~checked[any_up][:,DOWN_MASK],
+                                               num_up[any_up],True)
+
+        return np.concatenate([states[~down],checked[~any_up],down_states]),\
+          np.concatenate([probs[~down],probs[down][~any_up],down_probs])
+
+    def _pick_slot(self,states,probs,options,num_options,down):
+        '''
+        method to split states over the random choice of which
+        combatant goes down or gets back up, each with equal probability
+
+        Parameters
+        ----------
+        states - numpy.ndarray
+            (num_states,10) array of states, see STATE_COLUMNS
+        probs - numpy.ndarray
+            probability of each state
+        options - numpy.ndarray
+            mask of the slots which can be chosen for each state
+        num_options - numpy.ndarray
+            number of slots which can be chosen for each state
+        down - bool
+            True to set the chosen slot as down, False to set it as up
+
+        Returns
+        -------
+        numpy.ndarray
+            the states after the choice
+        numpy.ndarray
+            probability of each of those
+        '''
+
+        new_states=[]
+        new_probs=[]
+
+        for slot_idx in range(self._num_slots):
+            chosen=options>>slot_idx&1==1
+
+            if not chosen.any():
+                continue
+
+            picked=states[chosen]
+
+            if down:
+                picked[:,DOWN_MASK]|=1<<slot_idx
+
+            else:
+                picked[:,DOWN_MASK]&=~(1<<slot_idx)
+
+            new_states.append(picked)
+            new_probs.append(probs[chosen]/num_options[chosen])
+
+        if not new_states:
+            return states[:0],probs[:0]
+
+        return np.concatenate(new_states),np.concatenate(new_probs)
+
+    def _update_threshold(self,hit_points,num_up):
+        '''
+        method to get the updated down threshold after a combatant
+        goes down, the same rule as Encounter.update_pc_down_threshold,
+        for hit points in units of 1/HP_SCALE
+        '''
+
+        return np.where(num_up<=1,0,
+                        hit_points-HP_SCALE*(hit_points//\
+                                             (HP_SCALE*np.maximum(num_up,1))))
+
+    def _encounter_over(self,states):
+        '''
+        method to check which states meet any encounter end condition,
+        the same conditions as Encounter.encounter_over
+        '''
+
+        return (states[:,NUM_PCS_DOWN]==self.party.num_members)|\
+          (states[:,NUM_ENEMIES_DOWN]==self.enemies.num_members)|\
+          (states[:,PARTY_HP]<=0)|(states[:,ENEMIES_HP]<=0)
+
+    def _merge(self,states,probs):
+        '''
+        method to combine identical states, adding their probabilities
+
+        Returns
+        -------
+        numpy.ndarray
+            the distinct states
+        numpy.ndarray
+            probability of each of those
+        '''
+
+        if len(states)<2:
+            return states,probs
+
+        #pack the columns into a single integer key when they fit,
+        #otherwise compare whole rows
+        lows=states.min(axis=0)
+        spans=states.max(axis=0)-lows+1
+
+        if prod(int(span) for span in spans)<2**63:
+            keys=np.zeros(len(states),dtype=np.int64)
+
+            for column,(low,span) in enumerate(zip(lows,spans)):
+                keys=keys*span+(states[:,column]-low)
+
+        else:
+            keys=np.ascontiguousarray(states).view(\
+              np.dtype((np.void,states.itemsize*states.shape[1]))).ravel()
+
+        _,first,inverse=np.unique(keys,return_index=True,return_inverse=True)
+
+        return states[first],np.bincount(inverse.ravel(),weights=probs)
+
+    def _scaled(self,value,name):
+        '''
+        method to convert a hit point or damage value into an integer
+        number of 1/HP_SCALE units
+        '''
+
+        scaled=Fraction(np.asarray(value).item())*HP_SCALE
+
+        if scaled.denominator!=1:
+            raise ValueError(f'The {name} ({value}) must be a multiple of\
+ 1/{HP_SCALE} for the exact solver')
+
+        return int(scaled)
+
+    def _attack_probabilities(self,to_hit,armor_class):
+        '''
+        method to get the probability that an attack misses, hits, or
+        is a natural 20, with the d20 rules used by the Encounter class
+
+        Returns
+        -------
+        list
+            the probabilities of a miss, a regular hit, and a natural 20
+        '''
+
+        hits=sum([d20+to_hit>=armor_class for d20 in range(2,20)])
+
+        return [(19-hits)/20,hits/20,1/20]
+
+    def _make_summary(self,unresolved):
+        '''
+        method to create the summary attribute from the outcomes
+        '''
+
+        weights=self.outcomes['probability']
+
+        self.summary={'success':weights[self.outcomes['success']].sum(),
+                      'failure':weights[~self.outcomes['success']].sum(),
+                      'unresolved':unresolved}
+
+        for column in ['frac_party_hp','frac_party_extras','num_party_down',
+                       'num_enemies_down','num_rounds']:
+            self.summary[column]=(self.outcomes[column]*weights).sum()/\
+              weights.sum()
+
+    def _make_outcomes(self,states,probs,rounds,unresolved):
+        '''
+        method to create the outcomes attribute, a DataFrame with one
+        row per distinct outcome, and then the summary attribute
+
+        Parameters
+        ----------
+        states - numpy.ndarray
+            (num_states,10) array of finished states
+        probs - numpy.ndarray
+            probability of each finished state
+        rounds - numpy.ndarray
+            number of rounds each finished state took
+        unresolved - float
+            probability left over when the solver stopped
+        '''
+
+        outcomes=pd.DataFrame({'party_hp':states[:,PARTY_HP],
+                               'party_extras':states[:,EXTRAS],
+                               'num_party_down':states[:,NUM_PCS_DOWN],
+                               'enemies_hp':states[:,ENEMIES_HP],
+                               'num_enemies_down':states[:,NUM_ENEMIES_DOWN],
+                               'num_rounds':rounds,
+                               'probability':probs})
+
+        outcomes=outcomes.groupby(['party_hp','party_extras','num_party_down',
+                                   'enemies_hp','num_enemies_down',
+                                   'num_rounds'],as_index=False)\
+          ['probability'].sum()
+
+        #back to hit points, whole numbers stay integers
+        for column in ['party_hp','enemies_hp']:
+            if (outcomes[column]%HP_SCALE==0).all():
+                outcomes[column]=outcomes[column]//HP_SCALE
+
+            else:
+                outcomes[column]=outcomes[column]/HP_SCALE
+
+        #fill in the rest of the Encounter summary values
+        outcomes['frac_party_hp']=outcomes['party_hp']/\
+          self.party.max_hit_points()
+        outcomes['frac_party_extras']=outcomes['party_extras']/\
+          self.party.max_extras()
+        outcomes['frac_party_down']=outcomes['num_party_down']/\
+          self.party.num_members
+        outcomes['success']=outcomes['party_hp']>0
+        outcomes['frac_enemies_down']=outcomes['num_enemies_down']/\
+          self.enemies.num_members
+
+        self.outcomes=outcomes[['party_hp','party_extras','frac_party_hp',
+                                'frac_party_extras','num_party_down',
+                                'frac_party_down','success','enemies_hp',
+                                'num_enemies_down','frac_enemies_down',
+                                'num_rounds','probability']]
+
+        self._make_summary(unresolved)
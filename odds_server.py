@@ -0,0 +1,567 @@
+#local HTTP/JSON service estimating the odds of an encounter,
+#simulations run on a background process pool and repeated
+#queries are answered from a cache
+
+import argparse
+import asyncio
+import json
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from statistics import NormalDist
+
+import numpy as np
+
+from encounter_utils import normalize_configuration
+
+from run_encounters import (
+                    confidence_intervals,
+                    simulate_batch,
+                    simulation_seed
+                    )
+
+#summary columns reported as quantiles, and the quantiles
+QUANTILE_COLUMNS=['frac_party_hp','frac_party_extras','num_party_down',
+                  'num_rounds']
+QUANTILES=[0.05,0.25,0.5,0.75,0.95]
+
+#number of simulations in each task sent to the pool, fixed so
+#a query always gets the same results for a given seed
+CHUNK_SIZE=1000
+
+#largest number of simulations a query may ask for
+MAX_SIMS=1000000
+
+#largest request body read, in bytes, a query is far smaller
+MAX_BODY=2**20
+
+class OddsCache():
+    '''
+    class for a least recently used cache of query results
+
+    ...
+
+    Attributes
+    ----------
+    hits - int
+        number of look-ups answered from the cache
+    max_size - int
+        largest number of results kept
+    misses - int
+        number of look-ups not in the cache
+
+    Methods
+    -------
+    get(key)
+        method to look up a result, None-type if not cached
+    put(key,value)
+        method to add a result, dropping the least recently
+        used one if the cache is full
+    stats()
+        method to get the size and hit counts of the cache
+    '''
+
+    def __init__(self,max_size=1024):
+        '''
+        Parameters
+        ----------
+        max_size - int
+            largest number of results kept
+        '''
+
+        self.max_size=max_size
+        self.hits=0
+        self.misses=0
+
+        self._entries=OrderedDict()
+
+    def get(self,key):
+        '''
+        method to look up a result, marking it as just used
+
+        Parameters
+        ----------
+        key - str
+            the normalized query, see OddsServer.odds
+
+        Returns
+        -------
+        dict or None-type
+            the cached result, None-type if the key is not cached
+        '''
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits+=1
+
+            return self._entries[key]
+
+        self.misses+=1
+
+        return None
+
+    def put(self,key,value):
+        '''
+        method to add a result, dropping the least recently
+        used one if the cache is full
+
+        Parameters
+        ----------
+        key - str
+            the normalized query, see OddsServer.odds
+        value - dict
+            the result to keep
+        '''
+
+        self._entries[key]=value
+        self._entries.move_to_end(key)
+
+        while len(self._entries)>self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        '''
+        method to get the size and hit counts of the cache
+
+        Returns
+        -------
+        dict
+            dictionary with keys
+              size: number of results kept
+              max_size: largest number of results kept
+              hits: number of look-ups answered from the cache
+              misses: number of look-ups not in the cache
+        '''
+
+        return {'size':len(self._entries),
+                'max_size':self.max_size,
+                'hits':self.hits,
+                'misses':self.misses}
+
+class OddsServer():
+    '''
+    class for an asyncio HTTP server answering encounter odds
+    queries, with endpoints
+
+      POST /odds: body is a JSON object with a 'config' entry, a
+        configuration in the configuration file schema (missing keys
+        get the encounter_utils.DEFAULT_CONFIGURATION values), and
+        optional 'num_sims' and 'seed' entries, the response has the
+        win probability with its confidence interval and quantiles
+        of the party's remaining resources, see estimate_odds
+      GET /stats: cache and server counters
+
+    ...
+
+    Attributes
+    ----------
+    cache - OddsCache
+        cache of results keyed by the normalized query
+    confidence - float
+        confidence level of the win probability interval
+    executor - concurrent.futures.ProcessPoolExecutor or None-type
+        process pool running the simulations, while serving
+    num_sims - int
+        number of simulations used when a query does not say
+    num_workers - int or None-type
+        number of worker processes, None-type for one per CPU
+    seed - int
+        seed used when a query does not give one
+
+    Methods
+    -------
+    odds(query)
+        coroutine to answer a query dictionary
+    serve(host,port)
+        coroutine to run the server until cancelled
+    '''
+
+    def __init__(self,num_workers=None,cache_size=1024,num_sims=10000,
+                 SEED=0,confidence=0.95):
+        '''
+        Parameters
+        ----------
+        num_workers - int or None-type
+            number of worker processes, None-type for one per CPU
+        cache_size - int
+            largest number of query results cached
+        num_sims - int
+            number of simulations used when a query does not say
+        SEED - int
+            seed used when a query does not give one
+        confidence - float
+            confidence level of the win probability interval
+        '''
+
+        self.num_workers=num_workers
+        self.cache=OddsCache(cache_size)
+        self.num_sims=num_sims
+        self.seed=SEED
+        self.confidence=confidence
+        self.executor=None
+
+        #queries being simulated, so identical concurrent
+        #queries share one set of simulations
+        self._pending={}
+
+    async def odds(self,query):
+        '''
+        coroutine to answer an odds query
+
+        Parameters
+        ----------
+        query - dict
+            dictionary with a 'config' entry and optional
+            'num_sims' and 'seed' entries
+
+        Returns
+        -------
+        dict
+            the estimate_odds dictionary, with 'cached' added
+        '''
+
+        if not isinstance(query,dict) or \
+          not isinstance(query.get('config',{}),dict):
+            raise ValueError('The query must be a JSON object with a\
+ "config" object')
+
+        unknown=set(query)-{'config','num_sims','seed'}
+
+        if unknown:
+            raise ValueError(f'Unknown query keys {sorted(unknown)}')
+
+        #values of the wrong JSON type (e.g., null or a list)
+        #raise a TypeError rather than a ValueError
+        try:
+            config=normalize_configuration(query.get('config',{}))
+            num_sims=int(query.get('num_sims',self.num_sims))
+            seed=int(query.get('seed',self.seed))
+
+        except (TypeError,ValueError) as error:
+            raise ValueError(f'Malformed query, {error}') from None
+
+        if not 0<num_sims<=MAX_SIMS:
+            raise ValueError(f'num_sims must be between 1 and {MAX_SIMS}')
+
+        key=json.dumps([config,num_sims,seed],sort_keys=True)
+
+        result=self.cache.get(key)
+
+        if result is not None:
+            return dict(result,cached=True)
+
+        if key not in self._pending:
+            self._pending[key]=asyncio.ensure_future(\
+              self._simulate(config,num_sims,seed))
+
+            self._pending[key].add_done_callback(\
+              lambda _:self._pending.pop(key,None))
+
+        result=await asyncio.shield(self._pending[key])
+
+        self.cache.put(key,result)
+
+        return dict(result,cached=False)
+
+    async def _simulate(self,config,num_sims,seed):
+        '''
+        coroutine to run the simulations of a query on the pool
+        '''
+
+        loop=asyncio.get_running_loop()
+
+        start=time.perf_counter()
+
+        chunks=await asyncio.gather(*[loop.run_in_executor(self.executor,
+                                        partial(_simulate_chunk,config,seed,
+                                                first,
+                                                min(first+CHUNK_SIZE,
+                                                    num_sims))) \
+                                      for first in range(0,num_sims,
+                                                         CHUNK_SIZE)])
+
+        result=summarize_odds({column:np.concatenate([chunk[column] \
+                                                      for chunk in chunks]) \
+                               for column in chunks[0]},self.confidence)
+
+        return dict(result,config=config,seed=seed,
+                    elapsed=time.perf_counter()-start)
+
+    async def serve(self,host='127.0.0.1',port=8765):
+        '''
+        coroutine to run the server until cancelled
+
+        Parameters
+        ----------
+        host - str
+            address to listen on, the local machine by default
+        port - int
+            port to listen on
+        '''
+
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            self.executor=executor
+
+            server=await asyncio.start_server(self._handle,host,port)
+
+            try:
+                async with server:
+                    await server.serve_forever()
+
+            finally:
+                self.executor=None
+
+    async def _handle(self,reader,writer):
+        '''
+        coroutine to answer the requests of one client connection
+        '''
+
+        try:
+            while True:
+                request=await _read_request(reader)
+
+                if request is None:
+                    break
+
+                method,path,body,keep_alive=request
+
+                status,response=await self._route(method,path,body)
+
+                _write_response(writer,status,response,keep_alive)
+
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+
+        except ValueError as error:
+            #the rest of a connection cannot be read after
+            #a malformed request, so it is answered and closed
+            _write_response(writer,HTTPStatus.BAD_REQUEST,
+                            {'error':str(error)},False)
+
+            try:
+                await writer.drain()
+
+            except ConnectionError:
+                pass
+
+        except (ConnectionError,asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def _route(self,method,path,body):
+        '''
+        coroutine to pick the response to a request
+        '''
+
+        if path=='/odds':
+            if method!='POST':
+                return HTTPStatus.METHOD_NOT_ALLOWED,{'error':'use POST'}
+
+            try:
+                return HTTPStatus.OK,await self.odds(json.loads(body or b'{}'))
+
+            except ValueError as error:
+                return HTTPStatus.BAD_REQUEST,{'error':str(error)}
+
+            except Exception as error:
+                return HTTPStatus.INTERNAL_SERVER_ERROR,\
+                  {'error':f'{type(error).__name__}: {error}'}
+
+        if path=='/stats':
+            if method!='GET':
+                return HTTPStatus.METHOD_NOT_ALLOWED,{'error':'use GET'}
+
+            return HTTPStatus.OK,{'cache':self.cache.stats(),
+                                  'pending':len(self._pending)}
+
+        return HTTPStatus.NOT_FOUND,{'error':f'no such endpoint {path}'}
+
+def summarize_odds(results,confidence=0.95):
+    '''
+    function to get the win probability and resource quantiles
+    from simulation results
+
+    Parameters
+    ----------
+    results - dict
+        dictionary of arrays with the 'success' and QUANTILE_COLUMNS
+        values of each simulation
+    confidence - float
+        confidence level of the win probability interval
+
+    Returns
+    -------
+    dict
+        dictionary with keys
+          num_sims: number of simulations
+          win_probability: fraction of simulations the party won
+          win_center: centre of the Wilson score interval on
+            win_probability, a little closer to 0.5
+          win_interval: half-width of the Wilson score interval
+          quantiles: for each of QUANTILE_COLUMNS, a dictionary
+            with the QUANTILES (as strings) as keys
+    '''
+
+    num_sims=len(results['success'])
+
+    z=NormalDist().inv_cdf(0.5+confidence/2)
+
+    wins=float(np.sum(results['success']))
+
+    win_center,win_interval=confidence_intervals(num_sims,
+                                                 {'success':wins},
+                                                 {'success':wins},
+                                                 z)['success']
+
+    return {'num_sims':num_sims,
+            'win_probability':wins/num_sims,
+            'win_center':win_center,
+            'win_interval':win_interval,
+            'confidence':confidence,
+            'quantiles':{column:{str(quantile):float(value) for quantile,value \
+                                 in zip(QUANTILES,
+                                        np.quantile(results[column],
+                                                    QUANTILES))} \
+                         for column in QUANTILE_COLUMNS}}
+
+def _simulate_chunk(config,seed,first_sim,last_sim):
+    '''
+    function run in a worker process to simulate a range of
+    simulation indices with the BatchEncounter class
+
+    Returns
+    -------
+    dict
+        arrays with the 'success' and QUANTILE_COLUMNS values
+        of each simulation
+    '''
+
+    summary=simulate_batch([simulation_seed(seed,sim_index) \
+                            for sim_index in range(first_sim,last_sim)],
+                           config)
+
+    return {column:np.asarray(summary[column]) \
+            for column in ['success']+QUANTILE_COLUMNS}
+
+async def _read_request(reader):
+    '''
+    coroutine to read an HTTP/1.1 request, returns None-type if
+    the client closed the connection first, raises a ValueError if
+    the request is malformed or its body is over MAX_BODY bytes
+
+    Returns
+    -------
+    tuple
+        method, path, body bytes, and whether to keep the
+        connection open
+    '''
+
+    request_line=await reader.readline()
+
+    if not request_line.strip():
+        return None
+
+    parts=request_line.decode('latin-1').split()
+
+    if len(parts)!=3:
+        raise ValueError('Malformed request line, expected\
+ "METHOD PATH VERSION"')
+
+    method,path,version=parts
+
+    headers={}
+
+    while True:
+        line=await reader.readline()
+
+        if line in [b'\r\n',b'\n',b'']:
+            break
+
+        name,_,value=line.decode('latin-1').partition(':')
+        headers[name.strip().lower()]=value.strip()
+
+    try:
+        length=int(headers.get('content-length',0))
+
+    except ValueError:
+        raise ValueError('Content-Length must be an integer') from None
+
+    if not 0<=length<=MAX_BODY:
+        raise ValueError(f'Content-Length must be between 0 and {MAX_BODY}')
+
+    body=await reader.readexactly(length) if length else b''
+
+    keep_alive=headers.get('connection','').lower()!='close' \
+      and version=='HTTP/1.1'
+
+    return method,path.split('?')[0],body,keep_alive
+
+def _write_response(writer,status,response,keep_alive):
+    '''
+    function to write a JSON HTTP response
+    '''
+
+    body=json.dumps(response).encode()
+
+    writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n\
+Content-Type: application/json\r\n\
+Content-Length: {len(body)}\r\n\
+Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode()+body)
+
+def main(args=None):
+    '''
+    function to run the server from the command line, e.g.,
+
+    python odds_server.py --port 8765 --workers 4
+
+    and then query it with, e.g.,
+
+    curl -d '{"config":{"difficulty":"hard","num_pcs":4}}'\
+ http://127.0.0.1:8765/odds
+
+    Parameters
+    ----------
+    args - list or None-type
+        command line arguments, if None-type sys.argv is used
+    '''
+
+    parser=argparse.ArgumentParser(description='Serve encounter odds\
+ over HTTP')
+
+    parser.add_argument('--host',default='127.0.0.1',help='address to\
+ listen on')
+    parser.add_argument('--port',type=int,default=8765,help='port to\
+ listen on')
+    parser.add_argument('--workers',type=int,default=None,
+                        help='number of worker processes, one per CPU by\
+ default')
+    parser.add_argument('--cache-size',type=int,default=1024,
+                        help='number of query results to cache')
+    parser.add_argument('--num-sims',type=int,default=10000,
+                        help='number of simulations when a query does not\
+ say')
+    parser.add_argument('--seed',type=int,default=0,
+                        help='seed when a query does not give one')
+
+    parsed=parser.parse_args(args)
+
+    server=OddsServer(num_workers=parsed.workers,cache_size=parsed.cache_size,
+                      num_sims=parsed.num_sims,SEED=parsed.seed)
+
+    print(f'Serving encounter odds on http://{parsed.host}:{parsed.port}')
+
+    try:
+        asyncio.run(server.serve(parsed.host,parsed.port))
+
+    except KeyboardInterrupt:
+        pass
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,260 @@
+#class for a content-addressed on-disk cache of simulation output
+#files, keyed by the configuration, seed, and run settings
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from functools import lru_cache
+from pathlib import Path
+
+from encounter_utils import normalize_configuration
+
+#modules whose code decides the simulation results, a change to
+#any of them gives a new engine_version and so new cache keys
+ENGINE_MODULES=['battle_groups.py','batch_encounter.py','composition_index.py',
+                'encounter.py','encounter_hooks.py','encounter_utils.py',
+                'encounter_worker.py','run_encounters.py']
+
+#cache directory used if none is given and the
+#ENCOUNTER_CACHE_DIR environment variable is not set
+DEFAULT_DIRECTORY=Path.home()/'.cache'/'encounter_calibration'
+
+class ResultCache():
+    '''
+    class for a directory of cached simulation output files, each
+    stored under the sha256 hash of everything that decides its
+    contents, with the least recently used files removed once the
+    directory grows past a size limit
+
+    ...
+
+    Attributes
+    ----------
+    directory - pathlib.Path
+        the cache directory
+    max_bytes - int
+        largest total size of the cached files
+
+    Methods
+    -------
+    clear()
+        method to remove every cached file
+    get(key,output_file)
+        method to copy a cached output file to output_file
+    key(config,suffix,**settings)
+        method to get the cache key of a run
+    put(key,output_file,info)
+        method to add an output file to the cache
+    size()
+        method to get the total size of the cached files
+    '''
+
+    def __init__(self,DIRECTORY=None,MAX_BYTES=2**30):
+        '''
+        Parameters
+        ----------
+        DIRECTORY - str, path-like, or None-type
+            cache directory, if None-type the ENCOUNTER_CACHE_DIR
+            environment variable is used, or DEFAULT_DIRECTORY
+            if it is not set
+        MAX_BYTES - int
+            largest total size of the cached files, 1 GiB by default
+        '''
+
+        if DIRECTORY is None:
+            DIRECTORY=os.environ.get('ENCOUNTER_CACHE_DIR',DEFAULT_DIRECTORY)
+
+        self.directory=Path(DIRECTORY)
+        self.max_bytes=MAX_BYTES
+
+        self.directory.mkdir(parents=True,exist_ok=True)
+
+    def key(self,config,suffix,**settings):
+        '''
+        method to get the cache key of a run
+
+        Parameters
+        ----------
+        config - dict
+            the configuration of the run, normalized first (see
+            encounter_utils.normalize_configuration) so equivalent
+            configurations share a key
+        suffix - str
+            the output file suffix (e.g., '.csv')
+        settings
+            every other value the results depend on (e.g., seed,
+            num_sims, first_sim, batch_size), must be JSON serializable
+
+        Returns
+        -------
+        str
+            the sha256 hex digest
+        '''
+
+        content=json.dumps({'config':normalize_configuration(config),
+                            'suffix':suffix.lower(),
+                            'settings':settings,
+                            'engine':engine_version()},sort_keys=True)
+
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self,key,output_file):
+        '''
+        method to copy a cached output file to output_file
+
+        Parameters
+        ----------
+        key - str
+            cache key, see key
+        output_file - str or path-like
+            where to copy the cached file
+
+        Returns
+        -------
+        dict or None-type
+            the details of the cached run saved by put, or
+            None-type if the key is not in the cache
+        '''
+
+        data_file,info_file=self._paths(key,Path(output_file).suffix)
+
+        try:
+            with open(info_file,'r') as ifile:
+                info=json.load(ifile)
+
+            shutil.copyfile(data_file,output_file)
+
+        except FileNotFoundError:
+            return None
+
+        #mark the entry as just used
+        for path in [data_file,info_file]:
+            os.utime(path)
+
+        return info
+
+    def put(self,key,output_file,info):
+        '''
+        method to add an output file to the cache, and remove least
+        recently used files if the cache is then over max_bytes
+
+        Parameters
+        ----------
+        key - str
+            cache key, see key
+        output_file - str or path-like
+            the output file to cache
+        info - dict
+            details of the run returned by get, must be
+            JSON serializable
+        '''
+
+        data_file,info_file=self._paths(key,Path(output_file).suffix)
+
+        data_file.parent.mkdir(parents=True,exist_ok=True)
+
+        #copy to a temporary name first, so a reader never
+        #sees a partly written entry
+        with tempfile.NamedTemporaryFile(dir=data_file.parent,
+                                         delete=False) as tfile:
+            temp_name=tfile.name
+
+        shutil.copyfile(output_file,temp_name)
+        os.replace(temp_name,data_file)
+
+        with tempfile.NamedTemporaryFile('w',dir=data_file.parent,
+                                         delete=False) as tfile:
+            json.dump(info,tfile)
+
+        os.replace(tfile.name,info_file)
+
+        self._evict()
+
+    def size(self):
+        '''
+        method to get the total size of the cached files
+
+        Returns
+        -------
+        int
+            total size, in bytes
+        '''
+
+        return sum(path.stat().st_size for path in self._files())
+
+    def clear(self):
+        '''
+        method to remove every cached file
+        '''
+
+        for path in self._files():
+            path.unlink(missing_ok=True)
+
+    def _paths(self,key,suffix):
+        '''
+        method to get the output and details files of an entry,
+        the details file has its own suffix so it is never the
+        same file as a '.json' output
+        '''
+
+        entry=self.directory/key[:2]/key
+
+        return entry.with_name(key+suffix.lower()),\
+          entry.with_name(key+'.info.json')
+
+    def _files(self):
+        '''
+        method to list the files of every entry
+        '''
+
+        return [path for path in self.directory.glob('??/*') \
+                if path.is_file()]
+
+    def _evict(self):
+        '''
+        method to remove the least recently used entries until
+        the cache is no larger than max_bytes
+        '''
+
+        entries={}
+
+        for path in self._files():
+            stat=path.stat()
+            entry=entries.setdefault(path.name.split('.')[0],[0,0.,[]])
+
+            entry[0]+=stat.st_size
+            entry[1]=max(entry[1],stat.st_mtime)
+            entry[2].append(path)
+
+        total=sum(entry[0] for entry in entries.values())
+
+        for size,_,paths in sorted(entries.values(),key=lambda entry:entry[1]):
+            if total<=self.max_bytes:
+                break
+
+            for path in paths:
+                path.unlink(missing_ok=True)
+
+            total-=size
+
+@lru_cache
+def engine_version():
+    '''
+    function to get the version of the simulation code, the sha256
+    hash of the source of the ENGINE_MODULES
+
+    Returns
+    -------
+    str
+        the first 16 characters of the hex digest
+    '''
+
+    digest=hashlib.sha256()
+
+    for module in ENGINE_MODULES:
+        digest.update((Path(__file__).parent/module).read_bytes())
+
+    return digest.hexdigest()[:16]
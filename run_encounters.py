@@ -3,30 +3,93 @@
 #and save results in CSV file for analysis
 
 import numpy as np
-import pandas as pd
 import multiprocessing as mp
 
-from battle_groups import (
-                    Party,
-                    Enemies
-                    )
+from encounter import SUMMARY_DTYPE
 
-from encounter import Encounter
+from encounter_hooks import EventCounter
 
 from encounter_utils import (
-                    valid_configuration,
-                    valid_difficulty
+                    load_configuration,
+                    normalize_configuration
+                    )
+
+from accumulators import (
+                    read_summary,
+                    SummaryAccumulator,
+                    write_summary
+                    )
+
+#the functions run by the worker processes, along with the
+#simulate_* functions and simulation_seed for other modules
+from encounter_worker import (
+                    _init_worker,
+                    _record_range,
+                    _simulate_index,
+                    _simulate_range,
+                    _summarize_range,
+                    SharedRecords,
+                    simulate_batch,
+                    simulate_encounter,
+                    simulation_seed,
+                    summarize_simulations
+                    )
+
+from run_profile import (
+                    read_sidecar,
+                    RunProfile,
+                    sidecar_path,
+                    write_sidecar
                     )
 
+from result_cache import (
+                    engine_version,
+                    ResultCache
+                    )
+
+from contextlib import (
+                    contextmanager,
+                    nullcontext
+                    )
 from pathlib import Path
+from statistics import NormalDist
 
-import time
 import os
+import shutil
+import tempfile
+
+#column types used for the binary output formats, small integer
+#and float types are plenty for the values a simulation produces
+RESULT_DTYPES={'party_hp':'int16',
+               'party_extras':'int8',
+               'frac_party_hp':'float32',
+               'frac_party_extras':'float32',
+               'num_party_down':'int8',
+               'frac_party_down':'float32',
+               'success':'bool',
+               'enemies_hp':'float32',
+               'num_enemies_down':'int8',
+               'num_enemies':'int8',
+               'frac_enemies_down':'float32',
+               'CRs':'category',
+               'totalXP':'float32',
+               'num_rounds':'int16',
+               'num_turns':'int16'}
+
+#supported output file formats, chosen by the output file suffix
+OUTPUT_FORMATS=['.csv','.npz','.parquet','.feather']
 
-import yaml
+#number of simulations in each worker task with summary_only
+#or shared_memory, when not running batches
+RANGE_TASK_SIZE=1000
 
 def generate_encounter_results(encounter_config,output_csv,
-                               num_sims,num_jobs,SEED=None):
+                               num_sims,num_jobs,SEED=None,batch_size=None,
+                               rng_mode='buffered',chunk_size=None,
+                               first_sim=0,group_index=None,half_width=None,
+                               confidence=0.95,profile=False,
+                               count_events=None,cache=None,append=False,
+                               summary_only=False,shared_memory=False):
     '''
     function to run many simulations of an encounter of a
     specified difficulty level for a set number of PCs of
@@ -35,129 +98,1181 @@ def generate_encounter_results(encounter_config,output_csv,
     
     Parameters
     ----------
-    encounter_config - str or path-like
+    encounter_config - str, path-like, or dict
         name or path-like object for input yaml configuration
-        file specifying encounter details
+        file specifying encounter details, or the dictionary
+        returned by encounter_utils.load_configuration
     output_csv - str or path-like
-        name or path-like object for output CSV file with
-        details of each simulated encounter
+        name or path-like object for output file with details of
+        each simulated encounter, the format is chosen by the suffix:
+        '.csv', or one of the binary columnar formats '.npz',
+        '.parquet', or '.feather' which store typed columns (see
+        RESULT_DTYPES) and are read back with load_encounter_results,
+        '.parquet' and '.feather' need the optional pyarrow package
     num_sims - int
         number of simulations to run
     num_jobs - int
         number of parallel jobs to run
     SEED - int
-        optional seed to instantiate the random number generator
-        only needed for if reproducibility is desired
+        optional root seed for the simulations, simulation i always
+        gets the random stream simulation_seed(SEED,i) no matter the
+        num_jobs value or machine, if None-type fresh entropy from the
+        operating system is used and returned so the run can be redone
+    batch_size - int or None-type
+        if specified, the simulations are run in batches of (up to)
+        this many encounters with the vectorized BatchEncounter class
+        instead of one Encounter object per simulation, batches start
+        at multiples of batch_size in simulation index, so results
+        depend on batch_size but not on num_jobs, each batch draws from
+        the seed of its first simulation, so first_sim must then be a
+        multiple of batch_size
+    rng_mode - str
+        how the Encounter turn loop makes its random draws, either
+        'buffered' or 'exact', with 'exact' reproducing results of
+        earlier versions of the code for a given SEED, see the
+        encounter.EncounterRNG class, ignored if batch_size is given
+    chunk_size - int or None-type
+        if specified, results are appended to output_csv in chunks of
+        (at least) this many simulations as they arrive from the
+        workers, instead of all at once at the end, so memory use
+        does not grow with num_sims (as long as writing keeps up with
+        the workers) and a crash keeps finished chunks,
+        note that '.npz' and '.feather' files cannot be appended to,
+        so for those the typed chunks are kept and written at the end
+    first_sim - int
+        index of the first simulation to run, so one large run can be
+        split into shards (e.g., across machines) that each run a range
+        of simulation indices with the same SEED, and then be combined
+        with merge_encounter_results to match a single run, with
+        batch_size every shard must start on a multiple of batch_size
+    group_index - bool or None-type
+        if True, random enemy groups are picked from the precomputed
+        composition_index.CompositionIndex instead of built by random
+        trial, if None-type the 'group_index' entry of the
+        configuration is used, which defaults to False
+    half_width - float, dict, or None-type
+        if specified, simulations stop early once the confidence
+        intervals are this tight, with num_sims as the maximum, either
+        the target half-width of the interval on the success rate, or
+        a dictionary with column names (e.g., 'success',
+        'frac_party_hp') as keys and target half-widths as values,
+        the intervals are checked every chunk_size simulations (every
+        batch if batch_size is given, otherwise every 1000), in
+        simulation order, so the stopping point does not depend
+        on num_jobs
+    confidence - float
+        confidence level of the intervals used with half_width, a
+        Wilson score interval for 'success' and a normal interval on
+        the mean for other columns
+    profile - bool
+        if True, time the phases of the run in the parent process and
+        in the workers (see run_profile.RunProfile) and measure the
+        size of the results sent back, the measurements are saved
+        with the details of the run, when False nothing is measured
+    count_events - bool or None-type
+        if True, each encounter also counts its heals, extras used,
+        critical hits, misses, downs, and revives, which are added
+        as columns to the output (see encounter_hooks.EventCounter),
+        if None-type the 'count_events' entry of the configuration
+        is used, which defaults to False, cannot be used with
+        batch_size
+    cache - bool, result_cache.ResultCache, or None-type
+        if True (for the default cache directory) or a ResultCache,
+        a run with a SEED first looks for its output in the cache,
+        keyed by the normalized configuration, SEED, the settings
+        that change the results, and the simulation code version,
+        and copies it to output_csv instead of simulating if found,
+        otherwise the new output is added to the cache, not used
+        when profile is True
+    append - bool
+        if True and output_csv exists, num_sims more simulations are
+        added to the end of it, continuing from where the run that
+        wrote it stopped, so the combined file matches a single run
+        of the total size, the SEED (which can be left out), settings
+        that change the results, configuration, and simulation code
+        must be the same as for that run, first_sim is ignored, and
+        with batch_size the earlier run must have ended on a
+        multiple of batch_size, cannot be used with half_width
+    summary_only - bool
+        if True, no per simulation results are kept, each worker
+        accumulates statistics of its simulations (see the
+        accumulators.SummaryAccumulator class) and sends back only
+        those, which are merged and written to output_csv, which
+        must then be a '.json' file (read back with
+        accumulators.read_summary), so memory use and the data sent
+        between processes do not grow with num_sims, cannot be used
+        with half_width or append
+    shared_memory - bool
+        if True, workers write the results of each simulation as a
+        fixed width record (see encounter.SUMMARY_DTYPE) straight into
+        a multiprocessing.shared_memory array, at the row of its
+        simulation index, instead of sending back a summary dictionary,
+        and the output is written from that array, the output file is
+        the same, cannot be used with chunk_size, half_width, or
+        summary_only
+    
+    Returns
+    -------
+    dict
+        details of the run, with keys
+          seed: the root seed entropy, which is the SEED
+            value if one was given
+          first_sim: index of the first simulation
+          num_sims: number of simulations run
+          intervals: only if half_width is given, dictionary with the
+            interval centre and half-width of each target column, see
+            confidence_intervals
+          converged: only if half_width is given, if every target
+            half-width was reached within num_sims simulations,
+            False if no simulations were run
+          profile: only if profile is True, the measurements, see
+            run_profile.RunProfile.report
+          cached: only if cache is used, if the output was
+            copied from the cache
+          total_sims: only if append is True, number of simulations
+            in the combined output file
+          summary: only if summary_only is True, the merged
+            SummaryAccumulator
+        
+        the details of the run, along with the normalized
+        configuration, settings, and simulation code version, are
+        also saved to a JSON sidecar file, the output file name with
+        '.json' added (e.g., 'results.csv.json'), which is what
+        append reads
     '''
     
+    run_profile=RunProfile() if profile else None
+    
+    #only extend a file that is there
+    append=append and Path(output_csv).exists()
+    
+    #check the output format before running anything
+    if summary_only:
+        if Path(output_csv).suffix.lower()!='.json':
+            raise ValueError(f'With summary_only the output file must be a\
+ ".json" file, not "{Path(output_csv).suffix}"')
+        
+        if half_width is not None or append:
+            raise ValueError('summary_only cannot be used with half_width\
+ or append')
+        
+        writer=None
+    
+    else:
+        writer=ResultWriter(output_csv)
+    
+    if shared_memory and (chunk_size is not None or half_width is not None \
+                          or summary_only):
+        raise ValueError('shared_memory cannot be used with chunk_size,\
+ half_width, or summary_only')
+    
     #first, we'll make sure that the configuration exists
-    #and has valid options
-    if not valid_configuration(encounter_config):
-        raise RuntimeError(f'{encounter_config} has invalid parameters')
+    #and has valid options, this is the only time it is read,
+    #the workers are handed the resulting dictionary
+    if isinstance(encounter_config,dict):
+        config=encounter_config
     
-    with open(encounter_config,'r') as cfile:
-        config=yaml.safe_load(cfile)
+    else:
+        with _phase(run_profile,'config'):
+            config=load_configuration(encounter_config)
     
-    #make sure a valid difficulty category has been supplied
-    if not valid_difficulty(config['difficulty']):
-        raise ValueError(f'{difficulty = } is not valid, must be one\
- of "easy", "medium", "hard", or "deadly".  Case does not matter.')
+    if group_index is not None:
+        config=dict(config,group_index=group_index)
     
-    #make lists of SEEDs to give to each simulation
-    #to avoid duplication and give each the name
-    #of the pickle file
-    rng=np.random.default_rng(seed=SEED \
-      if SEED is not None \
-      else int(time.time()))
+    if count_events is not None:
+        config=dict(config,count_events=count_events)
     
-    seeds=[int(time.time()*rng.random()) \
-            for _ in range(num_sims)]
+    if config.get('count_events') and batch_size is not None:
+        raise ValueError('count_events cannot be used with batch_size,\
+ the BatchEncounter class does not report individual events')
     
-    config_files=[str(encounter_config)]*num_sims
-
-    inputs=np.array([seeds,config_files],dtype=object).T
+    if append:
+        #pick up the seed and count of the run that wrote the file
+        previous=_previous_run(output_csv,config,SEED,batch_size,rng_mode,
+                               half_width)
+        
+        SEED=previous['seed']
+        first_sim=previous['first_sim']+previous['num_sims']
+        
+        writer=ResultWriter(output_csv,APPEND=True)
+    
+    if batch_size is not None and first_sim%batch_size:
+        raise ValueError(f'first_sim = {first_sim} must be a multiple of\
+ batch_size = {batch_size}, a batch starting mid-way would not match the\
+ one in a single run')
+    
+    #every simulation seed is spawned from this root, which
+    #gets fresh entropy if no SEED was given
+    entropy=np.random.SeedSequence(SEED).entropy
+    
+    last_sim=first_sim+num_sims
+    
+    if half_width is not None:
+        #targets for the stopping check
+        half_width=half_width if isinstance(half_width,dict) \
+          else {'success':half_width}
+        
+        #how many simulations are written between checks
+        chunk_size=chunk_size if chunk_size is not None else \
+          batch_size if batch_size is not None else 1000
+    
+    #without a SEED the results are new every time, so there
+    #is nothing to look up
+    cache_key=None
+    
+    if cache and SEED is not None and not profile and not append:
+        cache=ResultCache() if cache is True else cache
+        
+        cache_key=cache.key(config,Path(output_csv).suffix,seed=entropy,
+                            num_sims=num_sims,first_sim=first_sim,
+                            batch_size=batch_size,
+                            rng_mode=None if batch_size else rng_mode,
+                            half_width=half_width,
+                            confidence=confidence if half_width else None,
+                            chunk_size=chunk_size if half_width else None,
+                            summary_only=summary_only)
+        
+        info=cache.get(cache_key,output_csv)
+        
+        if info is not None and summary_only:
+            info['summary']=read_summary(output_csv)
+        
+        if info is not None:
+            #JSON turns the (mean,half-width) tuples into lists
+            if 'intervals' in info:
+                info['intervals']={column:tuple(interval) for column,interval \
+                                   in info['intervals'].items()}
+            
+            info['cached']=True
+            
+            write_sidecar(output_csv,_run_details(info,config,num_jobs,
+                                                  batch_size,chunk_size,
+                                                  rng_mode))
+            
+            return info
+    
+    if batch_size is None:
+        #each task is just the index of one simulation, the worker
+        #turns it into that simulation's seed
+        tasks=range(first_sim,last_sim)
+        
+        worker=_simulate_index
+        
+        #hand out a few chunks of simulations per job at a time
+        task_chunks=1 if chunk_size is None else \
+          max(1,chunk_size//(4*num_jobs))
+    
+    else:
+        #split the simulations into batches at multiples of
+        #batch_size, each task is a range of simulation indices
+        tasks=_batch_tasks(first_sim,last_sim,batch_size)
+        
+        worker=_simulate_range
+        
+        task_chunks=1
+    
+    batched=batch_size is not None
+    
+    if summary_only:
+        #workers send back the statistics of a range of simulations,
+        #a batch or RANGE_TASK_SIZE simulations, instead of rows
+        tasks=_range_tasks(tasks,first_sim,last_sim,batched)
+        
+        worker=_summarize_range
+    
+    elif shared_memory:
+        #workers write their results into a shared array,
+        #sending back only how many they wrote
+        tasks=_range_tasks(tasks,first_sim,last_sim,batched)
+        
+        worker=_record_range
+        
+        records=_shared_records(num_sims,first_sim,config.get('count_events'))
+    
+    info={'seed':entropy,
+          'first_sim':first_sim,
+          'num_sims':num_sims}
     
     #create a multiprocessing pool and 'submit the jobs'
-    with mp.Pool(processes=num_jobs) as pool:
-        results=pool.map(simulate_encounter,inputs)
+    with _phase(run_profile,'pool_start'):
+        pool=mp.Pool(processes=num_jobs,initializer=_init_worker,
+                     initargs=(config,rng_mode,entropy,profile,
+                               records.layout if shared_memory else None))
+    
+    with pool,_phase(run_profile,'simulate'),_discard_on_error(writer):
+        if shared_memory:
+            try:
+                for _ in _unwrap(pool.imap_unordered(worker,tasks),
+                                 run_profile):
+                    pass
+                
+                with _phase(run_profile,'frames'):
+                    encounter_df=records.frame()
+                
+                with _phase(run_profile,'write'):
+                    writer.write(encounter_df)
+                    writer.close()
+                
+                del encounter_df
+            
+            finally:
+                records.release()
+        
+        elif summary_only:
+            #merged in simulation order, so the statistics
+            #do not depend on num_jobs
+            info['summary']=SummaryAccumulator()
+            
+            for accumulator in _unwrap(pool.imap(worker,tasks),run_profile):
+                info['summary'].merge(accumulator)
+            
+            with _phase(run_profile,'write'):
+                write_summary(output_csv,info['summary'])
+        
+        elif half_width is not None:
+            #leaving the pool context stops the workers still running
+            #simulations past the stopping point
+            info['num_sims'],info['intervals']=_stream_until_precise(\
+              _unwrap(pool.imap(worker,tasks,chunksize=task_chunks),
+                      run_profile),
+              writer,chunk_size,batched,half_width,confidence,run_profile)
+            
+            #with no simulations there are no intervals to check
+            info['converged']=info['num_sims']>0 and \
+              all(interval[1]<=half_width[column] \
+                  for column,interval in info['intervals'].items())
+        
+        elif chunk_size is None:
+            results=list(_unwrap(pool.map(worker,tasks),run_profile))
+            
+            #now write the output file
+            with _phase(run_profile,'frames'):
+                encounter_df=results_frame(results,batched)
+            
+            with _phase(run_profile,'write'):
+                writer.write(encounter_df)
+                writer.close()
+        
+        else:
+            #imap keeps the results in simulation order, it holds
+            #every finished result not yet taken here, both those
+            #ahead of an unfinished one and those waiting on a write
+            _stream_results(_unwrap(pool.imap(worker,tasks,
+                                              chunksize=task_chunks),
+                                    run_profile),
+                            writer,chunk_size,batched,run_profile)
+    
+    if profile:
+        info['profile']=run_profile.report(info['num_sims'])
+    
+    details=_run_details(info,config,num_jobs,batch_size,chunk_size,rng_mode)
+    
+    if append:
+        #the sidecar describes the whole file
+        info['total_sims']=previous['num_sims']+info['num_sims']
+        
+        details.update(first_sim=previous['first_sim'],
+                       num_sims=info['total_sims'])
+        
+        for key in ['intervals','converged']:
+            details.pop(key,None)
     
-    #now write the output_csv
-    encounter_df=pd.DataFrame(results)
+    write_sidecar(output_csv,details)
     
-    #let's recode the success column to be binary 0/1
-    #instead of True/False which will likely be saved as a string
-    encounter_df.success=encounter_df.success.astype(int,copy=True)
+    if cache_key is not None:
+        cache.put(cache_key,output_csv,
+                  {key:value for key,value in info.items() if key!='summary'})
+        
+        info['cached']=False
     
-    #now, write to CSV file
-    encounter_df.to_csv(output_csv,index=False)
+    return info
 
+def _run_details(info,config,num_jobs,batch_size,chunk_size,rng_mode):
+    '''
+    function to get the details of a run saved to the sidecar
+    file of its output, see generate_encounter_results
+    
+    Returns
+    -------
+    dict
+        info, without the SummaryAccumulator of a summary_only run,
+        along with the settings of the run, the normalized
+        configuration, and the simulation code version
+    '''
+    
+    info={key:value for key,value in info.items() if key!='summary'}
+    
+    return dict(info,num_jobs=num_jobs,
+                batch_size=batch_size,
+                chunk_size=chunk_size,
+                rng_mode=rng_mode,
+                config=normalize_configuration(config),
+                engine=engine_version())
 
-def simulate_encounter(inputs):
+def _previous_run(output_file,config,SEED,batch_size,rng_mode,half_width):
     '''
-    function to run a simulation of a given encounter
-    and return details of the outcome
+    function to read the details of the run that wrote an output
+    file and check that a run with the given settings can extend it
     
     Parameters
     ----------
-    inputs - iterable
-        must be of length 2 with the first element being an
-        integer to use as the random seed and the second
-        being the name of a YAML configuration file
+    output_file - str or path-like
+        the output file to extend
+    config - dict
+        configuration of the new run
+    SEED - int or None-type
+        SEED of the new run
+    batch_size - int or None-type
+        batch_size of the new run
+    rng_mode - str
+        rng_mode of the new run
+    half_width - dict or None-type
+        half_width of the new run
     
     Returns
     -------
     dict
-        Encounter class object summary dictionary
-    '''
-    
-    #get simulation parameters from the pickled file
-    with Path(inputs[1]).open('r') as cfile:
-        config=yaml.safe_load(cfile)
-    
-    #create a random number generator instance using the
-    #input seed value
-    rng=np.random.default_rng(seed=inputs[0])
-    
-    #make the Party BattleGroup of PCs
-    party=Party(LVL=config.get('pcs_level'),
-                EXTRAS=config.get('extras'),
-                NUMBER=config.get('num_pcs'),
-                ATK=config.get('pcs_ATK'),
-                AC=config.get('pcs_AC'),
-                HP=config.get('pcs_HP'))
-    
-    #make the Enemies BattleGroup, give it a SEED
-    #derived from the input SEED
-    enemy_seed=int(inputs[0]*1000*rng.random())
-    
-    CRs=None if config.get('CRs')=='None' else confg.get('CRs')
-    
-    enemies=Enemies(DIFFICULTY=config.get('difficulty'),
-                    NUMBER=config.get('num_enemies'),
-                    ATK=config.get('enemies_ATK'),
-                    AC=config.get('enemies_AC'),
-                    CRs=CRs,
-                    NUM_PCs=config.get('num_pcs'),
-                    LVL_PCs=config.get('pcs_level'),
-                    SEED=enemy_seed)
-    
-    #check for an input initiative order
-    initiative=None if config.get('initiative')=='None' \
-      else config.get('initiative')
-    
-    ###create a random seed for the encounter
-    ##encounter_seed=int(inputs[0]*5000*rng.random())
-    
-    #create the encounter
-    encounter=Encounter(party=party,
-                        enemies=enemies,
-                        SEED=None,
-                        RNG=rng,
-                        initiative=initiative)
-    
-    #run the encounter
-    encounter.run_encounter()
-    
-    #return the summary dictionary
-    return encounter.summary
-    
\ No newline at end of file
+        the sidecar details of the earlier run
+    '''
+    
+    previous=read_sidecar(output_file)
+    
+    if previous is None:
+        raise ValueError(f'Cannot append to {output_file}, there is no\
+ {sidecar_path(output_file).name} file with the details of its run')
+    
+    if half_width is not None:
+        raise ValueError('half_width cannot be used with append')
+    
+    if SEED is not None and SEED!=previous['seed']:
+        raise ValueError(f'SEED = {SEED} does not match the seed\
+ {previous["seed"]} of the run that wrote {output_file}')
+    
+    if normalize_configuration(config)!=previous['config']:
+        raise ValueError(f'The configuration does not match the one used\
+ for {output_file}')
+    
+    if previous['engine']!=engine_version():
+        raise ValueError(f'The simulation code has changed since\
+ {output_file} was written, appended results would not match a single run')
+    
+    if batch_size!=previous['batch_size'] or \
+      (batch_size is None and rng_mode!=previous['rng_mode']):
+        raise ValueError(f'batch_size and rng_mode must match the run that\
+ wrote {output_file}, batch_size = {previous["batch_size"]} and rng_mode =\
+ {previous["rng_mode"]}')
+    
+    if batch_size is not None and \
+      (previous['first_sim']+previous['num_sims'])%batch_size:
+        raise ValueError(f'The run that wrote {output_file} did not end on a\
+ multiple of batch_size = {batch_size}, its last batch would not match a\
+ single run')
+    
+    #a file changed after its sidecar was written (e.g., by a
+    #run that stopped part way) cannot be continued
+    num_rows=_num_rows(output_file)
+    
+    if num_rows!=previous['num_sims']:
+        raise ValueError(f'{output_file} has {num_rows} results, but its\
+ {sidecar_path(output_file).name} file says it has {previous["num_sims"]},\
+ the simulations it holds are not known')
+    
+    return previous
+
+def _num_rows(results_file):
+    '''
+    function to get the number of results in an output file
+    '''
+    
+    if Path(results_file).suffix.lower()=='.csv':
+        #one line per result after the header
+        with open(results_file,'rb') as rfile:
+            return sum(1 for _ in rfile)-1
+    
+    return len(load_encounter_results(results_file))
+
+def merge_encounter_results(shard_files,output_file):
+    '''
+    function to combine the output files of several shards of a run
+    (see the first_sim argument of generate_encounter_results) into
+    a single output file
+    
+    Parameters
+    ----------
+    shard_files - list
+        files to combine, in order of their first simulation index
+    output_file - str or path-like
+        combined output file, the format is chosen by the suffix
+    '''
+    
+    writer=ResultWriter(output_file)
+    
+    for shard_file in shard_files:
+        writer.write(load_encounter_results(shard_file))
+    
+    writer.close()
+
+def results_frame(results,batched):
+    '''
+    function to combine simulation results into a DataFrame
+    
+    Parameters
+    ----------
+    results - list
+        list of Encounter summary dictionaries, or BatchEncounter
+        summary dictionaries if batched is True
+    batched - bool
+        flag indicating the results are BatchEncounter summaries
+    
+    Returns
+    -------
+    pandas.DataFrame
+        one row per simulated encounter
+    '''
+    
+    pd=_pandas()
+    
+    #concat needs at least one frame
+    if batched and results:
+        encounter_df=pd.concat([pd.DataFrame(result) for result in results],
+                               ignore_index=True)
+    
+    else:
+        encounter_df=pd.DataFrame(results)
+    
+    #totalXP is an int or a float depending on the XP multiplier, fix
+    #its dtype so chunks and appended runs write the same text as
+    #a single run
+    if 'totalXP' in encounter_df:
+        encounter_df['totalXP']=encounter_df.totalXP.astype('float64')
+    
+    return encounter_df
+
+class ResultWriter():
+    '''
+    class to write simulation results to an output file, in one
+    go or in chunks, in the format given by the file suffix
+    
+    ...
+    
+    Attributes
+    ----------
+    file_format - str
+        the output file suffix, one of OUTPUT_FORMATS
+    output_file - pathlib.Path
+        the output file
+    
+    Methods
+    -------
+    close()
+        method to finish writing the output file
+    discard()
+        method to stop writing without finishing the output file
+    write(encounter_df)
+        method to write (or add) a DataFrame of results
+    '''
+    
+    def __init__(self,output_file,APPEND=False):
+        '''
+        Parameters
+        ----------
+        output_file - str or path-like
+            the output file, overwritten by the first write
+            unless APPEND is True
+        APPEND - bool
+            if True, writes are added to the end of the existing
+            output file instead, going to a temporary file next to
+            it which only replaces it in close, so the existing file
+            is left as it was if the writing stops part way
+        '''
+        
+        self.output_file=Path(output_file)
+        self.file_format=self.output_file.suffix.lower()
+        
+        if self.file_format not in OUTPUT_FORMATS:
+            raise ValueError(f'Unsupported output file format\
+ "{self.file_format}", must be one of {OUTPUT_FORMATS}')
+        
+        #track if anything has been written yet, and hold on to
+        #the pieces for formats that must be written in one go
+        self._started=False
+        self._frames=[]
+        self._parquet_writer=None
+        
+        #where the results are written, only a temporary
+        #file when adding to an existing output file
+        self._path=self.output_file
+        
+        if APPEND:
+            self._start_append()
+    
+    def _start_append(self):
+        '''
+        method to set up adding to the end of an existing output file,
+        which is copied to a temporary file, formats other than '.csv'
+        are read in and written back out
+        '''
+        
+        with tempfile.NamedTemporaryFile(dir=self.output_file.parent,
+                                         prefix=self.output_file.name+'.',
+                                         suffix=self.file_format,
+                                         delete=False) as tfile:
+            self._path=Path(tfile.name)
+        
+        if self.file_format=='.csv':
+            #the header is already there
+            shutil.copyfile(self.output_file,self._path)
+        
+        elif self.file_format=='.parquet':
+            table=_pyarrow_parquet().read_table(self.output_file)
+            
+            self._parquet_writer=_pyarrow_parquet()\
+              .ParquetWriter(self._path,table.schema)
+            self._parquet_writer.write_table(table)
+        
+        else:
+            encounter_df=load_encounter_results(self.output_file)
+            
+            self._frames.append(encounter_df.astype(RESULT_DTYPES))
+        
+        self._started=True
+    
+    def write(self,encounter_df):
+        '''
+        method to write a DataFrame of results to the output file,
+        or add it to the end of what has already been written
+        
+        Parameters
+        ----------
+        encounter_df - pandas.DataFrame
+            results to write, one row per simulated encounter
+        '''
+        
+        #the results of no simulations have no columns either
+        if encounter_df.columns.empty:
+            return
+        
+        if self.file_format=='.csv':
+            #let's recode the success column to be binary 0/1
+            #instead of True/False which will likely be saved as a string
+            encounter_df.success=encounter_df.success.astype(int,copy=True)
+            
+            #now, write to CSV file
+            encounter_df.to_csv(self._path,index=False,
+                                mode='a' if self._started else 'w',
+                                header=not self._started)
+        
+        elif self.file_format=='.parquet':
+            #CRs are kept as plain strings in the file, parquet
+            #dictionary encodes them, as the categories can differ
+            #between chunks
+            dtypes=dict(RESULT_DTYPES,CRs='str')
+            table=_pyarrow().Table.from_pandas(encounter_df.astype(dtypes),
+                                               preserve_index=False)
+            
+            if self._parquet_writer is None:
+                self._parquet_writer=_pyarrow_parquet()\
+                  .ParquetWriter(self._path,table.schema)
+            
+            self._parquet_writer.write_table(table)
+        
+        else:
+            #keep the much smaller typed version until closing
+            self._frames.append(encounter_df.astype(RESULT_DTYPES))
+        
+        self._started=True
+    
+    def close(self):
+        '''
+        method to finish writing the output file
+        '''
+        
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer=None
+        
+        if self.file_format in ['.npz','.feather'] and self._frames:
+            self._write_frames()
+        
+        if self._path!=self.output_file:
+            os.replace(self._path,self.output_file)
+            
+            self._path=self.output_file
+    
+    def discard(self):
+        '''
+        method to stop writing without finishing the output file,
+        when adding to an existing output file it is left as it was,
+        otherwise the chunks already written to a '.csv' or
+        '.parquet' file are kept
+        '''
+        
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer=None
+        
+        self._frames=[]
+        
+        if self._path!=self.output_file:
+            self._path.unlink(missing_ok=True)
+            
+            self._path=self.output_file
+    
+    def _write_frames(self):
+        '''
+        method to write the kept typed results to a
+        '.npz' or '.feather' file in one go
+        '''
+        
+        pd=_pandas()
+        
+        #combining categoricals with different categories
+        #would give back plain strings
+        CRs=pd.api.types.union_categoricals([frame.CRs \
+                                             for frame in self._frames])
+        
+        encounter_df=pd.concat(self._frames,ignore_index=True)
+        encounter_df['CRs']=CRs
+        
+        self._frames=[]
+        
+        if self.file_format=='.feather':
+            encounter_df.to_feather(self._path)
+        
+        else:
+            #store the CRs as integer codes and the category strings,
+            #and any other text columns as fixed width strings
+            columns={key:encounter_df[key].to_numpy() \
+                     for key in encounter_df.columns if key!='CRs'}
+            
+            for key,column in columns.items():
+                if column.dtype==object:
+                    columns[key]=column.astype(str)
+            
+            np.savez(self._path,
+                     CRs_codes=CRs.codes,
+                     CRs_categories=CRs.categories.to_numpy(dtype=str),
+                     **columns)
+
+def _pandas():
+    '''
+    function to import pandas, only when a DataFrame is needed, so
+    importing this module (and starting workers) stays quick
+    '''
+    
+    import pandas
+    
+    return pandas
+
+def _pyarrow():
+    '''
+    function to import the optional pyarrow package
+    '''
+    
+    try:
+        import pyarrow
+    
+    except ImportError:
+        raise ImportError('Writing parquet files needs the pyarrow package,\
+ install it or use a ".npz" or ".csv" output file')
+    
+    return pyarrow
+
+def _pyarrow_parquet():
+    '''
+    function to import the parquet module of the optional
+    pyarrow package
+    '''
+    
+    _pyarrow()
+    
+    import pyarrow.parquet
+    
+    return pyarrow.parquet
+
+def load_encounter_results(results_file):
+    '''
+    function to read a file written by generate_encounter_results
+    into a DataFrame
+    
+    Parameters
+    ----------
+    results_file - str or path-like
+        the results file, with one of the OUTPUT_FORMATS suffixes
+    
+    Returns
+    -------
+    pandas.DataFrame
+        one row per simulated encounter, binary formats come back
+        with the RESULT_DTYPES column types
+    '''
+    
+    pd=_pandas()
+    
+    file_format=Path(results_file).suffix.lower()
+    
+    if file_format=='.csv':
+        #read the fractions back exactly as they were written, and
+        #keep CRs as strings even if they all look like numbers
+        return pd.read_csv(results_file,float_precision='round_trip',
+                           dtype={'CRs':str})
+    
+    if file_format=='.feather':
+        return pd.read_feather(results_file)
+    
+    if file_format=='.parquet':
+        encounter_df=pd.read_parquet(results_file)
+        encounter_df['CRs']=encounter_df.CRs.astype('category')
+        
+        return encounter_df
+    
+    if file_format!='.npz':
+        raise ValueError(f'Unsupported results file format "{file_format}",\
+ must be one of {OUTPUT_FORMATS}')
+    
+    with np.load(results_file) as npz:
+        columns={key:npz[key] for key in npz.files}
+    
+    CRs=pd.Categorical.from_codes(columns.pop('CRs_codes'),
+                                  columns.pop('CRs_categories'))
+    
+    encounter_df=pd.DataFrame(columns)
+    encounter_df['CRs']=CRs
+    
+    #keep the usual column order, with any extra columns
+    #(e.g., the configuration tags of a sweep) at the end
+    return encounter_df[list(RESULT_DTYPES)+[key for key in encounter_df.columns \
+                                            if key not in RESULT_DTYPES]]
+
+def _stream_results(results,writer,chunk_size,batched,run_profile=None):
+    '''
+    function to write simulation results to the output file
+    in chunks as they are produced
+    
+    Parameters
+    ----------
+    results - iterable
+        iterable of Encounter summary dictionaries, or BatchEncounter
+        summary dictionaries if batched is True
+    writer - ResultWriter
+        writer for the output file
+    chunk_size - int
+        minimum number of simulations to collect before writing
+    batched - bool
+        flag indicating the results are BatchEncounter summaries
+    run_profile - RunProfile or None-type
+        if given, the time spent building DataFrames and
+        writing is added to it
+    '''
+    
+    chunk=[]
+    chunk_sims=0
+    
+    for result in results:
+        chunk.append(result)
+        chunk_sims+=len(result['success']) if batched else 1
+        
+        if chunk_sims>=chunk_size:
+            _write_chunk(chunk,writer,batched,run_profile)
+            
+            chunk=[]
+            chunk_sims=0
+    
+    #write whatever is left
+    if chunk:
+        _write_chunk(chunk,writer,batched,run_profile)
+    
+    with _phase(run_profile,'write'):
+        writer.close()
+
+def _write_chunk(chunk,writer,batched,run_profile=None):
+    '''
+    function to write a chunk of simulation results
+    
+    Parameters
+    ----------
+    chunk - list
+        list of Encounter summary dictionaries, or BatchEncounter
+        summary dictionaries if batched is True
+    writer - ResultWriter
+        writer for the output file
+    batched - bool
+        flag indicating the results are BatchEncounter summaries
+    run_profile - RunProfile or None-type
+        if given, the time spent building the DataFrame and
+        writing is added to it
+    
+    Returns
+    -------
+    pandas.DataFrame
+        the chunk as written
+    '''
+    
+    with _phase(run_profile,'frames'):
+        encounter_df=results_frame(chunk,batched)
+    
+    with _phase(run_profile,'write'):
+        writer.write(encounter_df)
+    
+    return encounter_df
+
+@contextmanager
+def _discard_on_error(writer):
+    '''
+    function to get the context manager which discards what has
+    been written by a ResultWriter if the run stops with an error,
+    so an output file being added to is left as it was
+    '''
+    
+    try:
+        yield
+    
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        
+        raise
+
+def _phase(run_profile,name):
+    '''
+    function to get the context manager timing a phase of
+    a run, which does nothing if run_profile is None-type
+    '''
+    
+    return nullcontext() if run_profile is None else run_profile.phase(name)
+
+def _unwrap(results,run_profile):
+    '''
+    function to record and strip the measurements sent back with
+    worker results when profiling, otherwise results are passed as is
+    '''
+    
+    return results if run_profile is None else \
+      run_profile.unwrap(results,_num_results)
+
+def _num_results(result):
+    '''
+    function to get the number of simulations in a worker result,
+    an Encounter or BatchEncounter summary dictionary or a
+    SummaryAccumulator
+    '''
+    
+    if isinstance(result,SummaryAccumulator):
+        return result.num_sims
+    
+    #workers writing to shared memory send back a count
+    if isinstance(result,int):
+        return result
+    
+    return 1 if isinstance(result['success'],(bool,np.bool_)) \
+      else len(result['success'])
+
+def _stream_until_precise(results,writer,chunk_size,batched,half_width,
+                          confidence,run_profile=None):
+    '''
+    function to write simulation results to the output file in
+    chunks as they are produced, keeping running sums of the target
+    columns and stopping once every confidence interval is tight enough
+    
+    Parameters
+    ----------
+    results - iterable
+        iterable of Encounter summary dictionaries, or BatchEncounter
+        summary dictionaries if batched is True
+    writer - ResultWriter
+        writer for the output file
+    chunk_size - int
+        minimum number of simulations to collect before writing
+        and checking the intervals
+    batched - bool
+        flag indicating the results are BatchEncounter summaries
+    half_width - dict
+        target half-width of the interval for each column
+    confidence - float
+        confidence level of the intervals
+    run_profile - RunProfile or None-type
+        if given, the time spent building DataFrames and
+        writing is added to it
+    
+    Returns
+    -------
+    int
+        number of simulations written
+    dict
+        mean and half-width of the interval for each column
+    '''
+    
+    z=NormalDist().inv_cdf(0.5+confidence/2)
+    
+    num_sims=0
+    totals={column:0. for column in half_width}
+    squares={column:0. for column in half_width}
+    intervals={}
+    
+    chunk=[]
+    chunk_sims=0
+    
+    for result in results:
+        chunk.append(result)
+        chunk_sims+=len(result['success']) if batched else 1
+        
+        if chunk_sims<chunk_size:
+            continue
+        
+        encounter_df=_write_chunk(chunk,writer,batched,run_profile)
+        
+        chunk=[]
+        chunk_sims=0
+        
+        num_sims+=len(encounter_df)
+        
+        for column in half_width:
+            values=encounter_df[column].to_numpy(dtype=float)
+            totals[column]+=values.sum()
+            squares[column]+=(values**2).sum()
+        
+        intervals=confidence_intervals(num_sims,totals,squares,z)
+        
+        if all(intervals[column][1]<=target \
+               for column,target in half_width.items()):
+            with _phase(run_profile,'write'):
+                writer.close()
+            
+            return num_sims,intervals
+    
+    #ran every simulation, write whatever is left
+    if chunk:
+        encounter_df=_write_chunk(chunk,writer,batched,run_profile)
+        
+        num_sims+=len(encounter_df)
+        
+        for column in half_width:
+            values=encounter_df[column].to_numpy(dtype=float)
+            totals[column]+=values.sum()
+            squares[column]+=(values**2).sum()
+        
+        intervals=confidence_intervals(num_sims,totals,squares,z)
+    
+    with _phase(run_profile,'write'):
+        writer.close()
+    
+    return num_sims,intervals
+
+def confidence_intervals(num_sims,totals,squares,z):
+    '''
+    function to get the centre and half-width of a confidence
+    interval for each column from running sums, a Wilson score
+    interval for the success rate, centred a little towards 0.5 from
+    the rate, and a normal interval centred on the mean otherwise
+    
+    Parameters
+    ----------
+    num_sims - int
+        number of simulations summed over
+    totals - dict
+        sum of the values of each column
+    squares - dict
+        sum of the squared values of each column
+    z - float
+        number of standard deviations for the confidence level
+    
+    Returns
+    -------
+    dict
+        (centre,half-width) for each column
+    '''
+    
+    intervals={}
+    
+    for column in totals:
+        mean=totals[column]/num_sims
+        
+        if column=='success':
+            #the Wilson interval stays sensible for rates near 0 or 1
+            centre=(mean+z**2/(2*num_sims))/(1+z**2/num_sims)
+            width=z*np.sqrt(mean*(1-mean)/num_sims+z**2/(4*num_sims**2))/\
+              (1+z**2/num_sims)
+            
+            intervals[column]=(float(centre),float(width))
+        
+        else:
+            variance=max(squares[column]/num_sims-mean**2,0)*\
+              num_sims/max(num_sims-1,1)
+            
+            intervals[column]=(float(mean),float(z*np.sqrt(variance/num_sims)))
+    
+    return intervals
+
+def _batch_tasks(first_sim,last_sim,batch_size):
+    '''
+    function to split a range of simulation indices into batches at
+    multiples of batch_size, first_sim must itself be a multiple of
+    batch_size, since a batch draws from the seed of its first
+    simulation, so only the last batch can be cut short
+    
+    Parameters
+    ----------
+    first_sim - int
+        index of the first simulation
+    last_sim - int
+        one past the index of the last simulation
+    batch_size - int
+        number of simulations in a full batch
+    
+    Returns
+    -------
+    list
+        list of (first,one past last) simulation index tuples
+    '''
+    
+    return [(start,min(start+batch_size,last_sim)) \
+            for start in range(first_sim,last_sim,batch_size)]
+
+def _range_tasks(tasks,first_sim,last_sim,batched):
+    '''
+    function to get worker tasks of ranges of simulation indices,
+    the batches themselves if batched, otherwise RANGE_TASK_SIZE
+    simulations, with the batched flag added to each
+    
+    Parameters
+    ----------
+    tasks - list
+        batch tasks, (first,one past last) simulation index tuples,
+        only used if batched is True
+    first_sim - int
+        index of the first simulation
+    last_sim - int
+        one past the index of the last simulation
+    batched - bool
+        flag to run the ranges with the BatchEncounter class
+    
+    Returns
+    -------
+    list
+        list of (first,one past last,batched) tuples
+    '''
+    
+    if not batched:
+        tasks=[(start,min(start+RANGE_TASK_SIZE,last_sim)) \
+               for start in range(first_sim,last_sim,RANGE_TASK_SIZE)]
+    
+    return [task+(batched,) for task in tasks]
+
+def _shared_records(num_sims,first_sim,count_events):
+    '''
+    function to create the shared array the workers write
+    results to with shared_memory
+    
+    Returns
+    -------
+    SharedRecords
+        the array, with one record per simulation
+    '''
+    
+    dtype=SUMMARY_DTYPE.descr
+    
+    if count_events:
+        dtype+=[(name,'int64') for name in EventCounter.EVENTS]
+    
+    return SharedRecords.create(num_sims,first_sim,dtype)
+
@@ -0,0 +1,268 @@
+#class to collect timing and throughput measurements of a run
+#of simulations, and functions for the JSON sidecar file written
+#next to a run's output file
+
+import json
+import os
+import pickle
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+class RunProfile():
+    '''
+    class to collect where the time goes in a run of simulations,
+    both in the parent process (reading the configuration, starting
+    the workers, building DataFrames, and writing the output) and in
+    the worker processes (building the party and enemy groups, running
+    the combat, and serializing the results sent back)
+
+    ...
+
+    Attributes
+    ----------
+    phases - dict
+        wall time, in seconds, of each parent process phase
+    result_bytes - int
+        total size of the pickled results sent back by the workers
+    start_time - float
+        time.perf_counter value when the profile was created
+    worker_phases - dict
+        time, in seconds, summed over workers, of each worker phase
+    workers - dict
+        dictionary with worker process ids as keys and dictionaries
+        with the number of tasks, number of simulations, and busy
+        time of that worker as values
+
+    Methods
+    -------
+    phase(name)
+        context manager adding the time spent inside it to a phase
+    record(pid,num_sims,timings)
+        method to add the measurements returned with a worker task
+    report(num_sims)
+        method to get the measurements as a dictionary
+    unwrap(results,count)
+        generator to record and strip the measurements sent back
+        with each worker result
+    '''
+
+    def __init__(self):
+        self.start_time=time.perf_counter()
+        self.phases={}
+        self.worker_phases={}
+        self.workers={}
+        self.result_bytes=0
+
+    @contextmanager
+    def phase(self,name):
+        '''
+        context manager adding the wall time spent inside it to
+        the named parent process phase
+
+        Parameters
+        ----------
+        name - str
+            name of the phase (e.g., 'write')
+        '''
+
+        start=time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            self.phases[name]=self.phases.get(name,0.)+\
+              time.perf_counter()-start
+
+    def record(self,pid,num_sims,timings):
+        '''
+        method to add the measurements sent back with a worker task
+
+        Parameters
+        ----------
+        pid - int
+            process id of the worker
+        num_sims - int
+            number of simulations in the task
+        timings - dict
+            time of each worker phase in the task, with 'busy' the
+            total and 'result_bytes' the size of the pickled result
+        '''
+
+        worker=self.workers.setdefault(pid,{'tasks':0,'sims':0,'busy':0.})
+
+        worker['tasks']+=1
+        worker['sims']+=num_sims
+        worker['busy']+=timings['busy']
+
+        self.result_bytes+=timings['result_bytes']
+
+        for name,value in timings.items():
+            if name not in ['busy','result_bytes']:
+                self.worker_phases[name]=self.worker_phases.get(name,0.)+value
+
+    def unwrap(self,results,count):
+        '''
+        generator to record the measurements sent back with each
+        worker result, see profiled, and pass on the result itself
+
+        Parameters
+        ----------
+        results - iterable
+            iterable of (result,pid,timings) tuples
+        count - function
+            function giving the number of simulations in a result
+
+        Yields
+        ------
+        object
+            the result (e.g., an Encounter summary dictionary)
+        '''
+
+        for result,pid,timings in results:
+            self.record(pid,count(result),timings)
+
+            yield result
+
+    def report(self,num_sims):
+        '''
+        method to get the measurements as a dictionary
+
+        Parameters
+        ----------
+        num_sims - int
+            number of simulations written
+
+        Returns
+        -------
+        dict
+            dictionary with keys
+              wall_time: seconds since the profile was created
+              battles_per_sec: num_sims divided by wall_time
+              phases: wall time of each parent process phase
+              worker_phases: time of each worker phase, summed
+                over workers
+              workers: per worker (by process id) number of tasks,
+                simulations, busy time, and utilisation, the busy
+                time as a fraction of the time the pool was running
+              result_bytes: total size of the pickled results
+              result_bytes_per_sim: result_bytes divided by num_sims
+        '''
+
+        wall_time=time.perf_counter()-self.start_time
+
+        #the workers could only be busy while the pool was running
+        pool_time=self.phases.get('simulate',wall_time)
+
+        return {'wall_time':wall_time,
+                'battles_per_sec':num_sims/wall_time if wall_time>0 else None,
+                'phases':dict(self.phases),
+                'worker_phases':dict(self.worker_phases),
+                'workers':{str(pid):dict(worker,
+                                         utilisation=worker['busy']/pool_time \
+                                           if pool_time>0 else None) \
+                           for pid,worker in self.workers.items()},
+                'result_bytes':self.result_bytes,
+                'result_bytes_per_sim':self.result_bytes/num_sims \
+                  if num_sims else None}
+
+def profiled(simulate,*args,**kwargs):
+    '''
+    function run in a worker process to call one of the simulate_*
+    functions with timing, passing it a timings dictionary to fill
+    in per phase, and measure the size of the pickled result
+
+    Parameters
+    ----------
+    simulate - function
+        function to call, must take a timings keyword argument
+    args, kwargs
+        arguments passed on to simulate
+
+    Returns
+    -------
+    dict
+        the result of simulate
+    int
+        process id of the worker
+    dict
+        time of each phase, with 'busy' the total time, 'pickle' the
+        time to pickle the result, and 'result_bytes' its size
+    '''
+
+    timings={}
+
+    start=time.perf_counter()
+
+    result=simulate(*args,timings=timings,**kwargs)
+
+    pickle_start=time.perf_counter()
+
+    timings['result_bytes']=len(pickle.dumps(result,
+                                             protocol=pickle.HIGHEST_PROTOCOL))
+
+    timings['pickle']=time.perf_counter()-pickle_start
+    timings['busy']=time.perf_counter()-start
+
+    return result,os.getpid(),timings
+
+def sidecar_path(output_file):
+    '''
+    function to get the name of the JSON sidecar file of an output
+    file, the output file name with '.json' added (e.g.,
+    'results.csv' -> 'results.csv.json')
+
+    Parameters
+    ----------
+    output_file - str or path-like
+        output file of a run
+
+    Returns
+    -------
+    pathlib.Path
+        the sidecar file
+    '''
+
+    output_file=Path(output_file)
+
+    return output_file.with_name(output_file.name+'.json')
+
+def write_sidecar(output_file,details):
+    '''
+    function to write details of a run to the JSON sidecar
+    file of its output file
+
+    Parameters
+    ----------
+    output_file - str or path-like
+        output file of the run
+    details - dict
+        details to save, must be JSON serializable
+    '''
+
+    with open(sidecar_path(output_file),'w') as sfile:
+        json.dump(details,sfile,indent=2)
+
+def read_sidecar(output_file):
+    '''
+    function to read the JSON sidecar file of an output file
+
+    Parameters
+    ----------
+    output_file - str or path-like
+        output file of a run
+
+    Returns
+    -------
+    dict or None-type
+        the details of the run, or None-type if there is no sidecar
+    '''
+
+    try:
+        with open(sidecar_path(output_file),'r') as sfile:
+            return json.load(sfile)
+
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,313 @@
+#class for a long-lived pool of worker processes running many
+#independent simulation jobs, so repeated short runs (e.g., from a
+#notebook or a service) do not start new workers every time
+
+import multiprocessing as mp
+import os
+
+from pathlib import Path
+
+import numpy as np
+
+from accumulators import (
+                    SummaryAccumulator,
+                    write_summary
+                    )
+
+from encounter_utils import load_configuration
+
+from encounter_worker import _simulate_job_range
+
+from run_encounters import (
+                    _batch_tasks,
+                    _run_details,
+                    RANGE_TASK_SIZE,
+                    ResultWriter,
+                    results_frame
+                    )
+
+from run_profile import write_sidecar
+
+class SimulationPool():
+    '''
+    class for a pool of worker processes kept running between
+    simulation jobs, any number of jobs with different configurations
+    share the workers at once and each gets the same results as
+    run_encounters.generate_encounter_results with the same settings,
+    use as a context manager so the workers are stopped at the end
+
+    ...
+
+    Attributes
+    ----------
+    configs - dict
+        configurations read from files, keyed by the resolved path
+        and modification time of the file, so each file is only
+        read once
+    num_jobs - int
+        number of worker processes
+    pool - multiprocessing.pool.Pool or None-type
+        the worker processes, None-type once stopped
+
+    Methods
+    -------
+    close()
+        method to stop the workers once their tasks are done
+    map(jobs)
+        method to run several jobs and get the results of each
+    run(encounter_config,num_sims,**settings)
+        method to run one job and get its results
+    terminate()
+        method to stop the workers straight away
+    '''
+
+    def __init__(self,NUM_JOBS=None,START_METHOD=None):
+        '''
+        Parameters
+        ----------
+        NUM_JOBS - int or None-type
+            number of worker processes, if None-type
+            one per CPU
+        START_METHOD - str or None-type
+            multiprocessing start method (e.g., 'spawn'), if
+            None-type the platform default is used
+        '''
+
+        self.num_jobs=NUM_JOBS if NUM_JOBS is not None else os.cpu_count() or 1
+        self.configs={}
+
+        self.pool=mp.get_context(START_METHOD).Pool(processes=self.num_jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        #after an error there is no point finishing the other tasks
+        if exc_type is None:
+            self.close()
+
+        else:
+            self.terminate()
+
+    def run(self,encounter_config,num_sims,**settings):
+        '''
+        method to run one job and get its results
+
+        Parameters
+        ----------
+        encounter_config - str, path-like, or dict
+            yaml configuration file, or the dictionary returned
+            by encounter_utils.load_configuration
+        num_sims - int
+            number of simulations to run
+        settings
+            other settings of the job, see map
+
+        Returns
+        -------
+        dict
+            details and results of the job, see map
+        '''
+
+        return self.map([dict(settings,encounter_config=encounter_config,
+                              num_sims=num_sims)])[0]
+
+    def map(self,jobs):
+        '''
+        method to run several jobs, the tasks of every job are handed
+        out together, so short jobs run side by side on the workers
+
+        Parameters
+        ----------
+        jobs - list
+            list of dictionaries, one per job, with the keys
+              encounter_config: yaml configuration file, or the
+                dictionary returned by encounter_utils.load_configuration
+              num_sims: number of simulations to run
+            and optionally any of
+              SEED, batch_size, rng_mode, first_sim, group_index,
+                count_events, summary_only: as for
+                run_encounters.generate_encounter_results
+              output_file: if given, the results are also written
+                to this file with a sidecar file of the run details,
+                as generate_encounter_results would write them
+
+        Returns
+        -------
+        list
+            list of dictionaries, one per job in the same order, with
+            keys
+              seed: the root seed entropy
+              first_sim: index of the first simulation
+              num_sims: number of simulations run
+              results: pandas.DataFrame with one row per simulated
+                encounter, if summary_only is not set
+              summary: SummaryAccumulator of the simulations, if
+                summary_only is set
+        '''
+
+        if self.pool is None:
+            raise ValueError('The SimulationPool has been stopped,\
+ make a new one to run more jobs')
+
+        jobs=[self._job(**job) for job in jobs]
+
+        #every task is a job index, a range of simulation
+        #indices, and the settings of the job
+        tasks=[(index,start,stop,job['settings']) \
+               for index,job in enumerate(jobs) for start,stop in job['ranges']]
+
+        pieces=[{} for job in jobs]
+
+        for index,start,results in self.pool.imap_unordered(\
+          _simulate_job_range,tasks):
+            pieces[index][start]=results
+
+        return [self._finish(job,[results[start] for start in sorted(results)]) \
+                for job,results in zip(jobs,pieces)]
+
+    def close(self):
+        '''
+        method to stop the workers once their tasks are done
+        '''
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+            self.pool=None
+
+    def terminate(self):
+        '''
+        method to stop the workers straight away
+        '''
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+            self.pool=None
+
+    def _job(self,encounter_config,num_sims,SEED=None,batch_size=None,
+             rng_mode='buffered',first_sim=0,group_index=None,
+             count_events=None,summary_only=False,output_file=None):
+        '''
+        method to check the settings of a job and split
+        it into ranges of simulation indices
+        '''
+
+        config=self._configuration(encounter_config)
+
+        if group_index is not None:
+            config=dict(config,group_index=group_index)
+
+        if count_events is not None:
+            config=dict(config,count_events=count_events)
+
+        if config.get('count_events') and batch_size is not None:
+            raise ValueError('count_events cannot be used with batch_size,\
+ the BatchEncounter class does not report individual events')
+
+        if batch_size is not None and first_sim%batch_size:
+            raise ValueError(f'first_sim = {first_sim} must be a multiple of\
+ batch_size = {batch_size}, a batch starting mid-way would not match the\
+ one in a single run')
+
+        #check the output format before any simulations are run,
+        #so one bad job does not throw away the work of the others
+        writer=None
+
+        if summary_only:
+            if output_file is not None and \
+              Path(output_file).suffix.lower()!='.json':
+                raise ValueError(f'With summary_only the output file must\
+ be a ".json" file, not "{Path(output_file).suffix}"')
+
+        elif output_file is not None:
+            writer=ResultWriter(output_file)
+
+        entropy=np.random.SeedSequence(SEED).entropy
+
+        last_sim=first_sim+num_sims
+
+        batched=batch_size is not None
+
+        if batched:
+            ranges=_batch_tasks(first_sim,last_sim,batch_size)
+
+        else:
+            #statistics are merged over the same ranges as
+            #generate_encounter_results, rows can be split finer
+            #so a short job still uses every worker
+            task_size=RANGE_TASK_SIZE if summary_only else \
+              max(1,min(RANGE_TASK_SIZE,-(-num_sims//self.num_jobs)))
+
+            ranges=[(start,min(start+task_size,last_sim)) \
+                    for start in range(first_sim,last_sim,task_size)]
+
+        return {'config':config,
+                'settings':(config,rng_mode,entropy,batched,summary_only),
+                'ranges':ranges,
+                'info':{'seed':entropy,
+                        'first_sim':first_sim,
+                        'num_sims':num_sims},
+                'batch_size':batch_size,
+                'rng_mode':rng_mode,
+                'output_file':output_file,
+                'writer':writer}
+
+    def _finish(self,job,results):
+        '''
+        method to combine the results of the ranges of a job,
+        in simulation order, and write them if asked
+        '''
+
+        info=dict(job['info'])
+        batched=job['batch_size'] is not None
+        summary_only=job['settings'][-1]
+        output_file=job['output_file']
+
+        if summary_only:
+            info['summary']=SummaryAccumulator()
+
+            for accumulator in results:
+                info['summary'].merge(accumulator)
+
+            if output_file is not None:
+                write_summary(output_file,info['summary'])
+
+        else:
+            info['results']=results_frame([result for piece in results \
+                                           for result in piece],batched)
+
+            if job['writer'] is not None:
+                job['writer'].write(info['results'])
+                job['writer'].close()
+
+        if output_file is not None:
+            details={key:value for key,value in info.items() \
+                     if key!='results'}
+
+            write_sidecar(output_file,_run_details(details,job['config'],
+                                                   self.num_jobs,
+                                                   job['batch_size'],None,
+                                                   job['rng_mode']))
+
+        return info
+
+    def _configuration(self,encounter_config):
+        '''
+        method to get a configuration dictionary, reading
+        a file only the first time it is used
+        '''
+
+        if isinstance(encounter_config,dict):
+            return encounter_config
+
+        path=Path(encounter_config).resolve()
+        key=(str(path),path.stat().st_mtime_ns)
+
+        if key not in self.configs:
+            self.configs[key]=load_configuration(path)
+
+        return self.configs[key]
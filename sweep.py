@@ -0,0 +1,315 @@
+#set of functions to run simulations over a grid of
+#encounter configurations, sharing one multiprocessing pool,
+#and save the combined results tagged by configuration
+
+import argparse
+import itertools
+import multiprocessing as mp
+
+import numpy as np
+
+from encounter_utils import (
+                    load_configuration,
+                    valid_difficulty
+                    )
+
+from run_encounters import (
+                    ResultWriter,
+                    results_frame,
+                    simulate_batch,
+                    simulate_encounter,
+                    simulation_seed
+                    )
+
+#configurations of the sweep cells, Encounter random draw mode,
+#and root seed entropy used by a worker process, set once per
+#worker by _init_sweep_worker
+_worker_configs=None
+_worker_rng_mode='buffered'
+_worker_entropy=None
+_worker_batched=False
+
+def expand_grid(base_config,ranges):
+    '''
+    function to expand ranges of configuration values into the
+    full grid of configurations
+
+    Parameters
+    ----------
+    base_config - dict
+        validated configuration, see encounter_utils.load_configuration,
+        giving the values of every field not in ranges
+    ranges - dict
+        dictionary with configuration field names (e.g., 'num_pcs',
+        'pcs_AC', 'difficulty') as keys and lists of values to
+        sweep over as values
+
+    Returns
+    -------
+    list
+        list of configuration dictionaries, one per grid cell, with
+        the last field in ranges changing fastest
+    '''
+
+    unknown=[field for field in ranges if field not in base_config]
+
+    if unknown:
+        raise ValueError(f'Cannot sweep over {unknown}, not fields of\
+ the encounter configuration')
+
+    cells=[]
+
+    for values in itertools.product(*ranges.values()):
+        config=dict(base_config)
+        config.update(zip(ranges.keys(),values))
+
+        #make sure a valid difficulty category is used
+        if config['difficulty'] is not None and \
+          not valid_difficulty(config['difficulty']):
+            raise ValueError(f'difficulty = {config["difficulty"]} is not\
+ valid, must be one of "easy", "medium", "hard", or "deadly".')
+
+        cells.append(config)
+
+    return cells
+
+def run_sweep(base_config,ranges,output_file,num_sims,num_jobs,SEED=None,
+              batch_size=None,rng_mode='buffered',task_size=1000):
+    '''
+    function to run num_sims simulations for every configuration in
+    a grid, scheduling all of them on one multiprocessing pool, and
+    write the combined results, tagged by configuration, to one file
+
+    Parameters
+    ----------
+    base_config - str, path-like, or dict
+        yaml configuration file, or dictionary returned by
+        encounter_utils.load_configuration, giving the values of
+        every field not being swept over
+    ranges - dict
+        dictionary with configuration field names as keys and lists
+        of values to sweep over as values, see expand_grid
+    output_file - str or path-like
+        output file, the format is chosen by the suffix, see
+        run_encounters.generate_encounter_results, every row gets a
+        'cell' column with the index of its grid cell and one column
+        per swept field with the value used
+    num_sims - int
+        number of simulations to run per grid cell
+    num_jobs - int
+        number of parallel jobs to run
+    SEED - int
+        optional root seed, simulation i of grid cell c always gets
+        run_encounters.simulation_seed(SEED,i,(c,)), if None-type
+        fresh entropy from the operating system is used and returned
+    batch_size - int or None-type
+        if specified, simulations are run with the vectorized
+        BatchEncounter class in batches of this many encounters,
+        replacing task_size
+    rng_mode - str
+        how the Encounter turn loop makes its random draws, see
+        run_encounters.generate_encounter_results
+    task_size - int
+        number of simulations of a cell handed to a worker at a time,
+        results are written as each of these finishes
+
+    Returns
+    -------
+    dict
+        details of the sweep, with keys
+          seed: the root seed entropy
+          num_cells: number of grid cells
+          num_sims: number of simulations per grid cell
+          fields: the swept field names
+    '''
+
+    if not isinstance(base_config,dict):
+        base_config=load_configuration(base_config)
+
+    cells=expand_grid(base_config,ranges)
+
+    writer=ResultWriter(output_file)
+
+    entropy=np.random.SeedSequence(SEED).entropy
+
+    task_size=task_size if batch_size is None else batch_size
+
+    #every task is a cell index and a range of simulation indices
+    tasks=[(cell,start,min(start+task_size,num_sims)) \
+           for cell in range(len(cells)) \
+           for start in range(0,num_sims,task_size)]
+
+    #one pool for the whole grid, the workers get every cell
+    #configuration once when they start
+    with mp.Pool(processes=num_jobs,initializer=_init_sweep_worker,
+                 initargs=(cells,rng_mode,entropy,batch_size is not None)) \
+      as pool:
+        for cell,results in pool.imap(_simulate_cell_range,tasks):
+            encounter_df=results_frame(results,batch_size is not None)
+
+            #tag the rows with the configuration they came from
+            encounter_df['cell']=cell
+
+            for field in ranges:
+                encounter_df[field]=_tag_value(cells[cell][field])
+
+            writer.write(encounter_df)
+
+    writer.close()
+
+    return {'seed':entropy,
+            'num_cells':len(cells),
+            'num_sims':num_sims,
+            'fields':list(ranges)}
+
+def _tag_value(value):
+    '''
+    function to turn a configuration value into something that
+    fits in a single results column, lists become strings
+    '''
+
+    if isinstance(value,(list,tuple)):
+        return '_'.join(str(item) for item in value)
+
+    return value
+
+def _init_sweep_worker(configs,rng_mode,entropy,batched):
+    '''
+    function run once when each worker process starts, storing
+    the sweep cell configurations
+
+    Parameters
+    ----------
+    configs - list
+        configuration dictionaries, one per grid cell
+    rng_mode - str
+        Encounter RNG_MODE, either 'buffered' or 'exact'
+    entropy - int
+        root seed entropy of the sweep
+    batched - bool
+        flag to run simulations with simulate_batch
+    '''
+
+    global _worker_configs,_worker_rng_mode,_worker_entropy,_worker_batched
+
+    _worker_configs=configs
+    _worker_rng_mode=rng_mode
+    _worker_entropy=entropy
+    _worker_batched=batched
+
+def _simulate_cell_range(task):
+    '''
+    function run by a worker process to simulate a range of
+    simulation indices of one grid cell
+
+    Parameters
+    ----------
+    task - tuple
+        cell index, first simulation index, and one past the
+        last simulation index
+
+    Returns
+    -------
+    int
+        the cell index
+    list
+        list of Encounter summary dictionaries, or a single
+        BatchEncounter summary dictionary if running batches
+    '''
+
+    cell,start,stop=task
+
+    config=_worker_configs[cell]
+
+    seeds=[simulation_seed(_worker_entropy,sim_index,(cell,)) \
+           for sim_index in range(start,stop)]
+
+    if _worker_batched:
+        return cell,[simulate_batch(seeds,config=config)]
+
+    return cell,[simulate_encounter(seed,config=config,
+                                    rng_mode=_worker_rng_mode) \
+                 for seed in seeds]
+
+def parse_range(text):
+    '''
+    function to turn a command line range into a list of values,
+    either comma separated values (e.g., '3,4,5' or 'easy,hard')
+    or an inclusive numeric range start:stop:step (e.g., '3:6:1')
+
+    Parameters
+    ----------
+    text - str
+        the range to parse
+
+    Returns
+    -------
+    list
+        the values, each parsed as yaml so numbers become numbers
+    '''
+
+    #only the command line needs yaml, not the sweep workers
+    import yaml
+
+    if ':' in text and ',' not in text:
+        start,stop,*step=[yaml.safe_load(part) for part in text.split(':')]
+        step=step[0] if step else 1
+
+        #include the stop value, keeping integers as integers
+        if all(isinstance(value,int) for value in [start,stop,step]):
+            return list(range(start,stop+1,step))
+
+        #allow for float round-off
+        return np.arange(start,stop+step/2,step).tolist()
+
+    return [yaml.safe_load(part) for part in text.split(',')]
+
+def main(args=None):
+    '''
+    function to run a sweep from the command line, e.g.,
+
+    python sweep.py easy_battle.yml sweep.npz --num-sims 1000\
+ --num-jobs 6 --seed 0 --vary num_pcs=3:6 --vary difficulty=easy,hard
+
+    Parameters
+    ----------
+    args - list or None-type
+        command line arguments, if None-type sys.argv is used
+    '''
+
+    parser=argparse.ArgumentParser(description='Run simulations over a grid\
+ of encounter configurations')
+
+    parser.add_argument('base_config',help='yaml configuration giving the\
+ values of fields not being varied')
+    parser.add_argument('output_file',help='combined output file, format\
+ chosen by the suffix (.csv, .npz, .parquet, .feather)')
+    parser.add_argument('--vary',action='append',default=[],
+                        metavar='FIELD=VALUES',help='field to sweep over, with\
+ comma separated values or an inclusive start:stop:step range, can be repeated')
+    parser.add_argument('--num-sims',type=int,default=1000,
+                        help='number of simulations per grid cell')
+    parser.add_argument('--num-jobs',type=int,default=1,
+                        help='number of parallel jobs')
+    parser.add_argument('--seed',type=int,default=None,help='root seed')
+    parser.add_argument('--batch-size',type=int,default=None,
+                        help='run batches of this many encounters with\
+ BatchEncounter')
+
+    parsed=parser.parse_args(args)
+
+    ranges={}
+
+    for vary in parsed.vary:
+        field,_,values=vary.partition('=')
+        ranges[field]=parse_range(values)
+
+    info=run_sweep(parsed.base_config,ranges,parsed.output_file,
+                   parsed.num_sims,parsed.num_jobs,SEED=parsed.seed,
+                   batch_size=parsed.batch_size)
+
+    print(f'Ran {info["num_sims"]} simulations for each of\
+ {info["num_cells"]} configurations, seed = {info["seed"]}')
+
+if __name__=='__main__':
+    main()